@@ -0,0 +1,296 @@
+import asyncio
+import base64
+import copy
+import socket
+import ssl
+import sys
+import time
+import urllib.parse as urlparse
+
+import pycurl
+
+from . import parsing
+from .transports import Transport, TransportResponse
+from .tests import DEFAULT_TIMEOUT
+
+"""
+Pure-python HTTP/1.1 transport on an asyncio event loop, Python 3.5.3+ only
+One event loop can hold thousands of requests in flight, without a curl handle for each
+
+Supports the same request options as tests (method, headers, body, basic auth), but not custom curl options
+Timing metrics are measured by python around each step and match the libcurl ones:
+- namelookup_time, connect_time, appconnect_time (TLS), pretransfer_time, starttransfer_time, total_time
+- For HTTPS, the TCP connect and TLS handshake are timed together, so connect_time == appconnect_time
+"""
+
+DEFAULT_PORTS = {u'http': 80, u'https': 443}
+
+# Statuses that never have a response body
+NO_BODY_STATUSES = set([204, 304])
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class PreparedRequest(object):
+    """ Bytes to send for one request, and where to send them """
+    scheme = None
+    host = None
+    port = None
+    method = None
+    head = None  # Request line and headers, as bytes
+    body = None  # Body bytes, or None
+
+
+def prepare_request(templated_test, context=None, connection_reuse=False):
+    """ Build a PreparedRequest for a templated test, following what Test.configure_curl sends """
+    if templated_test.curl_options:
+        raise ValueError("asyncio transport does not support curl_option settings")
+    url = urlparse.urlsplit(str(templated_test.url))
+    scheme = url.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        raise ValueError("asyncio transport does not support URL scheme: " + scheme)
+
+    request = PreparedRequest()
+    request.scheme = scheme
+    request.host = url.hostname
+    request.port = url.port or DEFAULT_PORTS[scheme]
+    request.method = (templated_test.method or u'GET').upper()
+    path = url.path or '/'
+    if url.query:
+        path = path + '?' + url.query
+
+    body, is_unicoded = templated_test.encode_body()
+    if request.method in (u'GET', u'HEAD'):
+        body = None
+    elif body is None and request.method in (u'POST', u'PUT'):
+        body = b''  # Required for some servers
+    request.body = body
+
+    head = copy.copy(templated_test.get_headers(context=context))
+    lower_names = set([name.lower() for name in head.keys()])
+    if is_unicoded and u'content-type' in head.keys():
+        content = head[u'content-type']
+        if u'charset' not in content:
+            head[u'content-type'] = content + u' ; charset=UTF-8'
+
+    lines = [u'{0} {1} HTTP/1.1'.format(request.method, path)]
+    if u'host' not in lower_names:
+        lines.append(u'Host: ' + url.netloc.rsplit('@', 1)[-1])
+    if u'accept' not in lower_names:  # Like curl, which only adds it if the test doesn't set one
+        lines.append(u'Accept: */*')
+    if body is not None and u'content-length' not in lower_names:
+        lines.append(u'Content-Length: ' + str(len(body)))
+    if templated_test.auth_username and templated_test.auth_password:
+        if templated_test.auth_type not in (None, pycurl.HTTPAUTH_BASIC):
+            raise ValueError("asyncio transport only supports basic authentication")
+        credentials = (parsing.encode_unicode_bytes(templated_test.auth_username) + b':' +
+                       parsing.encode_unicode_bytes(templated_test.auth_password))
+        lines.append(u'Authorization: Basic ' + base64.b64encode(credentials).decode('ascii'))
+    if not connection_reuse and u'connection' not in lower_names:
+        lines.append(u'Connection: close')
+    for name, value in head.items():
+        lines.append(str(name) + u': ' + str(value))
+    request.head = (u'\r\n'.join(lines) + u'\r\n\r\n').encode('ISO-8859-1')
+    return request
+
+
+class AsyncioTransport(Transport):
+    """ Runs requests as tasks on a private asyncio event loop, which runs while in wait() """
+
+    name = u'asyncio'
+    connection_reuse = False
+    loop = None
+    tasks = None  # Maps task to key
+    completed = None  # (key, response) for requests that failed before starting
+    idle = None  # Maps (scheme, host, port) to list of open (reader, writer) connections
+    ssl_context = None
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, ssl_insecure=False, verbose=False, connection_reuse=False):
+        super(AsyncioTransport, self).__init__(timeout=timeout, ssl_insecure=ssl_insecure, verbose=verbose)
+        self.connection_reuse = connection_reuse
+        self.loop = asyncio.new_event_loop()
+        self.tasks = dict()
+        self.completed = list()
+        self.idle = dict()
+
+    def get_ssl_context(self):
+        """ SSL context for HTTPS connections, created on first use because loading certificates is slow """
+        if self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+            if self.ssl_insecure:
+                self.ssl_context.check_hostname = False
+                self.ssl_context.verify_mode = ssl.CERT_NONE
+        return self.ssl_context
+
+    def start(self, templated_test, context=None, key=None, metrics=None, collect_body=True):
+        try:
+            request = prepare_request(templated_test, context=context,
+                                      connection_reuse=self.connection_reuse)
+        except Exception as e:
+            response = TransportResponse()
+            response.error = e
+            self.completed.append((key, response))
+            return
+        task = self.loop.create_task(self.fetch(request, collect_body))
+        self.tasks[task] = key
+
+    def wait(self, max_wait=1.0):
+        if self.completed:
+            output = self.completed
+            self.completed = list()
+            return output
+        if not self.tasks:
+            return list()
+        done, pending = self.loop.run_until_complete(asyncio.wait(
+            list(self.tasks.keys()), timeout=max_wait, return_when=asyncio.FIRST_COMPLETED))
+        return [(self.tasks.pop(task), task.result()) for task in done]
+
+    def in_flight(self):
+        return len(self.tasks) + len(self.completed)
+
+    def close(self):
+        for task in self.tasks.keys():
+            task.cancel()
+        if self.tasks:
+            self.loop.run_until_complete(asyncio.wait(list(self.tasks.keys())))
+        self.tasks = dict()
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self.idle = dict()
+        self.loop.close()
+
+    async def fetch(self, request, collect_body=True):
+        """ Run request, never raises: errors are returned in the TransportResponse """
+        response = TransportResponse()
+        try:
+            await asyncio.wait_for(self.exchange_retrying(request, response, collect_body), self.timeout)
+        except asyncio.TimeoutError:
+            response.error = socket.timeout(
+                "Operation timed out after {0} seconds".format(self.timeout))
+        except Exception as e:
+            response.error = e
+        return response
+
+    async def exchange_retrying(self, request, response, collect_body):
+        """ Run exchange, retrying once on a new connection if a reused one was closed by the server """
+        try:
+            await self.exchange(request, response, collect_body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if response.metrics.get(u'num_connects') != 0 or u'starttransfer_time' in response.metrics:
+                raise
+            response.metrics = dict()
+            await self.exchange(request, response, collect_body, reuse=False)
+
+    async def connect(self, request, metrics, start, reuse=True):
+        """ Get a connection for the request, reusing an idle one if possible
+            Returns (reader, writer), recording namelookup, connect and appconnect times """
+        host_key = (request.scheme, request.host, request.port)
+        connections = self.idle.get(host_key)
+        while reuse and connections:
+            reader, writer = connections.pop()
+            if not reader.at_eof() and not writer.transport.is_closing():
+                metrics[u'num_connects'] = 0
+                metrics[u'namelookup_time'] = metrics[u'connect_time'] = metrics[u'appconnect_time'] = 0.0
+                return reader, writer
+            writer.close()
+
+        addresses = await self.loop.getaddrinfo(request.host, request.port, type=socket.SOCK_STREAM)
+        metrics[u'namelookup_time'] = timer() - start
+        family, socktype, proto, canonname, address = addresses[0]
+        ssl_context = None
+        server_hostname = None
+        if request.scheme == u'https':
+            ssl_context = self.get_ssl_context()
+            server_hostname = request.host
+        reader, writer = await asyncio.open_connection(
+            address[0], address[1], ssl=ssl_context, server_hostname=server_hostname)
+        metrics[u'connect_time'] = timer() - start
+        metrics[u'appconnect_time'] = metrics[u'connect_time'] if ssl_context else 0.0
+        metrics[u'num_connects'] = 1
+        return reader, writer
+
+    async def exchange(self, request, response, collect_body, reuse=True):
+        """ Send request and read the response into response """
+        start = timer()
+        metrics = response.metrics
+        reader, writer = await self.connect(request, metrics, start, reuse=reuse)
+        metrics[u'pretransfer_time'] = timer() - start
+        try:
+            reusable = await self.transfer(request, response, collect_body, reader, writer, start)
+        except BaseException:  # Including cancellation on timeout
+            writer.close()
+            raise
+        if self.connection_reuse and reusable:
+            self.idle.setdefault((request.scheme, request.host, request.port), list()).append((reader, writer))
+        else:
+            writer.close()
+
+    async def transfer(self, request, response, collect_body, reader, writer, start):
+        """ Send request on a connection and read the response
+            Returns True if the connection can be used for another request """
+        metrics = response.metrics
+        if self.verbose:
+            sys.stderr.write(request.head.decode('ISO-8859-1'))
+        writer.write(request.head)
+        if request.body:
+            writer.write(request.body)
+        await writer.drain()
+
+        # Read status line and headers, skipping informational (1xx) responses
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            if u'starttransfer_time' not in metrics:
+                metrics[u'starttransfer_time'] = timer() - start
+            status_line = head.split(b'\r\n', 1)[0].split(None, 2)
+            response_code = int(status_line[1])
+            if response_code >= 200 or response_code == 101:
+                break
+        if self.verbose:
+            sys.stderr.write(head.decode('ISO-8859-1'))
+
+        headers = dict()
+        for line in head.split(b'\r\n')[1:]:
+            if b':' in line:
+                name, value = line.split(b':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        # Read body, delimited by chunked encoding, length, or end of connection
+        reusable = (status_line[0] == b'HTTP/1.1' and
+                    headers.get(b'connection', b'').lower() != b'close')
+        if request.method == u'HEAD' or response_code in NO_BODY_STATUSES or response_code < 200:
+            body = b''
+        elif b'chunked' in headers.get(b'transfer-encoding', b'').lower():
+            chunks = list()
+            while True:
+                size_line = await reader.readuntil(b'\r\n')
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readuntil(b'\r\n')) != b'\r\n':
+                        pass  # Skip trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif b'content-length' in headers:
+            body = await reader.readexactly(int(headers[b'content-length']))
+        else:
+            body = await reader.read()
+            reusable = False
+
+        total_time = timer() - start
+
+        response.response_code = response_code
+        if collect_body:
+            response.headers = head
+            response.body = body
+        size_upload = len(request.body or b'')
+        metrics[u'total_time'] = total_time
+        metrics[u'size_download'] = len(body)
+        metrics[u'size_upload'] = size_upload
+        metrics[u'request_size'] = len(request.head) + size_upload
+        metrics[u'speed_download'] = len(body) / total_time if total_time > 0 else 0.0
+        metrics[u'speed_upload'] = size_upload / total_time if total_time > 0 else 0.0
+        metrics[u'redirect_count'] = 0
+        metrics[u'redirect_time'] = 0.0
+        return reusable
@@ -0,0 +1,150 @@
+import math
+import json
+import logging
+
+from . import six
+from .six import text_type
+
+"""
+Compare benchmark results to a baseline: a previous result written by the JSON output format
+- Each aggregate is compared to the same one in the baseline, as a relative change
+- A change worse than the regression threshold is a regression, if it is statistically significant:
+  when both results have raw samples for the metric, a one-sided Mann-Whitney U test must agree
+"""
+
+logger = logging.getLogger('pyresttest.baseline')
+
+DEFAULT_REGRESSION_THRESHOLD = 0.10  # Relative change in an aggregate that counts as a regression
+DEFAULT_SIGNIFICANCE = 0.05  # p-value below which a change is significant
+
+# Metrics where bigger values are better, for all others an increase is a regression
+HIGHER_IS_BETTER = set(['speed_download', 'speed_upload'])
+
+
+class Comparison(object):
+    """ Comparison of one aggregate to its baseline value """
+    metricname = None
+    aggregate = None
+    baseline = None  # Baseline value
+    value = None  # Current value
+    change = None  # Relative change from the baseline, (value - baseline) / baseline
+    p_value = None  # Mann-Whitney p-value for a regression, None without raw samples for both
+    regressed = False
+
+    def __init__(self, metricname, aggregate, baseline, value):
+        self.metricname = metricname
+        self.aggregate = aggregate
+        self.baseline = baseline
+        self.value = value
+
+    def to_tuple(self):
+        return (self.metricname, self.aggregate, self.baseline, self.value, self.change, self.p_value, self.regressed)
+
+
+def parse_threshold(value):
+    """ Parse a relative threshold, as a fraction (0.1) or percentage ('10%') """
+    if isinstance(value, six.string_types) and value.strip().endswith(u'%'):
+        threshold = float(value.strip()[:-1]) / 100.0
+    else:
+        threshold = float(value)
+    if threshold < 0:
+        raise ValueError("Regression threshold must be >= 0")
+    return threshold
+
+
+def mann_whitney_p(current, baseline):
+    """ One-sided Mann-Whitney U test that values in current tend to be larger than in baseline
+        Returns the p-value, with normal approximation and tie correction, or None if either is empty """
+    n1 = len(current)
+    n2 = len(baseline)
+    if not n1 or not n2:
+        return None
+    combined = sorted([(value, 0) for value in current] + [(value, 1) for value in baseline])
+
+    # Average ranks for ties
+    rank_sum = 0.0
+    tie_correction = 0.0
+    index = 0
+    total = n1 + n2
+    while index < total:
+        end = index
+        while end + 1 < total and combined[end + 1][0] == combined[index][0]:
+            end = end + 1
+        ties = end - index + 1
+        rank = (index + end) / 2.0 + 1
+        rank_sum = rank_sum + rank * sum([1 for i in range(index, end + 1) if combined[i][1] == 0])
+        tie_correction = tie_correction + (ties ** 3 - ties)
+        index = end + 1
+
+    u = rank_sum - n1 * (n1 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    variance = n1 * n2 / 12.0 * ((total + 1) - tie_correction / float(total * (total - 1) or 1))
+    if variance <= 0:  # All values equal
+        return 1.0
+    z = (u - mean - 0.5) / math.sqrt(variance)  # With continuity correction
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def load_baseline(path, name=None):
+    """ Load a baseline benchmark result from a JSON file, as a map
+        The file may hold one result or a list of them, if a list the one with the given name is used
+        Returns None if there is no result with the name, even if the file holds just one result,
+        so a benchmark is never compared to another benchmark's results """
+    with open(path, 'r') as baseline_file:
+        results = json.load(baseline_file)
+    if isinstance(results, dict):
+        results = [results]
+    for result in results:
+        if name is None or result.get(u'name') == name:
+            return result
+    return None
+
+
+def raw_samples(results, metricname):
+    """ Raw samples for a metric from a results map, or None if not plain numbers (ex: histogram buckets) """
+    samples = (results or {}).get(metricname)
+    if not samples or isinstance(samples[0], (list, tuple)):
+        return None
+    return samples
+
+
+def compare_to_baseline(benchmark_result, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD,
+                        significance=DEFAULT_SIGNIFICANCE):
+    """ Compare aggregates of an analyzed BenchmarkResult to those in a baseline result map
+        Returns a list of Comparison, for each aggregate found in both """
+    baseline_values = dict()
+    for metricname, aggregate, value in baseline.get(u'aggregates', []):
+        baseline_values[(metricname, aggregate)] = value
+
+    comparisons = list()
+    p_values = dict()  # p-value by metric, only computed once
+    for metricname, aggregate, value in benchmark_result.aggregates:
+        baseline_value = baseline_values.get((text_type(metricname), text_type(aggregate)))
+        if baseline_value is None or value is None:
+            continue
+        comparison = Comparison(metricname, aggregate, baseline_value, value)
+        if baseline_value != 0:
+            comparison.change = (value - baseline_value) / float(abs(baseline_value))
+        elif value != 0:
+            comparison.change = float('inf') if value > 0 else float('-inf')
+        else:
+            comparison.change = 0.0
+        worse = comparison.change
+        if metricname in HIGHER_IS_BETTER:
+            worse = -worse
+
+        if worse > threshold:
+            if metricname not in p_values:
+                current = raw_samples(benchmark_result.results, metricname)
+                previous = raw_samples(baseline.get(u'results'), metricname)
+                p_value = None
+                if current is not None and previous is not None:
+                    if metricname in HIGHER_IS_BETTER:
+                        p_value = mann_whitney_p(previous, current)
+                    else:
+                        p_value = mann_whitney_p(current, previous)
+                p_values[metricname] = p_value
+            comparison.p_value = p_values[metricname]
+            comparison.regressed = comparison.p_value is None or comparison.p_value < significance
+        comparisons.append(comparison)
+    return comparisons
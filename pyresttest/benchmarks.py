@@ -1,22 +1,34 @@
 import math
 import json
+import operator
 import pycurl
 import sys
+import time
+from array import array as ArrayType
 
 from . import tests
 from .tests import Test
 from . import parsing
 from .parsing import *
+from . import histogram
+from .histogram import Histogram
+from . import baseline
 
 # Python 2/3 switches
 if sys.version_info[0] > 2:
     from past.builtins import basestring
+    from builtins import range as xrange
 
 # Python 3 compatibility shims
 from . import six
 from .six import binary_type
 from .six import text_type
 
+try:  # Optional, makes aggregates over large benchmarks much faster
+    import numpy
+except ImportError:
+    numpy = None
+
 """
 Encapsulates logic related to benchmarking
 - Parameters and fields for benchmarks
@@ -73,28 +85,328 @@ METRICS = {
     'num_connects': pycurl.NUM_CONNECTS
 }
 
+# Metrics curl reports as integers, which are stored as integers so raw output keeps them that way
+INTEGER_METRICS = set(['request_size', 'redirect_count', 'num_connects'])
+
+# Metrics measured by pyresttest itself for each request, rather than read from curl
+CLIENT_METRICS = set([
+    # Time between when a request was scheduled to start and when it was started,
+    # nonzero when an open-loop (rate) benchmark falls behind its schedule
+    'schedule_lag',
+
+    # Latency measured from the intended start time: schedule_lag + total_time
+    # This corrects for coordinated omission in open-loop benchmarks
+    'response_time',
+
+    # Time pyresttest spends preparing each request, before it is sent (see CLIENT_PHASE_METRICS)
+    'context_time', 'template_time', 'configure_time',
+
+    # Total of the above: all client overhead for a request
+    'client_prepare_time'
+])
+
+# Phases of preparing a request, in the order of client_times passed to MetricCollector:
+# updating the context (generators, variable binds), templating the test (realize),
+# and configuring curl (or starting the request on a transport)
+CLIENT_PHASE_METRICS = ('context_time', 'template_time', 'configure_time')
+
+# Time spent in each phase of a request, derived from the curl timings, which are all cumulative from the start
+# Maps name to (end metric, start metric), the phase takes end - start (or never less than 0)
+DERIVED_METRICS = {
+    'dns_time': ('namelookup_time', None),  # Name resolution
+    'tcp_time': ('connect_time', 'namelookup_time'),  # TCP connect
+    'tls_time': ('appconnect_time', 'connect_time'),  # TLS handshake, 0 without TLS (appconnect_time is 0)
+    'server_time': ('starttransfer_time', 'pretransfer_time'),  # From sending the request to the first byte back
+    'transfer_time': ('total_time', 'starttransfer_time')  # Receiving the response, after the first byte
+}
+
+# Percentile aggregates, name to percent
+PERCENTILES = {
+    'p50': 50,  # Same as the median
+    'p90': 90,
+    'p95': 95,
+    'p99': 99,
+    'p999': 99.9
+}
+
 # Map statistical aggregate to the function to use to perform the
 # aggregation on an array
 AGGREGATES = {
     'mean_arithmetic':  # AKA the average, good for many things
-    lambda x: float(sum(x)) / float(len(x)),
+    lambda x: mean(x),
     'mean':  # Alias for arithmetic mean
-    lambda x: float(sum(x)) / float(len(x)),
+    lambda x: mean(x),
     'mean_harmonic':  # Harmonic mean, better predicts average of rates: http://en.wikipedia.org/wiki/Harmonic_mean
-    lambda x: 1.0 / (sum([1.0 / float(y) for y in x]) / float(len(x))),
+    lambda x: mean_harmonic(x),
     'median': lambda x: median(x),
     'std_deviation': lambda x: std_deviation(x),
-    'sum': lambda x: sum(x),
-    'total': lambda x: sum(x)
+    'sum': lambda x: total(x),
+    'total': lambda x: total(x),
+    'min': lambda x: minimum(x),
+    'max': lambda x: maximum(x),
+    'iqr':  # Interquartile range, p75 - p25, a measure of spread that ignores outliers
+    lambda x: interquartile_range(x),
+    'p50': lambda x: percentile(x, PERCENTILES['p50']),
+    'p90': lambda x: percentile(x, PERCENTILES['p90']),
+    'p95': lambda x: percentile(x, PERCENTILES['p95']),
+    'p99': lambda x: percentile(x, PERCENTILES['p99']),
+    'p999': lambda x: percentile(x, PERCENTILES['p999'])
 }
 
+# Aggregates that sort the numbers, if numpy is not available
+ORDER_AGGREGATES = set(['median', 'iqr']).union(PERCENTILES.keys())
+
 OUTPUT_FORMATS = [u'csv', u'json']
 
+# Formats for interval output while a benchmark runs: JSON lines or CSV rows, see intervals module
+INTERVAL_FORMATS = [u'json', u'csv']
+DEFAULT_INTERVAL = 1.0  # Seconds in each interval
+
+# How metric values are stored: every value in a list, or counted in a constant-memory Histogram
+METRIC_STORAGE = [u'list', u'histogram']
+
+# Suffixes allowed for durations, and their length in seconds
+DURATION_UNITS = {u'ms': 0.001, u's': 1, u'm': 60, u'h': 3600}
+
+# Aggregates that target_precision can compute a confidence interval for
+PRECISION_AGGREGATES = [u'mean', u'median']
+MIN_PRECISION_SAMPLES = 10  # Fewest samples to compute a confidence interval from
+MIN_PRECISION_CHECK_INTERVAL = 10  # Fewest new samples between checks of a precision target
+
+# Automatic warmup detection, with the MSER-5 rule on the series of each request's total_time
+WARMUP_METRIC = u'total_time'
+WARMUP_BATCH_SIZE = 5  # Requests averaged into each batch
+MIN_WARMUP_BATCHES = 10  # Fewest batches to look for a warmup period in
+
+# Values of a whole benchmark run that thresholds can be set on, besides aggregates of metrics
+# error_rate is the fraction of requests that failed
+RUN_THRESHOLDS = [u'error_rate', u'throughput', u'failures', u'count', u'elapsed']
+
+# Comparisons allowed in a threshold, ex: '<0.250', longest first for parsing
+THRESHOLD_OPERATORS = [(u'<=', operator.le), (u'>=', operator.ge), (u'<', operator.lt), (u'>', operator.gt)]
+
+# Best clock available for measuring intervals
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def parse_duration(value):
+    """ Parse a duration in seconds, from a number or string with unit suffix, ex: '500ms', '30s', '5m' """
+    if isinstance(value, basestring):
+        value = value.strip().lower()
+        for unit in sorted(DURATION_UNITS.keys(), key=len, reverse=True):
+            if value.endswith(unit) and value[:-len(unit)].strip():
+                return float(value[:-len(unit)]) * DURATION_UNITS[unit]
+    return float(value)
+
+
+class Stage(object):
+    """ One stage of a staged load profile: requests start at a rate that goes
+        linearly from rate_from to rate_to (requests/second) over duration seconds.
+        A stage with the same start and end rates holds a constant rate """
+    name = None
+    duration = None
+    rate_from = None
+    rate_to = None
+
+    def __init__(self, duration, rate_from, rate_to=None, name=None):
+        self.duration = duration
+        self.rate_from = rate_from
+        self.rate_to = rate_from if rate_to is None else rate_to
+        self.name = name
+
+    def request_count(self):
+        """ Number of requests started during the stage """
+        return int((self.rate_from + self.rate_to) * 0.5 * self.duration + 1e-9)
+
+    def start_times(self):
+        """ Generator of start times for requests, as seconds from the start of the stage """
+        slope = (self.rate_to - self.rate_from) / float(self.duration)
+        for k in xrange(0, self.request_count()):
+            # Solve for t where requests started by time t equals k:
+            #   rate_from * t + slope * t^2 / 2 = k
+            if slope == 0:
+                yield k / float(self.rate_from)
+            else:
+                yield (math.sqrt(self.rate_from * self.rate_from + 2 * slope * k) - self.rate_from) / slope
+
+    @staticmethod
+    def parse(node, index=0):
+        """ Parse a stage from config, either {duration, rate} or {duration, from, to} plus optional name """
+        node = lowercase_keys(flatten_dictionaries(node))
+        if not isinstance(node, dict) or u'duration' not in node:
+            raise ValueError("Benchmark stage must be a map with a duration, and a rate or from/to rates")
+        duration = parse_duration(node[u'duration'])
+        if duration <= 0:
+            raise ValueError("Benchmark stage duration must be > 0 seconds")
+        if u'rate' in node:
+            rate_from = rate_to = float(node[u'rate'])
+        elif u'from' in node and u'to' in node:
+            rate_from = float(node[u'from'])
+            rate_to = float(node[u'to'])
+        else:
+            raise ValueError("Benchmark stage needs a rate, or from and to rates")
+        if rate_from < 0 or rate_to < 0 or rate_from + rate_to <= 0:
+            raise ValueError("Benchmark stage rates must be >= 0, and not both 0")
+        name = node.get(u'name')
+        if name is None:
+            name = u'stage ' + text_type(index + 1)
+        return Stage(duration, rate_from, rate_to, name=text_type(name))
+
+
+def to_numpy(array):
+    """ Numbers as a numpy float array, for an array('d') this is a view of it, without copying """
+    if isinstance(array, ArrayType) and array.typecode == 'd':
+        return numpy.frombuffer(array, dtype=numpy.float64)
+    return numpy.asarray(array, dtype=numpy.float64)
+
+
+def select_stage(array, stages, index):
+    """ Values for requests in one stage, where stages holds the stage index of each request """
+    if numpy is not None:
+        return to_numpy(array)[numpy.asarray(stages) == index]
+    return [array[i] for i in xrange(0, len(stages)) if stages[i] == index]
+
+
+def derive_metric(metricname, results):
+    """ Values of a metric from DERIVED_METRICS, from arrays of the metrics it is derived from in results
+        (map of metric name to values), computed for all requests at once. Returns an array('d') """
+    end, start = DERIVED_METRICS[metricname]
+    if start is None:
+        return ArrayType('d', results[end])
+    if numpy is not None:
+        values = numpy.maximum(to_numpy(results[end]) - to_numpy(results[start]), 0.0)
+        output = ArrayType('d')
+        if hasattr(output, 'frombytes'):
+            output.frombytes(values.tobytes())
+        else:  # Python 2
+            output.fromstring(values.tostring())
+        return output
+    return ArrayType('d', [max(end_value - start_value, 0.0)
+                           for end_value, start_value in zip(results[end], results[start])])
+
+
+def derive_metrics(results, metricnames):
+    """ Copy of results (map of metric name to values) adding the derived metrics in metricnames, if not present
+        With histogram storage, derived metrics are already present, see MetricCollector """
+    missing = [name for name in metricnames if name in DERIVED_METRICS and name not in results]
+    if not missing:
+        return results
+    output = dict(results)
+    for metricname in missing:
+        output[metricname] = derive_metric(metricname, results)
+    return output
+
+
+def mser_truncation(values, batch_size=WARMUP_BATCH_SIZE):
+    """ Find where the warmup period of a series ends, by the MSER rule (Marginal Standard Error Rule)
+        Values are averaged in batches, and the series is cut at the batch that minimizes the
+        squared standard error of the mean of the remaining batches, looking only in the first half
+        Returns the count of values to drop from the start, 0 if the series is too short """
+    batches = len(values) // batch_size
+    if batches < MIN_WARMUP_BATCHES:
+        return 0
+    means = [float(sum(values[i * batch_size:(i + 1) * batch_size])) / batch_size for i in xrange(0, batches)]
+
+    # Sums and sums of squares of batch means from each batch to the end, computed backwards
+    best_cut = 0
+    best_error = None
+    total = 0.0
+    squares = 0.0
+    for index in xrange(batches - 1, -1, -1):
+        total = total + means[index]
+        squares = squares + means[index] * means[index]
+        remaining = batches - index
+        if index <= batches // 2:
+            error = (squares - total * total / remaining) / (remaining * remaining)
+            if best_error is None or error <= best_error:
+                best_cut = index
+                best_error = error
+    return best_cut * batch_size
+
+
+def numpy_number(array, value):
+    """ A numpy result for an array as a python number: an int for a compact array of integers
+        (INTEGER_METRICS), so aggregates have the same type with or without numpy, otherwise a float """
+    if isinstance(array, ArrayType) and array.typecode != 'd':
+        return int(value)
+    return float(value)
+
+
+def presort(array, aggregate_names):
+    """ Without numpy, get a sorted copy of an array if more than one of the aggregates would sort it,
+        since sorting is much faster for an already sorted array. Otherwise returns the array
+        Histograms are returned as they are, they compute percentiles without sorting """
+    if isinstance(array, Histogram):
+        return array
+    if numpy is None and len(ORDER_AGGREGATES.intersection(aggregate_names)) > 1:
+        return sorted(array)
+    return array
+
+
+def mean(array):
+    """ Arithmetic mean of an array of numbers """
+    if numpy is not None:
+        return float(numpy.mean(to_numpy(array)))
+    return float(sum(array)) / float(len(array))
+
+
+def mean_harmonic(array):
+    """ Harmonic mean of an array of numbers """
+    if numpy is not None:
+        return float(len(array) / numpy.sum(1.0 / to_numpy(array)))
+    return 1.0 / (sum([1.0 / float(y) for y in array]) / float(len(array)))
+
+
+def total(array):
+    """ Sum of an array of numbers, a list of integers has an integer sum """
+    if numpy is not None and not isinstance(array, list):
+        return numpy_number(array, numpy.sum(to_numpy(array)))
+    return sum(array)
+
+
+def minimum(array):
+    """ Smallest of an array of numbers """
+    if numpy is not None and not isinstance(array, list):
+        return numpy_number(array, numpy.min(to_numpy(array)))
+    return min(array)
+
+
+def maximum(array):
+    """ Largest of an array of numbers """
+    if numpy is not None and not isinstance(array, list):
+        return numpy_number(array, numpy.max(to_numpy(array)))
+    return max(array)
+
+
+def sorted_percentile(mysorted, percent):
+    """ Percentile of a sorted list, interpolating linearly between the closest ranks (as numpy does) """
+    position = (len(mysorted) - 1) * percent / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(mysorted) - 1)
+    return mysorted[lower] + (mysorted[upper] - mysorted[lower]) * (position - lower)
+
+
+def percentile(array, percent):
+    """ Get a percentile (0-100) of an array of numbers """
+    if numpy is not None:
+        return float(numpy.percentile(to_numpy(array), percent))
+    return sorted_percentile(sorted(array), percent)
+
+
+def interquartile_range(array):
+    """ Difference between the 75th and 25th percentiles of an array of numbers """
+    if numpy is not None:
+        quartiles = numpy.percentile(to_numpy(array), [25, 75])
+        return float(quartiles[1] - quartiles[0])
+    mysorted = sorted(array)
+    return sorted_percentile(mysorted, 75) - sorted_percentile(mysorted, 25)
+
 
 def median(array):
     """ Get the median of an array """
-    mysorted = [x for x in array]
-    mysorted.sort()
+    if numpy is not None:
+        return float(numpy.median(to_numpy(array)))
+    mysorted = sorted(array)
     middle = int(len(mysorted) / 2)  # Gets the middle element, if present
     if len(mysorted) % 2 == 0:  # Even, so need to average together the middle two values
         return float((mysorted[middle] + mysorted[middle - 1])) / 2
@@ -103,18 +415,196 @@ def median(array):
 
 
 def std_deviation(array):
-    """ Compute the standard deviation of an array of numbers """
-    if not array or len(array) == 1:
+    """ Compute the (population) standard deviation of an array of numbers """
+    if not len(array) or len(array) == 1:
         return 0
+    if numpy is not None:
+        return float(numpy.std(to_numpy(array)))
+
+    average = mean(array)
+    variance = sum((x - average) ** 2 for x in array) / float(len(array))
+    return math.sqrt(variance)
+
+
+def z_score(confidence):
+    """ Two-sided critical value of the standard normal distribution for a confidence level, ex: 1.96 for 0.95 """
+    low, high = 0.0, 40.0
+    for x in xrange(0, 100):  # Bisection, P(|Z| < z) = erf(z / sqrt(2))
+        middle = (low + high) / 2
+        if math.erf(middle / math.sqrt(2)) < confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def compute_aggregate(aggregate, array):
+    """ Compute an aggregate by name (see AGGREGATES) for an array of numbers or a Histogram """
+    if isinstance(array, Histogram):
+        if aggregate in PERCENTILES:
+            return array.percentile(PERCENTILES[aggregate])
+        elif aggregate == 'iqr':
+            return array.percentile(75) - array.percentile(25)
+        return array.aggregate(aggregate)
+    return AGGREGATES[aggregate](array)
+
+
+def confidence_interval(array, aggregate=u'mean', confidence=0.95):
+    """ Approximate confidence interval (low, high) for the mean or median of an array of numbers (or Histogram)
+        The mean uses the normal approximation, the median uses order statistics (no assumed distribution)
+        Returns None if there are fewer than MIN_PRECISION_SAMPLES numbers """
+    count = len(array)
+    if count < MIN_PRECISION_SAMPLES:
+        return None
+    z = z_score(confidence)
+    if aggregate == u'mean':
+        if isinstance(array, Histogram):
+            center, deviation = array.mean(), array.std_deviation()
+        else:
+            center, deviation = mean(array), std_deviation(array)
+        half_width = z * deviation / math.sqrt(count)
+        return (center - half_width, center + half_width)
+    elif aggregate == u'median':
+        spread = z * math.sqrt(count) / 2
+        lower = max(0, int(math.floor(count / 2.0 - spread)))
+        upper = min(count - 1, int(math.ceil(count / 2.0 + spread)))
+        if isinstance(array, Histogram):
+            return (array.value_at_rank(lower), array.value_at_rank(upper))
+        mysorted = sorted(array)
+        return (mysorted[lower], mysorted[upper])
+    raise ValueError("No confidence interval for aggregate: " + text_type(aggregate))
+
+
+def parse_precision(value):
+    """ Parse a relative precision as a fraction, from a number like 0.05 or a percentage like '5%' """
+    if isinstance(value, basestring) and value.strip().endswith(u'%'):
+        precision = float(value.strip()[:-1]) / 100.0
+    else:
+        precision = float(value)
+    if precision <= 0 or precision >= 1:
+        raise ValueError("Precision must be between 0 and 1 (or 0% and 100%)")
+    return precision
+
+
+class PrecisionTarget(object):
+    """ Stopping rule for a benchmark that samples until an aggregate of a metric is known precisely enough:
+        the confidence interval around it must be within +/- precision (a fraction) of its value,
+        or max_runs requests have been run """
+    metric = u'total_time'
+    aggregate = u'mean'
+    precision = 0.05
+    confidence = 0.95
+    max_runs = 10000
+
+    def __init__(self, precision=0.05, metric=u'total_time', aggregate=u'mean', confidence=0.95, max_runs=10000):
+        self.precision = precision
+        self.metric = metric
+        self.aggregate = aggregate
+        self.confidence = confidence
+        self.max_runs = max_runs
+
+    def is_met(self, array):
+        """ True if the values for the metric are enough to reach the target precision """
+        interval = confidence_interval(array, self.aggregate, self.confidence)
+        if interval is None:
+            return False
+        value = compute_aggregate(self.aggregate, array)
+        half_width = (interval[1] - interval[0]) / 2.0
+        return half_width <= abs(value) * self.precision
+
+    @staticmethod
+    def parse(node):
+        """ Parse from config, either just a precision or a map of precision plus optional
+            metric, aggregate, confidence and max_runs """
+        if not isinstance(node, dict) and not isinstance(node, list):
+            return PrecisionTarget(parse_precision(node))
+        node = lowercase_keys(flatten_dictionaries(node))
+        if u'precision' not in node:
+            raise ValueError("Benchmark target_precision needs a precision")
+        target = PrecisionTarget(parse_precision(node[u'precision']))
+        for key, value in node.items():
+            if key == u'metric':
+                target.metric = text_type(value).lower().strip()
+            elif key == u'aggregate':
+                target.aggregate = text_type(value).lower().strip()
+                if target.aggregate not in PRECISION_AGGREGATES:
+                    raise ValueError("Benchmark target_precision aggregate must be one of: " +
+                                     u', '.join(PRECISION_AGGREGATES))
+            elif key == u'confidence':
+                target.confidence = parse_precision(value)
+            elif key == u'max_runs':
+                target.max_runs = int(value)
+                if target.max_runs < 1:
+                    raise ValueError("Benchmark target_precision max_runs must be >= 1")
+        return target
+
+
+class Threshold(object):
+    """ A limit a benchmark result must meet, ex: p99 of total_time < 0.25 seconds
+        Applies to an aggregate of a metric, or with no aggregate to a value of the run (see RUN_THRESHOLDS) """
+    metricname = None
+    aggregate = None
+    comparison = u'<'  # Operator from THRESHOLD_OPERATORS
+    limit = None
+
+    def __init__(self, metricname, aggregate, comparison, limit):
+        self.metricname = metricname
+        self.aggregate = aggregate
+        self.comparison = comparison
+        self.limit = limit
+
+    def is_met(self, value):
+        """ True if a value is within the limit, a missing value (ex: no successful requests) never is """
+        if value is None:
+            return False
+        return dict(THRESHOLD_OPERATORS)[self.comparison](value, self.limit)
+
+    def expression(self):
+        return u'{0}{1}'.format(self.comparison, self.limit)
+
+    @staticmethod
+    def parse(metricname, aggregate, value):
+        """ Parse a threshold from an expression, a comparison and limit, ex: '<0.250' or '>= 500'
+            Limits for times can have units, ex: '<250ms' """
+        expression = text_type(value).strip()
+        for comparison, function in THRESHOLD_OPERATORS:
+            if expression.startswith(comparison):
+                limit = expression[len(comparison):].strip()
+                break
+        else:
+            raise ValueError("Benchmark threshold must start with one of <, <=, >, >=: " + expression)
+        if metricname.endswith(u'_time') or metricname == u'schedule_lag' or metricname == u'elapsed':
+            limit = parse_duration(limit)
+        else:
+            limit = float(limit)
+        return Threshold(metricname, aggregate, comparison, limit)
+
 
-    average = AGGREGATES['mean_arithmetic'](array)
-    variance = map(lambda x: (x - average)**2, array)
-    try:
-        len(variance)
-    except TypeError:  # Python 3.3 workaround until can use the statistics module from 3.4
-        variance = list(variance)
-    stdev = AGGREGATES['mean_arithmetic'](variance)
-    return math.sqrt(stdev)
+def parse_thresholds(node):
+    """ Parse thresholds from config, a map of run value (see RUN_THRESHOLDS) to expression,
+        or of metric name to a map of aggregate to expression, ex:
+            {total_time: {p99: '<0.250', mean: '<0.080'}, error_rate: '<0.01', throughput: '>500'}
+        Returns a list of Threshold """
+    node = lowercase_keys(flatten_dictionaries(node))
+    if not isinstance(node, dict):
+        raise ValueError("Benchmark thresholds must be a map of metric to thresholds")
+    thresholds = list()
+    for metricname, value in node.items():
+        metricname = text_type(metricname).strip()
+        if metricname in RUN_THRESHOLDS:
+            thresholds.append(Threshold.parse(metricname, None, value))
+            continue
+        if metricname not in METRICS and metricname not in CLIENT_METRICS and metricname not in DERIVED_METRICS:
+            raise ValueError("Benchmark threshold for invalid metric: " + metricname)
+        if not isinstance(value, (dict, list)):
+            raise ValueError("Benchmark thresholds for metric {0} must be a map of aggregate to threshold".format(
+                metricname))
+        for aggregate, expression in lowercase_keys(flatten_dictionaries(value)).items():
+            aggregate = text_type(aggregate).strip()
+            if aggregate not in AGGREGATES:
+                raise ValueError("Benchmark threshold for invalid aggregate: " + aggregate)
+            thresholds.append(Threshold.parse(metricname, aggregate, expression))
+    return thresholds
 
 
 class Benchmark(Test):
@@ -128,9 +618,29 @@ class Benchmark(Test):
                 - value of 'all' returns everything
     """
     warmup_runs = 10  # Times call is executed to warm up
+    warmup_auto = False  # Detect where warmup ends in the results, and leave out what comes before
     benchmark_runs = 100  # Times call is executed to generate benchmark results
+    rate = None  # Requests/second to start, for an open-loop benchmark
+    duration = None  # Seconds to run for, instead of benchmark_runs (for open-loop, at the given rate)
+    target_precision = None  # PrecisionTarget, to run until an aggregate is precise enough
+    concurrency = None  # Virtual users with a request in flight at once, default 1 (open-loop: no limit)
+    stages = None  # List of Stage, for an open-loop benchmark with a rate changing over time
     output_format = u'csv'
     output_file = None
+    metric_storage = u'list'  # How to store metric values, from METRIC_STORAGE
+    thresholds = None  # List of Threshold the results must meet, or the benchmark fails
+    base_url = None  # Base URL and configuration node parsed, so agents can rebuild the benchmark
+    source_node = None
+    baseline_file = None  # JSON result of a previous run, to check aggregates for regressions against
+    regression_threshold = baseline.DEFAULT_REGRESSION_THRESHOLD  # Relative change that is a regression
+    baseline_significance = baseline.DEFAULT_SIGNIFICANCE  # p-value needed for a regression, with raw samples
+    interval_output = None  # File to write a row of statistics to for each interval, while running
+    interval_format = None  # From INTERVAL_FORMATS, default is by file extension
+    interval = DEFAULT_INTERVAL  # Seconds in each interval
+    interval_requests = None  # Requests in each interval, instead of by time
+    validate_sample_rate = None  # Run validators on 1 in this many responses, if set
+    history_file = None  # SQLite database to record results in, see history module
+    history_label = None  # Label for results recorded in history, ex: a build or environment
 
     # Metrics to gather, both raw and aggregated
     metrics = set()
@@ -155,7 +665,7 @@ class Benchmark(Test):
 
         clean_metric = metric_name.lower().strip()
 
-        if clean_metric.lower() not in METRICS:
+        if clean_metric not in METRICS and clean_metric not in CLIENT_METRICS and clean_metric not in DERIVED_METRICS:
             raise Exception("Metric named: " + metric_name +
                             " is not a valid benchmark metric.")
         self.metrics.add(clean_metric)
@@ -185,6 +695,176 @@ class Benchmark(Test):
         return json.dumps(self, default=safe_to_json)
 
 
+def error_key(error):
+    """ Key to count a request error by: the curl error code for a pycurl error, otherwise the exception's type name """
+    if isinstance(error, pycurl.error) and error.args:
+        return error.args[0]
+    return type(error).__name__
+
+
+class MetricCollector(object):
+    """ Collects metrics for each request of a benchmark, into an array('d') of values per metric
+        or with storage 'histogram', into a Histogram per metric (and per stage, if tracking stages)
+
+        For DERIVED_METRICS, the metrics they are derived from are collected too.  With list storage,
+        derived metrics are computed after the run (see derive_metrics), with histograms as each value is stored """
+    metricnames = None
+    results = None  # List of value arrays (or Histograms), one per metric in metricnames
+    curl_metrics = None  # Tuples of (index, pycurl info constant)
+    lag_index = None
+    response_time_index = None
+    client_indices = None  # Tuples of (index, position in client_times or None for their total)
+    count = 0  # Requests recorded
+    stages = None  # Stage index for each request, if tracking stages with list storage
+    stage_results = None  # Maps stage index to list of Histograms, if tracking stages with histogram storage
+    transport_metrics = None  # Names of metrics needed from transport responses
+    storage = u'list'
+    intervals = None  # IntervalRecorder to pass values and failures to as they come in, for interval output
+    derived_indices = None  # Tuples of (index, end index, start index or None), for derived metrics stored
+    status_counts = None  # Maps HTTP status code to count of responses, successful or not
+    error_counts = None  # Maps error (see error_key) to count of requests that got no response
+    failed = None  # MetricCollector for metrics of failed responses, if tracking failures
+    validated = 0  # Responses sampled for validation
+    validation_failures = 0
+
+    def __init__(self, metricnames, track_stages=False, storage=u'list', track_failures=False):
+        self.count = 0
+        self.storage = storage
+        self.status_counts = dict()
+        self.error_counts = dict()
+        if track_failures:
+            self.failed = MetricCollector(metricnames, storage=storage)
+        if track_stages:
+            if storage == u'histogram':
+                self.stage_results = dict()
+            else:
+                self.stages = ArrayType('i')
+        self.metricnames = list(metricnames)
+        for name in list(self.metricnames):
+            for base in DERIVED_METRICS.get(name, ()):
+                if base is not None and base not in self.metricnames:
+                    self.metricnames.append(base)
+        if storage != u'histogram':
+            self.metricnames = [name for name in self.metricnames if name not in DERIVED_METRICS]
+        self.derived_indices = list()
+        for index, name in enumerate(self.metricnames):
+            if name in DERIVED_METRICS:
+                end, start = DERIVED_METRICS[name]
+                self.derived_indices.append((index, self.metricnames.index(end),
+                                             None if start is None else self.metricnames.index(start)))
+        self.results = self.new_results()
+        self.curl_metrics = list()
+        self.client_indices = list()
+        for index, name in enumerate(self.metricnames):
+            if name in METRICS:
+                self.curl_metrics.append((index, METRICS[name]))
+            elif name == 'schedule_lag':
+                self.lag_index = index
+            elif name == 'response_time':
+                self.response_time_index = index
+            elif name in CLIENT_PHASE_METRICS:
+                self.client_indices.append((index, CLIENT_PHASE_METRICS.index(name)))
+            elif name == 'client_prepare_time':
+                self.client_indices.append((index, None))
+        self.transport_metrics = [self.metricnames[index] for index, info in self.curl_metrics]
+        if self.response_time_index is not None and 'total_time' not in self.transport_metrics:
+            self.transport_metrics.append('total_time')
+
+    def new_results(self):
+        """ Empty value store for each metric, a Histogram or a compact array: of longs for INTEGER_METRICS,
+            otherwise of doubles """
+        if self.storage == u'histogram':
+            return [Histogram() for x in self.metricnames]
+        return [ArrayType('l' if name in INTEGER_METRICS else 'd') for name in self.metricnames]
+
+    def record(self, curl, schedule_lag=0.0, stage=None, client_times=None):
+        """ Store metrics from a completed curl request, started in the given stage index
+            client_times are the seconds spent in each of CLIENT_PHASE_METRICS preparing it, if measured """
+        values = [None] * len(self.metricnames)
+        for index, info in self.curl_metrics:
+            values[index] = curl.getinfo(info)
+        if self.lag_index is not None:
+            values[self.lag_index] = schedule_lag
+        if self.response_time_index is not None:
+            values[self.response_time_index] = schedule_lag + curl.getinfo(pycurl.TOTAL_TIME)
+        if self.client_indices:
+            self.set_client_times(values, client_times)
+        self.store(values, stage)
+
+    def record_metrics(self, metrics, schedule_lag=0.0, stage=None, client_times=None):
+        """ Store metrics from a transport response, metrics maps name to value """
+        values = [None] * len(self.metricnames)
+        metricnames = self.metricnames
+        for index, info in self.curl_metrics:
+            values[index] = metrics[metricnames[index]]
+        if self.lag_index is not None:
+            values[self.lag_index] = schedule_lag
+        if self.response_time_index is not None:
+            values[self.response_time_index] = schedule_lag + metrics['total_time']
+        if self.client_indices:
+            self.set_client_times(values, client_times)
+        self.store(values, stage)
+
+    def set_client_times(self, values, client_times):
+        """ Fill in values for client metrics, 0 for each phase if client_times were not measured """
+        if client_times is None:
+            client_times = (0.0,) * len(CLIENT_PHASE_METRICS)
+        for index, position in self.client_indices:
+            values[index] = sum(client_times) if position is None else client_times[position]
+
+    def store(self, values, stage=None):
+        """ Store one value for each metric, in the order of metricnames """
+        for index, end, start in self.derived_indices:
+            if start is None:
+                values[index] = values[end]
+            else:
+                values[index] = max(values[end] - values[start], 0.0)
+        self.count = self.count + 1
+        for results, value in zip(self.results, values):
+            results.append(value)
+        if self.intervals is not None:
+            self.intervals.record(values)
+        if self.stages is not None:
+            self.stages.append(stage)
+        elif self.stage_results is not None:
+            stage_results = self.stage_results.get(stage)
+            if stage_results is None:
+                stage_results = self.stage_results[stage] = self.new_results()
+            for results, value in zip(stage_results, values):
+                results.append(value)
+
+    def record_status(self, status):
+        """ Count a response with an HTTP status code """
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def record_failure(self, error=None, curl=None, metrics=None, schedule_lag=0.0, client_times=None):
+        """ Note a failed request: error is the exception if there was no response, which is counted by error_key
+            For a response that failed (unexpected status or validation), its metrics are stored in the
+            failed collector if tracking failures, from a curl handle or a transport's metrics """
+        if error is not None:
+            key = error_key(error)
+            self.error_counts[key] = self.error_counts.get(key, 0) + 1
+        elif self.failed is not None:
+            if curl is not None:
+                self.failed.record(curl, schedule_lag=schedule_lag, client_times=client_times)
+            elif metrics is not None:
+                self.failed.record_metrics(metrics, schedule_lag=schedule_lag, client_times=client_times)
+        if self.intervals is not None:
+            self.intervals.record_failure()
+
+    def get_results(self):
+        """ Map of metric name to array of values (or Histogram) """
+        return dict(zip(self.metricnames, self.results))
+
+    def get_stage_results(self):
+        """ For histogram storage with stages, map of stage index to map of metric name to Histogram
+            None otherwise, see stages instead """
+        if self.stage_results is None:
+            return None
+        return dict([(stage, dict(zip(self.metricnames, results)))
+                     for stage, results in self.stage_results.items()])
+
+
 def realize_partial(self, context=None):
     """ Attempt to template out what is possible for this benchmark """
     if not self.is_dynamic():
@@ -199,14 +879,6 @@ def realize_partial(self, context=None):
     pass
 
 
-def configure_curl(self, timeout=tests.DEFAULT_TIMEOUT, context=None, curl_handle=None):
-    curl = super().configure_curl(self, timeout=timeout,
-                                  context=context, curl_handle=curl_handle)
-    # Simulate results from different users hitting server
-    curl.setopt(pycurl.FORBID_REUSE, 1)
-    return curl
-
-
 def parse_benchmark(base_url, node):
     """ Try building a benchmark configuration from deserialized configuration root node """
     node = lowercase_keys(flatten_dictionaries(node))  # Make it usable
@@ -220,18 +892,85 @@ def parse_benchmark(base_url, node):
     for key, value in node.items():
         if key == u'warmup_runs':
             benchmark.warmup_runs = int(value)
+        elif key == u'warmup':
+            if text_type(value).lower().strip() == u'auto':
+                benchmark.warmup_auto = True
+            else:  # A count of runs, same as warmup_runs
+                benchmark.warmup_runs = int(value)
         elif key == u'benchmark_runs':
             benchmark.benchmark_runs = int(value)
+        elif key == u'rate':
+            benchmark.rate = float(value)
+            if benchmark.rate <= 0:
+                raise ValueError("Benchmark rate must be > 0 requests/second")
+        elif key == u'concurrency':
+            benchmark.concurrency = int(value)
+            if benchmark.concurrency < 1:
+                raise ValueError("Benchmark concurrency must be >= 1")
+        elif key == u'stages':
+            if not isinstance(value, list) or not value:
+                raise ValueError("Benchmark stages must be a non-empty list")
+            benchmark.stages = [Stage.parse(stage, index) for index, stage in enumerate(value)]
+        elif key == u'duration':
+            benchmark.duration = parse_duration(value)
+            if benchmark.duration <= 0:
+                raise ValueError("Benchmark duration must be > 0 seconds")
+        elif key == u'target_precision':
+            benchmark.target_precision = PrecisionTarget.parse(value)
         elif key == u'output_format':
             format = value.lower()
             if format in OUTPUT_FORMATS:
                 benchmark.output_format = format
             else:
                 raise ValueError('Invalid benchmark output format: ' + format)
+        elif key == u'metric_storage':
+            storage = text_type(value).lower().strip()
+            if storage not in METRIC_STORAGE:
+                raise ValueError('Invalid benchmark metric storage: ' + storage)
+            benchmark.metric_storage = storage
         elif key == u'output_file':
             if not isinstance(value, basestring):
                 raise ValueError("Invalid output file format")
             benchmark.output_file = value
+        elif key == u'baseline_file':
+            if not isinstance(value, basestring):
+                raise ValueError("Invalid baseline file format")
+            benchmark.baseline_file = value
+        elif key == u'regression_threshold':
+            benchmark.regression_threshold = baseline.parse_threshold(value)
+        elif key == u'baseline_significance':
+            benchmark.baseline_significance = float(value)
+            if benchmark.baseline_significance <= 0 or benchmark.baseline_significance >= 1:
+                raise ValueError("Benchmark baseline_significance must be between 0 and 1")
+        elif key == u'interval_output':
+            if not isinstance(value, basestring):
+                raise ValueError("Invalid interval output file format")
+            benchmark.interval_output = value
+        elif key == u'interval_format':
+            format = text_type(value).lower().strip()
+            if format not in INTERVAL_FORMATS:
+                raise ValueError('Invalid benchmark interval format: ' + format)
+            benchmark.interval_format = format
+        elif key == u'interval':
+            benchmark.interval = parse_duration(value)
+            if benchmark.interval <= 0:
+                raise ValueError("Benchmark interval must be > 0 seconds")
+        elif key == u'interval_requests':
+            benchmark.interval_requests = int(value)
+            if benchmark.interval_requests < 1:
+                raise ValueError("Benchmark interval_requests must be >= 1")
+        elif key == u'validate_sample_rate':
+            benchmark.validate_sample_rate = int(value)
+            if benchmark.validate_sample_rate < 1:
+                raise ValueError("Benchmark validate_sample_rate must be >= 1")
+        elif key == u'history_file':
+            if not isinstance(value, basestring):
+                raise ValueError("Invalid history file format")
+            benchmark.history_file = value
+        elif key == u'history_label':
+            benchmark.history_label = text_type(value)
+        elif key == u'thresholds':
+            benchmark.thresholds = parse_thresholds(value)
         elif key == u'metrics':
             if isinstance(value, basestring):
                 # Single value
@@ -269,4 +1008,72 @@ def parse_benchmark(base_url, node):
                 raise TypeError(
                     "Invalid benchmark metric datatype: " + str(value))
 
+    if benchmark.interval_output and benchmark.interval_format is None:
+        benchmark.interval_format = u'csv' if benchmark.interval_output.lower().endswith(u'.csv') else u'json'
+    if benchmark.warmup_auto:
+        if benchmark.metric_storage == u'histogram':
+            raise ValueError("Benchmark warmup: auto needs list metric_storage, to drop values from the start")
+        if u'warmup_runs' not in node:  # Detected instead
+            benchmark.warmup_runs = 0
+    for threshold in benchmark.thresholds or ():  # Aggregates with thresholds must be computed
+        if (threshold.aggregate is not None and
+                threshold.aggregate not in benchmark.aggregated_metrics.get(threshold.metricname, ())):
+            benchmark.add_metric(threshold.metricname, threshold.aggregate)
+    if benchmark.stages and (benchmark.rate is not None or benchmark.duration is not None):
+        raise ValueError("Benchmark stages can't be combined with rate or duration")
+    if benchmark.target_precision is not None:
+        if benchmark.rate is not None or benchmark.stages:
+            raise ValueError("Benchmark target_precision can't be combined with rate or stages")
+        if benchmark.target_precision.metric not in benchmark.metrics:
+            raise ValueError("Benchmark target_precision metric must be one of the benchmark's metrics: " +
+                             benchmark.target_precision.metric)
+    benchmark.base_url = base_url
+    benchmark.source_node = node
     return benchmark
+
+
+def request_schedule(benchmark):
+    """ Generator of (start time, stage index) for requests of an open-loop benchmark
+        Start times are seconds from the start of the benchmark, stage index is None without stages """
+    if benchmark.stages:
+        offset = 0.0
+        for index, stage in enumerate(benchmark.stages):
+            for start in stage.start_times():
+                yield (offset + start, index)
+            offset = offset + stage.duration
+    else:
+        interval = 1.0 / benchmark.rate
+        if benchmark.duration is not None:
+            total_requests = max(1, int(benchmark.rate * benchmark.duration))
+        else:
+            total_requests = benchmark.benchmark_runs
+        for x in xrange(0, total_requests):
+            yield (x * interval, None)
+
+
+def closed_loop_runs(benchmark, collector):
+    """ Generator for closed-loop benchmarks (no rate), yields the index of each request to start
+        Runs benchmark_runs requests, or with a duration, as many as start before that time is up
+        With a target_precision, benchmark_runs is the minimum: it keeps going until the confidence interval
+        of results in the collector is narrow enough, max_runs is reached, or the duration (if any) ends """
+    target = benchmark.target_precision
+    deadline = None
+    if benchmark.duration is not None:
+        deadline = timer() + benchmark.duration
+    next_check = benchmark.benchmark_runs
+    runs = 0
+
+    while True:
+        if deadline is not None and timer() >= deadline:
+            return
+        if target is not None:
+            if runs >= target.max_runs:
+                return
+            if collector.count >= next_check:
+                if target.is_met(derive_metrics(collector.get_results(), [target.metric])[target.metric]):
+                    return
+                next_check = collector.count + max(MIN_PRECISION_CHECK_INTERVAL, collector.count // 10)
+        elif deadline is None and runs >= benchmark.benchmark_runs:
+            return
+        yield runs
+        runs = runs + 1
@@ -14,6 +14,8 @@ class Context(object):
     variables = dict()  # Maps variable name to current value
     generators = dict()  # Maps generator name to generator function
     mod_count = 0  # Lets us see if something has been altered, avoiding needless retemplating
+    versions = None  # Maps variable name to the mod_count when its value last changed
+    realized = None  # Templated tests for these variables, see Test.realize, maps id(test) to cache entry
 
     def bind_variable(self, variable_name, variable_value):
         """ Bind a named variable to a value within the context
@@ -23,6 +25,7 @@ class Context(object):
         if prev != variable_value:
             self.variables[str(variable_name)] = variable_value
             self.mod_count = self.mod_count + 1
+            self.versions[str_name] = self.mod_count
             #logging.debug('Context: altered variable named {0} to value {1}'.format(str_name, variable_value))
 
     def bind_variables(self, variable_map):
@@ -50,6 +53,7 @@ class Context(object):
         if prev != val:
             self.variables[str_name] = val
             self.mod_count = self.mod_count + 1
+            self.versions[str_name] = self.mod_count
             # Logging is /expensive/
             #logging.debug('Context: Set variable named {0} to next value {1} from generator named {2}'.format(variable_name, val, generator_name))
         return val
@@ -57,6 +61,11 @@ class Context(object):
     def get_values(self):
         return self.variables
 
+    def get_versions(self, variable_names):
+        """ Tuple of versions for variables (0 if never bound), which changes if any of their values change """
+        versions = self.versions
+        return tuple([versions.get(name, 0) for name in variable_names])
+
     def get_value(self, variable_name):
         """ Get bound variable value, or return none if not set """
         return self.variables.get(str(variable_name))
@@ -70,3 +79,15 @@ class Context(object):
     def __init__(self):
         self.variables = dict()
         self.generators = dict()
+        self.versions = dict()
+        self.realized = dict()
+
+    def copy(self):
+        """ New context with its own copy of the variables, sharing the same generators
+            (a generator can't be copied, so both contexts draw from it) """
+        output = Context()
+        output.variables = self.variables.copy()
+        output.generators = self.generators
+        output.mod_count = self.mod_count
+        output.versions = self.versions.copy()
+        return output
@@ -0,0 +1,62 @@
+import sys
+import logging
+import pycurl
+
+# Python 2/3 switches
+if sys.version_info[0] > 2:
+    import urllib.parse as urlparse
+else:
+    import urlparse
+
+"""
+Connection reuse support: keeps curl handles per host, with a CurlShare so that
+DNS lookups, TLS sessions and open connections are reused between requests
+"""
+
+logger = logging.getLogger('pyresttest.connections')
+
+
+class CurlPool(object):
+    """ Pool of idle curl handles, kept per host (scheme + host + port)
+        All handles use one CurlShare for the DNS cache, TLS sessions and connection cache
+
+        Handles are not thread-safe, so use one pool per thread or process """
+
+    share = None
+    idle = None  # Maps (scheme, netloc) to list of idle curl handles
+
+    def __init__(self):
+        self.idle = dict()
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        if hasattr(pycurl, 'LOCK_DATA_CONNECT'):  # Newer pycurl and libcurl 7.57.0+
+            try:
+                self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+            except pycurl.error:
+                logger.debug("libcurl can't share connection cache, only DNS and TLS sessions")
+
+    @staticmethod
+    def host_key(url):
+        """ Key for the host a URL is on """
+        parts = urlparse.urlsplit(str(url))
+        return (parts.scheme.lower(), parts.netloc.lower())
+
+    def acquire(self, url):
+        """ Get a curl handle for the host in url, reusing an idle one if possible """
+        handles = self.idle.get(self.host_key(url))
+        if handles:
+            return handles.pop()
+        return pycurl.Curl()
+
+    def release(self, url, curl):
+        """ Return a handle to the pool once its request is done """
+        self.idle.setdefault(self.host_key(url), list()).append(curl)
+
+    def close(self):
+        """ Close all idle handles and the share """
+        for handles in self.idle.values():
+            for curl in handles:
+                curl.close()
+        self.idle = dict()
+        self.share.close()
@@ -38,20 +38,28 @@ class ContentHandler:
         """ Is templating used? """
         return self.is_template_path or self.is_template_content
 
+    def template_variables(self):
+        """ Names of the variables templating uses, or None if not known until the file is read """
+        if self.is_file and self.is_template_content:
+            return None
+        if self.is_template_path or self.is_template_content:
+            return get_template(self.content).variables
+        return frozenset()
+
     def get_content(self, context=None):
         """ Does all context binding and pathing to get content, templated out """
 
         if self.is_file:
             path = self.content
             if self.is_template_path and context:
-                path = string.Template(path).safe_substitute(
+                path = get_template(path).safe_substitute(
                     context.get_values())
             data = None
             with open(path, 'r') as f:
                 data = f.read()
 
             if self.is_template_content and context:
-                return string.Template(data).safe_substitute(context.get_values())
+                return get_template(data).safe_substitute(context.get_values())
             else:
                 return data
         else:
@@ -80,6 +88,8 @@ class ContentHandler:
         self.is_file = is_file
         self.is_template_path = is_template_path
         self.is_template_content = is_template_content
+        if is_template_path or (is_template_content and not is_file):  # Compile once, up front
+            get_template(input)
 
     @staticmethod
     def parse_content(node):
@@ -126,6 +136,7 @@ class ContentHandler:
                         output.is_template_content = is_template_content
                         output.is_template_path = is_file
                         output.is_file = is_file
+                        get_template(value)  # Compile once, up front
                         return output
                     else:
                         is_template_content = True
@@ -0,0 +1,219 @@
+import hmac
+import json
+import socket
+import logging
+import threading
+
+from . import six
+from .six.moves import socketserver
+from .parsing import safe_to_json
+from .histogram import Histogram
+
+"""
+Distributed benchmarks: a coordinator sends benchmarks to agent processes on other machines, and merges their results
+- Messages are single lines of JSON, over a TCP connection per job
+- Each agent gets a share of the benchmark load (concurrency, rate, runs) and returns raw metrics
+- Raw metrics are lists of values, or with histogram storage, histograms which are merged
+- Agents run one job at a time, so several agents on one machine need separate ports
+- Agents only run jobs sent with their shared secret token, and listen on localhost unless given a host
+"""
+
+logger = logging.getLogger('pyresttest.distributed')
+
+DEFAULT_AGENT_PORT = 7777
+
+
+def parse_address(address, default_host=u'127.0.0.1'):
+    """ Parse a HOST:PORT (or just PORT) address into (host, port) """
+    address = str(address).strip()
+    if u':' in address:
+        host, port = address.rsplit(u':', 1)
+        host = host.strip(u'[]') or default_host
+    else:
+        host, port = default_host, address
+    return (host, int(port))
+
+
+def parse_agents(agents):
+    """ Parse a comma-separated list of agent HOST:PORT addresses """
+    if isinstance(agents, six.string_types):
+        agents = [x for x in agents.split(u',') if x.strip()]
+    return [parse_address(x, default_host=u'localhost') for x in agents]
+
+
+def token_matches(token, expected):
+    """ Compare a token to the expected one, in constant time so it can't be guessed by timing replies """
+    if not isinstance(token, six.string_types):
+        return False
+    token = token.encode('utf-8')
+    expected = expected.encode('utf-8')
+    compare_digest = getattr(hmac, 'compare_digest', None)
+    if compare_digest is None:  # Python before 2.7.7
+        return len(token) == len(expected) and sum([a != b for a, b in zip(token, expected)]) == 0
+    return compare_digest(token, expected)
+
+
+def send_message(sock_file, message):
+    """ Write a message (JSON-able object) as one line """
+    sock_file.write(json.dumps(message, default=safe_to_json).encode('utf-8') + b'\n')
+    sock_file.flush()
+
+
+def read_message(sock_file):
+    """ Read a one-line JSON message, or None if the connection was closed """
+    line = sock_file.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def share_of(total, index, count):
+    """ Split an integer total among count agents as evenly as possible, returning the part for index """
+    return total // count + (1 if index < total % count else 0)
+
+
+def apply_share(benchmark, index, count):
+    """ Scale a benchmark down to one agent's share of the load, where there are count agents
+        Concurrency and runs are split between agents (each keeps at least one),
+        and rates are divided so the combined rate is what the benchmark asks for """
+    if count <= 1:
+        return benchmark
+    benchmark.benchmark_runs = max(1, share_of(benchmark.benchmark_runs, index, count))
+    if benchmark.concurrency is not None:
+        benchmark.concurrency = max(1, share_of(benchmark.concurrency, index, count))
+    if benchmark.target_precision is not None:
+        benchmark.target_precision.max_runs = max(1, share_of(benchmark.target_precision.max_runs, index, count))
+    if benchmark.rate:
+        benchmark.rate = benchmark.rate / float(count)
+    if benchmark.stages:
+        for stage in benchmark.stages:
+            stage.rate_from = stage.rate_from / float(count)
+            stage.rate_to = stage.rate_to / float(count)
+    return benchmark
+
+
+def encode_results(results):
+    """ Copy of a map of metric name to values, with value arrays as lists and Histograms as JSON-able maps """
+    return dict([(metric, values.to_dict() if isinstance(values, Histogram) else list(values))
+                 for metric, values in results.items()])
+
+
+def merge_values(results, encoded_results):
+    """ Add values from encode_results output to results (map of metric name to values list or Histogram) """
+    for metric, values in encoded_results.items():
+        if isinstance(values, dict):
+            values = Histogram.from_dict(values)
+        if metric not in results:
+            results[metric] = values
+        elif isinstance(values, Histogram):
+            results[metric].merge(values)
+        else:
+            results[metric].extend(values)
+
+
+def merge_counts(counts, agent_counts):
+    """ Add counts by key (ex: status code) from an agent to counts
+        Keys that were integers come back from JSON as strings, and are converted back """
+    for key, count in (agent_counts or {}).items():
+        if isinstance(key, six.string_types) and key.isdigit():
+            key = int(key)
+        counts[key] = counts.get(key, 0) + count
+
+
+def merge_results(agent_results):
+    """ Merge raw results from agents, each a map with results (metric name to values, see encode_results),
+        failures, count, elapsed, sample_stages, stage_results (stage index to results), warmup_cutoff,
+        status_counts, error_counts, failure_results, validated and validation_failures
+        Returns a map of the same form for the combined run, with Histograms decoded """
+    output = {u'results': dict(), u'failures': 0, u'count': 0, u'elapsed': 0.0,
+              u'sample_stages': None, u'stage_results': None, u'warmup_cutoff': None,
+              u'status_counts': dict(), u'error_counts': dict(), u'failure_results': dict(),
+              u'validated': 0, u'validation_failures': 0}
+    for agent_result in agent_results:
+        merge_values(output[u'results'], agent_result[u'results'])
+        if agent_result.get(u'stage_results') is not None:
+            if output[u'stage_results'] is None:
+                output[u'stage_results'] = dict()
+            for stage, results in agent_result[u'stage_results'].items():
+                merge_values(output[u'stage_results'].setdefault(int(stage), dict()), results)
+        output[u'failures'] = output[u'failures'] + agent_result[u'failures']
+        output[u'count'] = output[u'count'] + agent_result[u'count']
+        output[u'elapsed'] = max(output[u'elapsed'], agent_result[u'elapsed'] or 0.0)
+        if agent_result.get(u'warmup_cutoff') is not None:  # Each agent drops its own warmup
+            output[u'warmup_cutoff'] = (output[u'warmup_cutoff'] or 0) + agent_result[u'warmup_cutoff']
+        merge_counts(output[u'status_counts'], agent_result.get(u'status_counts'))
+        merge_counts(output[u'error_counts'], agent_result.get(u'error_counts'))
+        if agent_result.get(u'failure_results'):
+            merge_values(output[u'failure_results'], agent_result[u'failure_results'])
+        output[u'validated'] = output[u'validated'] + agent_result.get(u'validated', 0)
+        output[u'validation_failures'] = output[u'validation_failures'] + agent_result.get(u'validation_failures', 0)
+        if agent_result.get(u'sample_stages') is not None:
+            if output[u'sample_stages'] is None:
+                output[u'sample_stages'] = list()
+            output[u'sample_stages'].extend(agent_result[u'sample_stages'])
+    return output
+
+
+def run_on_agents(agents, jobs, token, timeout=None):
+    """ Send one job to each agent (list of (host, port)) with the agents' shared secret token,
+        all before waiting for any to finish, so they run at the same time. Returns list of replies, in agent order
+        Raises an exception if any agent can't be reached or reports an error """
+    connections = list()
+    try:
+        for address, job in zip(agents, jobs):
+            sock = socket.create_connection(address, timeout=timeout)
+            sock_file = sock.makefile('rwb')
+            connections.append((address, sock, sock_file))
+            send_message(sock_file, {u'token': token, u'job': job})
+
+        replies = list()
+        for address, sock, sock_file in connections:
+            reply = read_message(sock_file)
+            if reply is None:
+                raise Exception("Agent at {0}:{1} closed the connection without a result".format(*address))
+            if reply.get(u'error'):
+                raise Exception("Agent at {0}:{1} failed: {2}".format(address[0], address[1], reply[u'error']))
+            replies.append(reply)
+        return replies
+    finally:
+        for address, sock, sock_file in connections:
+            sock_file.close()
+            sock.close()
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    """ Reads a job, runs it with the server's job function, and replies with the result or error
+        Jobs without the server's token are refused """
+
+    def handle(self):
+        try:
+            message = read_message(self.rfile)
+        except ValueError:  # Not JSON
+            message = None
+        if not isinstance(message, dict) or not token_matches(message.get(u'token'), self.server.token):
+            logger.warning("Agent refused a job from {0}: missing or wrong token".format(self.client_address[0]))
+            send_message(self.wfile, {u'error': u'Refused: missing or wrong agent token'})
+            return
+        job = message.get(u'job')
+        try:
+            with self.server.job_lock:  # One job at a time, so they don't skew each other's timings
+                reply = self.server.run_job(job)
+        except Exception as e:
+            logger.exception("Agent job failed")
+            reply = {u'error': u'{0}: {1}'.format(type(e).__name__, e)}
+        send_message(self.wfile, reply)
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ TCP server for an agent, run_job is a function taking a job message and returning the reply
+        Only jobs sent with token, a shared secret, are run """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, run_job, token):
+        if not token:
+            raise ValueError("Agents need a shared secret token")
+        socketserver.TCPServer.__init__(self, address, AgentHandler)
+        self.run_job = run_job
+        self.token = token
+        self.job_lock = threading.Lock()
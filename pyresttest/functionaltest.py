@@ -5,6 +5,7 @@ import time
 import json
 import unittest
 import logging
+import threading
 from multiprocessing import Process
 
 from django.core.management import call_command
@@ -15,6 +16,7 @@ from . import binding
 from .binding import Context
 from . import resttest
 from . import validators
+from . import distributed
 
 # Python 2/3 compat shims
 from . import six
@@ -292,6 +294,55 @@ class RestTestCase(unittest.TestCase):
         self.assertTrue(
             failures == 0, 'Simple tests failed where success expected')
 
+    def test_full_context_use_parallel(self):
+        """ Same as context use test, but running tests concurrently where allowed """
+        path = os.path.join(os.path.dirname(
+            os.path.realpath(__file__)), 'content-test.yaml')
+        tests = resttest.parse_testsets('http://localhost:8000', resttest.read_test_file(
+            path), working_directory=os.path.dirname(os.path.realpath(__file__)))
+        for testset in tests:
+            testset.config.test_parallel = True
+            testset.config.max_concurrent = 4
+        failures = resttest.run_testsets(tests)
+        self.assertTrue(
+            failures == 0, 'Parallel tests failed where success expected')
+
+    def test_full_context_use_asyncio(self):
+        """ Same as context use test, but running requests with the asyncio transport """
+        if 'asyncio' not in resttest.TRANSPORTS:
+            raise unittest.SkipTest("asyncio transport needs Python 3.5+")
+        path = os.path.join(os.path.dirname(
+            os.path.realpath(__file__)), 'content-test.yaml')
+        for parallel in (False, True):
+            tests = resttest.parse_testsets('http://localhost:8000', resttest.read_test_file(
+                path), working_directory=os.path.dirname(os.path.realpath(__file__)))
+            for testset in tests:
+                testset.config.transport = u'asyncio'
+                testset.config.test_parallel = parallel
+            failures = resttest.run_testsets(tests)
+            self.assertTrue(
+                failures == 0, 'asyncio transport tests failed where success expected')
+
+    def test_run_tests_parallel(self):
+        """ Run independent tests concurrently, results come back in test order """
+        mytests = list()
+        for x in range(1, 6):
+            test = Test()
+            test.name = 'get person ' + str(x)
+            test.url = self.prefix + '/api/person/{0}/'.format(x % 3 + 1)
+            mytests.append(test)
+        bad = Test()
+        bad.url = self.prefix + '/api/person/1000/'
+        mytests.append(bad)
+
+        results = resttest.run_tests_parallel(mytests, max_concurrent=3)
+        self.assertEqual(len(mytests), len(results))
+        for x in range(0, len(mytests)):
+            self.assertTrue(mytests[x] is results[x][0])
+        self.assertTrue(all([r[1].passed for r in results[0:5]]))
+        self.assertFalse(results[5][1].passed)
+        self.assertEqual(404, results[5][1].response_code)
+
     def test_unicode_use(self):
         """ Read and execute test set  with context use, from file """
 
@@ -317,6 +368,57 @@ class RestTestCase(unittest.TestCase):
         self.assertTrue(benchmark_config.benchmark_runs, len(
             benchmark_result.results['total_time']))
 
+    def test_benchmark_get_open_loop(self):
+        """ Benchmark local get test at a fixed request rate """
+        benchmark_config = resttest.Benchmark()
+        benchmark_config.url = self.prefix + '/api/person/'
+        benchmark_config.rate = 50
+        benchmark_config.benchmark_runs = 20
+        benchmark_config.add_metric('total_time').add_metric(
+            'response_time').add_metric('schedule_lag')
+        benchmark_result = resttest.run_benchmark(benchmark_config)
+        self.assertEqual(0, benchmark_result.failures)
+        self.assertEqual(20, len(benchmark_result.results['response_time']))
+        for lag in benchmark_result.results['schedule_lag']:
+            self.assertTrue(lag >= 0)
+        # Response time can't be shorter than time spent on the request
+        self.assertTrue(sum(benchmark_result.results['response_time']) >=
+                        sum(benchmark_result.results['total_time']))
+
+    def test_benchmark_get_concurrent(self):
+        """ Benchmark local get test with several virtual users """
+        benchmark_config = resttest.Benchmark()
+        benchmark_config.url = self.prefix + '/api/person/'
+        benchmark_config.concurrency = 4
+        benchmark_config.benchmark_runs = 20
+        benchmark_config.add_metric('total_time').add_metric('total_time', 'median')
+        benchmark_result = resttest.run_benchmark(benchmark_config)
+        self.assertEqual(0, benchmark_result.failures)
+        self.assertEqual(20, len(benchmark_result.results['total_time']))
+        self.assertTrue(benchmark_result.throughput > 0)
+
+    def test_benchmark_get_distributed(self):
+        """ Benchmark local get test, with the load split over two agents """
+        agents = list()
+        for x in range(0, 2):
+            server = distributed.AgentServer(('127.0.0.1', 0), resttest.run_benchmark_job)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            agents.append(server.server_address)
+
+        benchmark_config = resttest.parse_benchmark(self.prefix, {
+            'url': '/api/person/', 'benchmark_runs': 21, 'concurrency': 4,
+            'metrics': ['total_time', {'total_time': 'median'}]})
+        benchmark_result = resttest.run_benchmark_distributed(
+            benchmark_config, agents=agents)
+        self.assertEqual(0, benchmark_result.failures)
+        self.assertEqual(21, len(benchmark_result.results['total_time']))
+        self.assertEqual(21, benchmark_result.count)
+        self.assertTrue(benchmark_result.throughput > 0)
+
     def test_use_validator_ext_jsonschema(self):
         try:
             import jsonschema           
@@ -0,0 +1,188 @@
+import math
+
+"""
+Constant-memory storage of benchmark metric values, as a log-linear histogram (like HdrHistogram)
+- Values are counted in buckets: each power of two is split into equal-width sub-buckets,
+  so any value is known to within a fixed relative error, no matter how large or small
+- Memory use depends on the range of values seen, not how many there are
+- Count, sum, mean, standard deviation, min and max are exact, percentiles come from buckets
+- Histograms with the same relative error can be merged, ex: from different workers or agents
+"""
+
+DEFAULT_RELATIVE_ERROR = 0.001  # Values are stored to within 0.1%
+
+
+class Histogram(object):
+    """ Log-linear histogram of non-negative numbers, see module docs
+        Has an append method like a list, so it can store values in place of one """
+
+    relative_error = DEFAULT_RELATIVE_ERROR
+    sub_buckets = None  # Buckets per power of two
+    counts = None  # Maps bucket index to count of values in it
+    zero_count = 0  # Values of exactly 0, which have no bucket
+    count = 0
+    total = 0  # Sum of values
+    mean_value = 0.0  # Running mean and sum of squared differences from it (Welford's method)
+    squares = 0.0
+    min_value = None
+    max_value = None
+
+    def __init__(self, relative_error=DEFAULT_RELATIVE_ERROR):
+        if relative_error <= 0 or relative_error >= 1:
+            raise ValueError("Histogram relative error must be between 0 and 1")
+        self.relative_error = relative_error
+        # Bucket midpoints are within 1 / (2 * sub_buckets) of the bucket's values, leave margin for rounding
+        self.sub_buckets = int(math.ceil(1.0 / relative_error))
+        self.counts = dict()
+
+    def __len__(self):
+        return self.count
+
+    def bucket_index(self, value):
+        """ Index of the bucket for a value > 0 """
+        mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        sub_bucket = min(int((mantissa - 0.5) * 2 * self.sub_buckets), self.sub_buckets - 1)
+        return exponent * self.sub_buckets + sub_bucket
+
+    def bucket_value(self, index):
+        """ Value representing a bucket: its midpoint, within relative_error of every value in it """
+        exponent = index // self.sub_buckets
+        sub_bucket = index % self.sub_buckets
+        return math.ldexp(0.5 + (sub_bucket + 0.5) / (2.0 * self.sub_buckets), exponent)
+
+    def append(self, value):
+        """ Add a value """
+        if value < 0:
+            raise ValueError("Histogram values must be >= 0: " + str(value))
+        if value == 0:
+            self.zero_count = self.zero_count + 1
+        else:
+            index = self.bucket_index(value)
+            self.counts[index] = self.counts.get(index, 0) + 1
+
+        self.count = self.count + 1
+        self.total = self.total + value
+        delta = value - self.mean_value
+        self.mean_value = self.mean_value + delta / float(self.count)
+        self.squares = self.squares + delta * (value - self.mean_value)
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+
+    def merge(self, other):
+        """ Add all values from another histogram to this one, returns self """
+        if other.sub_buckets != self.sub_buckets:
+            raise ValueError("Can't merge histograms with different relative errors")
+        if not other.count:
+            return self
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.zero_count = self.zero_count + other.zero_count
+
+        count = self.count + other.count
+        delta = other.mean_value - self.mean_value
+        self.squares = self.squares + other.squares + delta * delta * self.count * other.count / float(count)
+        self.mean_value = self.mean_value + delta * other.count / float(count)
+        self.count = count
+        self.total = self.total + other.total
+        if self.min_value is None or other.min_value < self.min_value:
+            self.min_value = other.min_value
+        if self.max_value is None or other.max_value > self.max_value:
+            self.max_value = other.max_value
+        return self
+
+    def value_counts(self):
+        """ List of (value, count) for each bucket in use, in increasing order of value """
+        output = list()
+        if self.zero_count:
+            output.append((0, self.zero_count))
+        for index in sorted(self.counts.keys()):
+            output.append((self.bucket_value(index), self.counts[index]))
+        return output
+
+    def value_at_rank(self, rank):
+        """ Approximate value at rank (0-based) in sorted order, clamped to the exact min and max """
+        if rank < 0 or rank >= self.count:
+            raise IndexError("Histogram rank out of range: " + str(rank))
+        if rank == 0:
+            return self.min_value
+        elif rank == self.count - 1:
+            return self.max_value
+        seen = 0
+        for value, count in self.value_counts():
+            seen = seen + count
+            if rank < seen:
+                return min(max(value, self.min_value), self.max_value)
+
+    def percentile(self, percent):
+        """ Approximate percentile (0-100), interpolating between the closest ranks like benchmarks.percentile """
+        position = (self.count - 1) * percent / 100.0
+        lower = int(math.floor(position))
+        upper = min(lower + 1, self.count - 1)
+        low_value = self.value_at_rank(lower)
+        return low_value + (self.value_at_rank(upper) - low_value) * (position - lower)
+
+    def mean(self):
+        return self.mean_value
+
+    def median(self):
+        """ Median, averaging the two middle values for an even count like benchmarks.median """
+        return (self.value_at_rank((self.count - 1) // 2) + self.value_at_rank(self.count // 2)) / 2.0
+
+    def std_deviation(self):
+        """ Population standard deviation, like benchmarks.std_deviation """
+        if self.count < 2:
+            return 0
+        return math.sqrt(self.squares / self.count)
+
+    def mean_harmonic(self):
+        """ Harmonic mean, approximated from buckets """
+        if self.zero_count:
+            return 0.0
+        reciprocals = sum([count / value for value, count in self.value_counts()])
+        return self.count / reciprocals
+
+    def aggregate(self, name):
+        """ Compute an aggregate by name, see benchmarks.AGGREGATES """
+        if name in (u'mean', u'mean_arithmetic'):
+            return self.mean()
+        elif name == u'mean_harmonic':
+            return self.mean_harmonic()
+        elif name == u'median':
+            return self.median()
+        elif name == u'std_deviation':
+            return self.std_deviation()
+        elif name in (u'sum', u'total'):
+            return self.total
+        elif name == u'min':
+            return self.min_value
+        elif name == u'max':
+            return self.max_value
+        raise ValueError("Aggregate not supported for histograms: " + str(name))
+
+    def to_dict(self):
+        """ Map of histogram contents, as JSON-able types, see from_dict """
+        return {u'relative_error': self.relative_error,
+                u'counts': [[index, count] for index, count in self.counts.items()],
+                u'zero_count': self.zero_count,
+                u'count': self.count,
+                u'total': self.total,
+                u'mean': self.mean_value,
+                u'squares': self.squares,
+                u'min': self.min_value,
+                u'max': self.max_value}
+
+    @staticmethod
+    def from_dict(node):
+        """ Rebuild a histogram from the output of to_dict """
+        histogram = Histogram(node[u'relative_error'])
+        histogram.counts = dict([(int(index), count) for index, count in node[u'counts']])
+        histogram.zero_count = node[u'zero_count']
+        histogram.count = node[u'count']
+        histogram.total = node[u'total']
+        histogram.mean_value = node[u'mean']
+        histogram.squares = node[u'squares']
+        histogram.min_value = node[u'min']
+        histogram.max_value = node[u'max']
+        return histogram
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import logging
+import subprocess
+from optparse import OptionParser
+
+"""
+Persistent history of benchmark results, in a SQLite database
+- Every benchmark run is recorded with a timestamp, label, git revision, base URL,
+  request counts and throughput, and all its aggregates (overall and per stage)
+- Trends can be queried and exported with the pyresttest-history command, ex:
+  p99 of total_time for the 'Basic GET' benchmark over the last 30 runs
+"""
+
+logger = logging.getLogger('pyresttest.history')
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        timestamp REAL NOT NULL,
+        label TEXT,
+        revision TEXT,
+        base_url TEXT,
+        benchmark TEXT NOT NULL,
+        benchmark_group TEXT,
+        count INTEGER,
+        failures INTEGER,
+        elapsed REAL,
+        throughput REAL)""",
+    """CREATE TABLE IF NOT EXISTS aggregates (
+        run_id INTEGER NOT NULL REFERENCES runs (id),
+        stage TEXT,
+        metric TEXT NOT NULL,
+        aggregate TEXT NOT NULL,
+        value REAL)""",
+    "CREATE INDEX IF NOT EXISTS runs_by_benchmark ON runs (benchmark, timestamp)",
+    "CREATE INDEX IF NOT EXISTS aggregates_by_run ON aggregates (run_id, metric, aggregate)"
+]
+
+# Values recorded once per run, which can be queried like a metric, ex: --metric throughput
+RUN_FIELDS = [u'count', u'failures', u'elapsed', u'throughput']
+
+HISTORY_FORMATS = [u'table', u'csv', u'json']
+
+# Seconds to wait for another process (ex: a worker) to finish writing
+LOCK_TIMEOUT = 30
+
+
+def git_revision(directory=None):
+    """ Short git revision checked out in a directory (default: working directory), or None if not in git """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                             cwd=directory, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('utf-8').strip() or None
+
+
+def format_timestamp(timestamp):
+    """ Seconds since the epoch as an ISO 8601 UTC time """
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+class HistoryStore(object):
+    """ SQLite database of benchmark results, see module docs """
+    path = None
+    connection = None
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, benchmark_result, base_url=None, label=None, revision=None, timestamp=None):
+        """ Record an analyzed BenchmarkResult, with its aggregates and stage aggregates
+            Returns the id of the run """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (timestamp, label, revision, base_url, benchmark, benchmark_group, "
+                "count, failures, elapsed, throughput) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (timestamp, label, revision, base_url, benchmark_result.name, benchmark_result.group,
+                 benchmark_result.count, benchmark_result.failures, benchmark_result.elapsed,
+                 benchmark_result.throughput))
+            run_id = cursor.lastrowid
+            rows = [(run_id, None, metric, aggregate, value)
+                    for metric, aggregate, value in benchmark_result.aggregates]
+            if benchmark_result.stage_aggregates:
+                rows.extend([(run_id, stage, metric, aggregate, value)
+                             for stage, metric, aggregate, value in benchmark_result.stage_aggregates])
+            self.connection.executemany(
+                "INSERT INTO aggregates (run_id, stage, metric, aggregate, value) VALUES (?, ?, ?, ?, ?)", rows)
+        return run_id
+
+    def query(self, benchmark, metric, aggregate=None, last=None, stage=None, label=None):
+        """ Values of an aggregate of a metric over runs of a benchmark, oldest first
+            The metric can also be one of RUN_FIELDS, with no aggregate
+            Limited to the last runs (a count), a stage name, and runs with a label, if given
+            Returns list of (timestamp, label, revision, value) """
+        if metric in RUN_FIELDS:
+            sql = "SELECT timestamp, label, revision, {0} FROM runs WHERE benchmark = ?".format(metric)
+            params = [benchmark]
+        else:
+            if aggregate is None:
+                raise ValueError("An aggregate is needed for metric: " + metric)
+            sql = ("SELECT runs.timestamp, runs.label, runs.revision, aggregates.value "
+                   "FROM runs JOIN aggregates ON aggregates.run_id = runs.id "
+                   "WHERE runs.benchmark = ? AND aggregates.metric = ? AND aggregates.aggregate = ?")
+            params = [benchmark, metric, aggregate]
+            if stage is None:
+                sql = sql + " AND aggregates.stage IS NULL"
+            else:
+                sql = sql + " AND aggregates.stage = ?"
+                params.append(stage)
+        if label is not None:
+            sql = sql + " AND label = ?"
+            params.append(label)
+        sql = sql + " ORDER BY timestamp DESC, runs.id DESC"
+        if last is not None:
+            sql = sql + " LIMIT ?"
+            params.append(int(last))
+        rows = self.connection.execute(sql, params).fetchall()
+        rows.reverse()
+        return [tuple(row) for row in rows]
+
+    def summary(self):
+        """ What has been recorded: list of (benchmark, metric, aggregate, number of runs) """
+        rows = self.connection.execute(
+            "SELECT runs.benchmark, aggregates.metric, aggregates.aggregate, COUNT(DISTINCT runs.id) "
+            "FROM runs JOIN aggregates ON aggregates.run_id = runs.id WHERE aggregates.stage IS NULL "
+            "GROUP BY runs.benchmark, aggregates.metric, aggregates.aggregate "
+            "ORDER BY runs.benchmark, aggregates.metric, aggregates.aggregate").fetchall()
+        return [tuple(row) for row in rows]
+
+
+def record_result(path, benchmark_result, base_url=None, label=None):
+    """ Record an analyzed BenchmarkResult in the history database at path, with the current git revision """
+    store = HistoryStore(path)
+    try:
+        return store.record(benchmark_result, base_url=base_url, label=label, revision=git_revision())
+    finally:
+        store.close()
+
+
+def write_history(file_out, rows, output_format=u'table'):
+    """ Write rows from HistoryStore.query, as a table, CSV or JSON """
+    header = (u'timestamp', u'label', u'revision', u'value')
+    rows = [(format_timestamp(timestamp), label, revision, value) for timestamp, label, revision, value in rows]
+    if output_format == u'json':
+        json.dump([dict(zip(header, row)) for row in rows], file_out, indent=2)
+        file_out.write(u'\n')
+    elif output_format == u'csv':
+        writer = csv.writer(file_out)
+        writer.writerow(header)
+        writer.writerows([['' if value is None else value for value in row] for row in rows])
+    else:
+        cells = [header] + [tuple([u'' if value is None else str(value) for value in row]) for row in rows]
+        widths = [max([len(row[index]) for row in cells]) for index in range(0, len(header))]
+        for row in cells:
+            file_out.write(u'  '.join([value.ljust(width) for value, width in zip(row, widths)]).rstrip() + u'\n')
+
+
+def main(args):
+    """
+    Query the history of benchmark results.
+
+    Keys allowed for args:
+        history       - REQUIRED - History database file
+        benchmark     - OPTIONAL - Benchmark name, if not given lists what has been recorded
+        metric        - OPTIONAL - Metric name, or one of count/failures/elapsed/throughput (default total_time)
+        aggregate     - OPTIONAL - Aggregate name (default mean)
+        last          - OPTIONAL - Only the last N runs
+        stage         - OPTIONAL - Stage name, for a staged benchmark
+        label         - OPTIONAL - Only runs with this label
+        format        - OPTIONAL - Output format: table, csv or json (default table)
+        output        - OPTIONAL - File to export to, instead of the terminal
+    """
+    if not os.path.exists(args['history']):
+        raise ValueError("No history database at: " + args['history'])
+    output_format = (args.get('format') or u'table').lower()
+    if output_format not in HISTORY_FORMATS:
+        raise ValueError("Invalid history output format: " + output_format)
+
+    store = HistoryStore(args['history'])
+    try:
+        if not args.get('benchmark'):
+            for benchmark, metric, aggregate, runs in store.summary():
+                print(u"{0}: {1} {2} ({3} runs)".format(benchmark, metric, aggregate, runs))
+            return
+        metric = args.get('metric') or u'total_time'
+        aggregate = None if metric in RUN_FIELDS else (args.get('aggregate') or u'mean')
+        rows = store.query(args['benchmark'], metric, aggregate, last=args.get('last'),
+                           stage=args.get('stage'), label=args.get('label'))
+    finally:
+        store.close()
+
+    if args.get('output'):
+        with open(args['output'], 'w') as file_out:
+            write_history(file_out, rows, output_format)
+    else:
+        write_history(sys.stdout, rows, output_format)
+
+
+def parse_command_line_args(args_in):
+    parser = OptionParser(
+        usage="usage: %prog history_file [options]\n"
+              "  ex: %prog history.db --benchmark 'Basic GET' --metric total_time --aggregate p99 --last 30")
+    parser.add_option(u'--benchmark', help='Benchmark name, if not given lists what has been recorded',
+                      action="store", type="string")
+    parser.add_option(u'--metric', help='Metric name, or count/failures/elapsed/throughput (default total_time)',
+                      action="store", type="string")
+    parser.add_option(u'--aggregate', help='Aggregate name (default mean)',
+                      action="store", type="string")
+    parser.add_option(u'--last', help='Only the last N runs',
+                      action="store", type="int")
+    parser.add_option(u'--stage', help='Stage name, for a staged benchmark',
+                      action="store", type="string")
+    parser.add_option(u'--label', help='Only runs with this label',
+                      action="store", type="string")
+    parser.add_option(u'--format', help='Output format: table, csv or json (default table)',
+                      action="store", type="string")
+    parser.add_option(u'--output', help='File to export to, instead of the terminal',
+                      action="store", type="string")
+
+    (args, unparsed_args) = parser.parse_args(args_in)
+    if len(unparsed_args) != 1:
+        parser.print_help()
+        parser.error("need the history database file")
+    args = vars(args)
+    args['history'] = unparsed_args[0]
+    return args
+
+
+def command_line_run(args_in):
+    main(parse_command_line_args(args_in))
+
+# Allow import into another module without executing the main method
+if __name__ == '__main__':
+    command_line_run(sys.argv[1:])
@@ -0,0 +1,154 @@
+import csv
+import json
+from collections import OrderedDict
+
+from .benchmarks import CLIENT_METRICS, DERIVED_METRICS, DEFAULT_INTERVAL, INTERVAL_FORMATS, PERCENTILES, sorted_percentile, timer
+
+"""
+Time-series output while a benchmark runs: one row of statistics per interval
+- Intervals are a fixed length of time (ex: each second), or a fixed number of requests
+- Each row has the count of requests, failures, throughput, and latency percentiles for the interval
+- Rows are written and flushed as each interval ends, as JSON lines or CSV,
+  so a long soak test can be watched live, and a killed run loses only the last interval
+"""
+
+# Percentiles for each latency metric in an interval, which also gets the max
+INTERVAL_PERCENTILES = [u'p50', u'p90', u'p99']
+
+
+def is_latency_metric(metricname):
+    """ True if a metric is a time, which gets percentiles in interval output """
+    return metricname.endswith(u'_time') or metricname in CLIENT_METRICS or metricname in DERIVED_METRICS
+
+
+class IntervalRecorder(object):
+    """ Writes a row of statistics to a file for each interval of a running benchmark
+        A MetricCollector passes it the values for each request (record) and failures (record_failure)
+        Times in output are seconds since start() was called """
+    file_out = None
+    output_format = u'json'
+    interval = DEFAULT_INTERVAL  # Seconds in each interval, if not by requests
+    interval_requests = None  # Requests in each interval, instead of by time
+    latency_indices = None  # Tuples of (metric name, index in values, index to subtract or None) for latency metrics
+    columns = None
+    writer = None  # CSV writer
+    start_time = None
+    index = 0  # Index of the current interval
+    interval_start = 0.0
+    count = 0  # Successful requests in the current interval
+    failures = 0
+    values = None  # List of values for each latency metric in the current interval
+
+    def __init__(self, file_out, metricnames, output_format=u'json', interval=DEFAULT_INTERVAL, interval_requests=None,
+                 reported_metrics=None):
+        """ metricnames are the names for values passed to record, reported_metrics (default all of them)
+            the metrics to output, which may include DERIVED_METRICS computed from values """
+        if output_format not in INTERVAL_FORMATS:
+            raise ValueError("Invalid interval output format: " + str(output_format))
+        self.file_out = file_out
+        self.output_format = output_format
+        self.interval = interval
+        self.interval_requests = interval_requests
+        metricnames = list(metricnames)
+        if reported_metrics is None:
+            reported_metrics = metricnames
+        self.latency_indices = list()
+        ordered = ([name for name in metricnames if name in reported_metrics] +
+                   sorted([name for name in reported_metrics if name not in metricnames]))
+        for name in ordered:
+            if not is_latency_metric(name):
+                continue
+            if name in metricnames:
+                self.latency_indices.append((name, metricnames.index(name), None))
+            elif name in DERIVED_METRICS:
+                end, start = DERIVED_METRICS[name]
+                self.latency_indices.append((name, metricnames.index(end),
+                                             None if start is None else metricnames.index(start)))
+        self.columns = [u'interval', u'start', u'end', u'count', u'failures', u'throughput']
+        for name, index, start in self.latency_indices:
+            self.columns.extend([name + u'_' + aggregate for aggregate in INTERVAL_PERCENTILES])
+            self.columns.append(name + u'_max')
+
+    def start(self, now=None):
+        """ Start the first interval, and write the CSV header """
+        self.start_time = timer() if now is None else now
+        self.index = 0
+        self.interval_start = 0.0
+        self.reset()
+        if self.output_format == u'csv':
+            self.writer = csv.writer(self.file_out)
+            self.writer.writerow(self.columns)
+            self.file_out.flush()
+
+    def reset(self):
+        self.count = 0
+        self.failures = 0
+        self.values = [list() for x in self.latency_indices]
+
+    def elapsed(self, now=None):
+        return (timer() if now is None else now) - self.start_time
+
+    def tick(self, now=None):
+        """ Write rows for all intervals that have ended by now, if intervals are by time
+            Called on each request, and periodically so intervals with no requests are written """
+        if self.interval_requests is not None:
+            return
+        elapsed = self.elapsed(now)
+        while elapsed >= self.interval_start + self.interval:
+            self.write_row(self.interval_start + self.interval)
+
+    def record(self, values, now=None):
+        """ Add values for a successful request, in the order of the collector's metricnames """
+        self.tick(now)
+        self.count = self.count + 1
+        for window, (name, index, start) in zip(self.values, self.latency_indices):
+            if start is None:
+                window.append(values[index])
+            else:
+                window.append(max(values[index] - values[start], 0.0))
+        self.check_requests(now)
+
+    def record_failure(self, now=None):
+        """ Count a failed request """
+        self.tick(now)
+        self.failures = self.failures + 1
+        self.check_requests(now)
+
+    def check_requests(self, now=None):
+        """ End the interval if it has all its requests, for intervals by request count """
+        if self.interval_requests is not None and self.count + self.failures >= self.interval_requests:
+            self.write_row(self.elapsed(now))
+
+    def row(self, end):
+        """ Statistics for the current interval, ending at end seconds, as a list in the order of columns """
+        length = end - self.interval_start
+        output = [self.index, self.interval_start, end, self.count, self.failures,
+                  self.count / length if length > 0 else None]
+        for window in self.values:
+            if window:
+                window.sort()
+                output.extend([sorted_percentile(window, PERCENTILES[aggregate])
+                               for aggregate in INTERVAL_PERCENTILES])
+                output.append(window[-1])
+            else:
+                output.extend([None] * (len(INTERVAL_PERCENTILES) + 1))
+        return output
+
+    def write_row(self, end):
+        """ Write the current interval, ending at end seconds, and start the next one """
+        row = self.row(end)
+        if self.output_format == u'csv':
+            self.writer.writerow(['' if value is None else value for value in row])
+        else:
+            self.file_out.write(json.dumps(OrderedDict(zip(self.columns, row))) + u'\n')
+        self.file_out.flush()
+        self.index = self.index + 1
+        self.interval_start = end
+        self.reset()
+
+    def close(self, now=None):
+        """ Write the last, partial interval if it had any requests, and close the file """
+        self.tick(now)
+        if self.count or self.failures:
+            self.write_row(self.elapsed(now))
+        self.file_out.close()
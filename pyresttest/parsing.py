@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 import sys
 import string
+import threading
+from collections import OrderedDict
 
 
 # Python 3 compatibility shims
@@ -36,7 +38,115 @@ def encode_unicode_bytes(my_string):
         elif isinstance(my_string, bytes):
             return my_string
 
-# TODO create a full class that extends string.Template
+# Most compiled templates kept by the shared TemplateCache, the least recently used are dropped past this
+TEMPLATE_CACHE_SIZE = 1024
+
+
+class CompiledTemplate(string.Template):
+    """ string.Template that is parsed once, into literal text and variable references,
+        so safe_substitute joins the parts instead of scanning the text with a regex every time """
+    parts = None  # Literal strings, and tuples of (variable name, original text) for variables
+    literal = None  # Substituted text if there are no variables, which is always the same
+    variables = frozenset()  # Names of variables used
+
+    def __init__(self, template):
+        string.Template.__init__(self, template)
+        self.parts = list()
+        position = 0
+        for match in self.pattern.finditer(template):
+            literal = template[position:match.start()]
+            if match.group('escaped') is not None:
+                literal = literal + self.delimiter
+            elif match.group('invalid') is not None:
+                literal = literal + match.group()
+            if literal:
+                self.parts.append(literal)
+            name = match.group('named') or match.group('braced')
+            if name is not None:
+                self.parts.append((name, match.group()))
+            position = match.end()
+        if position < len(template):
+            self.parts.append(template[position:])
+        self.variables = frozenset([part[0] for part in self.parts if part.__class__ is tuple])
+        if not self.variables:
+            self.literal = template[0:0].join(self.parts)
+
+    def safe_substitute(self, *args, **kws):
+        """ Same as string.Template.safe_substitute, variables not in the mapping are left as-is """
+        if kws or len(args) != 1:
+            return string.Template.safe_substitute(self, *args, **kws)
+        if self.literal is not None:
+            return self.literal
+        mapping = args[0]
+        output = list()
+        for part in self.parts:
+            if part.__class__ is tuple:
+                try:
+                    output.append('%s' % (mapping[part[0]],))
+                except KeyError:
+                    output.append(part[1])
+            else:
+                output.append(part)
+        return self.template[0:0].join(output)
+
+
+class TemplateCache(object):
+    """ Bounded LRU cache of CompiledTemplate, keyed by template text
+        Shared by tests, content handlers, extractors and validators, so a template is compiled once """
+    max_size = TEMPLATE_CACHE_SIZE
+    templates = None  # OrderedDict of template text to CompiledTemplate, least recently used first
+    lock = None  # Held to add templates, lookups of cached templates don't need it
+    misses = 0  # Templates compiled
+
+    def __init__(self, max_size=TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self.templates = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.templates)
+
+    def get(self, text):
+        """ Compiled template for text, compiling and caching it if not already cached """
+        try:
+            template = self.templates[text]
+        except KeyError:
+            return self.add(text)
+        if PYTHON_MAJOR_VERSION > 2:
+            try:
+                self.templates.move_to_end(text)  # Now the most recently used, atomic so no lock
+            except KeyError:  # Dropped by another thread just now
+                pass
+        else:
+            with self.lock:
+                if self.templates.pop(text, None) is not None:
+                    self.templates[text] = template
+        return template
+
+    def add(self, text):
+        """ Compile and cache a template, dropping the least recently used if full """
+        template = CompiledTemplate(text)
+        with self.lock:
+            self.misses = self.misses + 1
+            self.templates.pop(text, None)
+            while len(self.templates) >= self.max_size:
+                self.templates.popitem(last=False)
+            self.templates[text] = template
+        return template
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+            self.misses = 0
+
+TEMPLATE_CACHE = TemplateCache()
+
+
+def get_template(text):
+    """ Compiled string.Template for text, from the shared template cache """
+    return TEMPLATE_CACHE.get(text)
+
+
 def safe_substitute_unicode_template(templated_string, variable_map):
     """ Perform string.Template safe_substitute on unicode input with unicode variable values by using escapes
         Catch: cannot accept unicode variable names, just values
@@ -44,9 +154,9 @@ def safe_substitute_unicode_template(templated_string, variable_map):
     """
 
     if PYTHON_MAJOR_VERSION > 2:  # Python 3 handles unicode templating natively, yay!
-        return string.Template(templated_string).safe_substitute(variable_map)
+        return get_template(templated_string).safe_substitute(variable_map)
 
-    my_template = string.Template(encode_unicode_bytes(templated_string))
+    my_template = get_template(encode_unicode_bytes(templated_string))
     my_escaped_dict = dict(map(lambda x: (x[0], encode_unicode_bytes(x[1])), variable_map.items()))
     templated = my_template.safe_substitute(my_escaped_dict)
     return text_type(templated, 'utf-8')
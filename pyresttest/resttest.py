@@ -9,6 +9,9 @@ import json
 import csv
 import logging
 import threading
+import heapq
+import random
+import multiprocessing
 from optparse import OptionParser
 from email import message_from_string  # For headers handling
 import time
@@ -42,7 +45,16 @@ if __name__ == '__main__':
 
     from pyresttest.validators import Failure
     from pyresttest.tests import Test, DEFAULT_TIMEOUT
-    from pyresttest.benchmarks import Benchmark, AGGREGATES, METRICS, parse_benchmark
+    from pyresttest.contenthandling import ContentHandler
+    from pyresttest.benchmarks import Benchmark, AGGREGATES, METRICS, MetricCollector, parse_benchmark, request_schedule, closed_loop_runs, compute_aggregate, presort, select_stage, derive_metrics, mser_truncation, WARMUP_METRIC, CLIENT_PHASE_METRICS
+    from pyresttest.scheduling import build_dependency_graph
+    from pyresttest.connections import CurlPool
+    from pyresttest.transports import TRANSPORTS, PycurlTransport
+    from pyresttest.histogram import Histogram
+    from pyresttest import distributed
+    from pyresttest import baseline
+    from pyresttest.intervals import IntervalRecorder
+    from pyresttest import history
 else:  # Normal imports
     from . import six
     from .six import text_type
@@ -58,8 +70,22 @@ else:  # Normal imports
     from .validators import Failure
     from . import tests
     from .tests import Test, DEFAULT_TIMEOUT
+    from .contenthandling import ContentHandler
     from . import benchmarks
-    from .benchmarks import Benchmark, AGGREGATES, METRICS, parse_benchmark
+    from .benchmarks import Benchmark, AGGREGATES, METRICS, MetricCollector, parse_benchmark, request_schedule, closed_loop_runs, compute_aggregate, presort, select_stage, derive_metrics, mser_truncation, WARMUP_METRIC, CLIENT_PHASE_METRICS
+    from . import scheduling
+    from .scheduling import build_dependency_graph
+    from . import connections
+    from .connections import CurlPool
+    from . import transports
+    from .transports import TRANSPORTS, PycurlTransport
+    from . import histogram
+    from .histogram import Histogram
+    from . import distributed
+    from . import baseline
+    from . import intervals
+    from .intervals import IntervalRecorder
+    from . import history
 
 """
 Executable class, ties everything together into the framework.
@@ -77,6 +103,12 @@ LOGGING_LEVELS = {'debug': logging.DEBUG,
                   'error': logging.ERROR,
                   'critical': logging.CRITICAL}
 
+DEFAULT_MAX_CONCURRENT = 10  # Max in-flight requests for parallel test execution
+OPEN_LOOP_MAX_IN_FLIGHT = 1000  # Default cap on requests in flight for open-loop benchmarks
+
+# Best clock available for measuring intervals
+timer = getattr(time, 'perf_counter', time.time)
+
 logging.basicConfig(format='%(levelname)s:%(message)s')
 logger = logging.getLogger('pyresttest')
 
@@ -107,6 +139,9 @@ class TestConfig:
     print_headers = False  # Print response bodies in all cases
     retries = 0  # Retries on failures
     test_parallel = False  # Allow parallel execution of tests in a test set, for speed?
+    max_concurrent = DEFAULT_MAX_CONCURRENT  # Max tests in flight at once when running in parallel
+    connection_reuse = False  # Keep connections open for reuse, instead of a new one per request
+    transport = u'pycurl'  # Name of transport to run requests with, see transports.TRANSPORTS
     interactive = False
     verbose = False
     ssl_insecure = False
@@ -115,6 +150,7 @@ class TestConfig:
     # Binding and creation of generators
     variable_binds = None
     generators = None  # Map of generator name to generator function
+    generator_configs = None  # Map of generator name to its configuration, to build it again on agents
 
     def __str__(self):
         return json.dumps(self, default=safe_to_json)
@@ -143,6 +179,22 @@ class BenchmarkResult:
     results = dict()  # Benchmark output, map the metric to the result array for that metric
     aggregates = list()  # List of aggregates, as tuples of (metricname, aggregate, result)
     failures = 0  # Track call count that failed
+    count = 0  # Requests that succeeded
+    elapsed = None  # Seconds taken to run the benchmark, after warmup
+    throughput = None  # Successful requests per second
+    sample_stages = None  # Raw output, index of the stage each result was in, for staged benchmarks
+    stage_results = None  # Raw output for staged benchmarks with histogram storage, stage index to results map
+    stage_aggregates = None  # For staged benchmarks, tuples of (stage name, metricname, aggregate, result)
+    warmup_cutoff = None  # With automatic warmup, count of requests at the start left out of results
+    status_counts = None  # Maps HTTP status code to count of responses
+    error_counts = None  # Maps curl error code (or exception type name) to count of requests without a response
+    failure_results = None  # Raw output for failed responses (unexpected status or validation), metric to values
+    failure_aggregates = None  # Aggregates over failure_results, tuples of (metricname, aggregate, result)
+    validated = 0  # Responses sampled and validated, with validate_sample_rate
+    validation_failures = 0
+    threshold_checks = None  # Tuples of (metricname, aggregate or None, threshold, value, passed)
+    # With a baseline, tuples of (metricname, aggregate, baseline, result, change, p-value, regressed)
+    comparisons = None
 
     def __init__(self):
         self.aggregates = list()
@@ -162,6 +214,7 @@ class TestResponse:
     passed = False
     response_headers = None
     failures = None
+    client_times = None  # Seconds pyresttest spent preparing the request, map of client metric name to value
 
     def __init__(self):
         self.failures = list()
@@ -283,6 +336,20 @@ def parse_configuration(node, base_config=None):
             test_config.print_bodies = safe_to_bool(value)
         elif key == u'retries':
             test_config.retries = int(value)
+        elif key == u'test_parallel':
+            test_config.test_parallel = safe_to_bool(value)
+        elif key == u'connection_reuse':
+            test_config.connection_reuse = safe_to_bool(value)
+        elif key == u'transport':
+            name = str(value).lower()
+            if name not in TRANSPORTS:
+                raise ValueError("Invalid transport: {0}, must be one of: {1}".format(
+                    value, ', '.join(sorted(TRANSPORTS.keys()))))
+            test_config.transport = name
+        elif key == u'max_concurrent':
+            test_config.max_concurrent = int(value)
+            if test_config.max_concurrent < 1:
+                raise ValueError("max_concurrent must be at least 1")
         elif key == u'variable_binds':
             if not test_config.variable_binds:
                 test_config.variable_binds = dict()
@@ -294,6 +361,7 @@ def parse_configuration(node, base_config=None):
                 gen = parse_generator(generator_config)
                 gen_map[str(generator_name)] = gen
             test_config.generators = gen_map
+            test_config.generator_configs = flat
 
     return test_config
 
@@ -306,18 +374,37 @@ def read_file(path):
     return string
 
 
-def run_test(mytest, test_config=TestConfig(), context=None, curl_handle=None, *args, **kwargs):
-    """ Put together test pieces: configure & run actual test, return results """
+def realize_timed(mytest, context=None):
+    """ Bind context and template a test (or benchmark), timing both as client overhead
+        Returns tuple of (templated test, client_times), with the seconds for each of CLIENT_PHASE_METRICS
+        client_times is a list, the caller fills in the time to configure the request """
+    before = timer()
+    mytest.update_context_before(context)
+    contexted = timer()
+    templated_test = mytest.realize(context)
+    return templated_test, [contexted - before, timer() - contexted, 0.0]
 
-    # Initialize a context if not supplied
-    my_context = context
-    if my_context is None:
-        my_context = Context()
 
-    mytest.update_context_before(my_context)
-    templated_test = mytest.realize(my_context)
+def client_times_map(client_times):
+    """ Map of client metric name to seconds, from client_times for each of CLIENT_PHASE_METRICS """
+    output = dict(zip(CLIENT_PHASE_METRICS, client_times))
+    output['client_prepare_time'] = sum(client_times)
+    return output
+
+
+def setup_test_run(mytest, test_config=TestConfig(), context=None, curl_handle=None, curl_pool=None):
+    """ Bind context and template the test, then configure a curl call for it
+        If a CurlPool is given, the curl handle comes from it and connections are reused
+        Returns tuple of (templated test, curl, TestResponse, header buffer, body buffer) """
+    templated_test, client_times = realize_timed(mytest, context)
+    configure_start = timer()
+    curl_share = None
+    if curl_pool is not None:
+        curl_handle = curl_pool.acquire(templated_test.url)
+        curl_share = curl_pool.share
     curl = templated_test.configure_curl(
-        timeout=test_config.timeout, context=my_context, curl_handle=curl_handle)
+        timeout=test_config.timeout, context=context, curl_handle=curl_handle, curl_share=curl_share,
+        verbose=test_config.verbose, ssl_insecure=test_config.ssl_insecure)
     result = TestResponse()
     result.test = templated_test
 
@@ -326,51 +413,32 @@ def run_test(mytest, test_config=TestConfig(), context=None, curl_handle=None, *
     body = MyIO()
     curl.setopt(pycurl.WRITEFUNCTION, body.write)
     curl.setopt(pycurl.HEADERFUNCTION, headers.write)
-    if test_config.verbose:
-        curl.setopt(pycurl.VERBOSE, True)
-    if test_config.ssl_insecure:
-        curl.setopt(pycurl.SSL_VERIFYPEER, 0)
-        curl.setopt(pycurl.SSL_VERIFYHOST, 0)
+    client_times[2] = timer() - configure_start
+    result.client_times = client_times_map(client_times)
 
     result.passed = None
+    return templated_test, curl, result, headers, body
 
-    if test_config.interactive:
-        print("===================================")
-        print("%s" % mytest.name)
-        print("-----------------------------------")
-        print("REQUEST:")
-        print("%s %s" % (templated_test.method, templated_test.url))
-        print("HEADERS:")
-        print("%s" % (templated_test.headers))
-        if mytest.body is not None:
-            print("\n%s" % templated_test.body)
-        raw_input("Press ENTER when ready (%d): " % (mytest.delay))
 
-    if mytest.delay > 0:
-        print("Delaying for %ds" % mytest.delay)
-        time.sleep(mytest.delay)
+def curl_failure(result, message, details=None):
+    """ Mark a test result as failed because the curl call itself failed (network error) """
+    result.failures.append(Failure(message="Curl Exception: {0}".format(
+        message), details=details, failure_type=validators.FAILURE_CURL_EXCEPTION))
+    result.passed = False
+    return result
 
-    try:
-        curl.perform()  # Run the actual call
-    except Exception as e:
-        # Curl exception occurred (network error), do not pass go, do not
-        # collect $200
-        trace = traceback.format_exc()
-        result.failures.append(Failure(message="Curl Exception: {0}".format(
-            e), details=trace, failure_type=validators.FAILURE_CURL_EXCEPTION))
-        result.passed = False
-        curl.close()
-        return result
 
-    # Retrieve values
-    result.body = body.getvalue()
-    body.close()
-    result.response_headers = text_type(headers.getvalue(), HEADER_ENCODING)  # Per RFC 2616
-    headers.close()
+def process_test_response(mytest, test_config, context, result, response_code, headers, body):
+    """ Check a response (code, raw header bytes and body bytes) for a test, validate and extract """
 
-    response_code = curl.getinfo(pycurl.RESPONSE_CODE)
+    # Retrieve values
+    result.body = body
+    result.response_headers = text_type(headers, HEADER_ENCODING)  # Per RFC 2616
     result.response_code = response_code
 
+    if result.client_times is not None:
+        logger.debug("Client overhead preparing request: {0:.6f} seconds".format(
+            result.client_times['client_prepare_time']))
     logger.debug("Initial Test Result, based on expected response code: " +
                  str(response_code in mytest.expected_status))
 
@@ -392,7 +460,6 @@ def run_test(mytest, test_config=TestConfig(), context=None, curl_handle=None, *
         result.failures.append(Failure(message="Header parsing exception: {0}".format(
             e), details=trace, failure_type=validators.FAILURE_TEST_EXCEPTION))
         result.passed = False
-        curl.close()
         return result
 
     # print str(test_config.print_bodies) + ',' + str(not result.passed) + ' ,
@@ -409,7 +476,7 @@ def run_test(mytest, test_config=TestConfig(), context=None, curl_handle=None, *
             failures = result.failures
             for validator in mytest.validators:
                 validate_result = validator.validate(
-                    body=body, headers=head, context=my_context)
+                    body=body, headers=head, context=context)
                 if not validate_result:
                     result.passed = False
                 # Proxy for checking if it is a Failure object, because of
@@ -421,7 +488,7 @@ def run_test(mytest, test_config=TestConfig(), context=None, curl_handle=None, *
             logger.debug("no validators found")
 
         # Only do context updates if test was successful
-        mytest.update_context_after(result.body, head, my_context)
+        mytest.update_context_after(result.body, head, context)
 
     # Print response body if override is set to print all *OR* if test failed
     # (to capture maybe a stack trace)
@@ -441,9 +508,166 @@ def run_test(mytest, test_config=TestConfig(), context=None, curl_handle=None, *
     return result
 
 
-def run_benchmark(benchmark, test_config=TestConfig(), context=None, *args, **kwargs):
+def run_test(mytest, test_config=TestConfig(), context=None, curl_handle=None, curl_pool=None,
+             transport=None, *args, **kwargs):
+    """ Put together test pieces: configure & run actual test, return results
+        Uses curl handles from curl_pool if given (connection reuse), otherwise curl_handle
+        If a Transport is given, the request is run with it instead """
+
+    # Initialize a context if not supplied
+    my_context = context
+    if my_context is None:
+        my_context = Context()
+
+    if transport is not None:  # Configuring the request is part of running it on the transport
+        templated_test, client_times = realize_timed(mytest, my_context)
+        result = TestResponse()
+        result.test = templated_test
+        result.client_times = client_times_map(client_times)
+    else:
+        templated_test, curl, result, headers, body = setup_test_run(
+            mytest, test_config=test_config, context=my_context, curl_handle=curl_handle, curl_pool=curl_pool)
+
+    if test_config.interactive:
+        print("===================================")
+        print("%s" % mytest.name)
+        print("-----------------------------------")
+        print("REQUEST:")
+        print("%s %s" % (templated_test.method, templated_test.url))
+        print("HEADERS:")
+        print("%s" % (templated_test.headers))
+        if mytest.body is not None:
+            print("\n%s" % templated_test.body)
+        raw_input("Press ENTER when ready (%d): " % (mytest.delay))
+
+    if mytest.delay > 0:
+        print("Delaying for %ds" % mytest.delay)
+        time.sleep(mytest.delay)
+
+    if transport is not None:
+        response = transport.perform(templated_test, context=my_context)
+        if response.error is not None:
+            return curl_failure(result, response.error)
+        process_test_response(mytest, test_config, my_context, result,
+                              response.response_code, response.headers, response.body)
+        return result
+
+    try:
+        curl.perform()  # Run the actual call
+    except Exception as e:
+        # Curl exception occurred (network error), do not pass go, do not
+        # collect $200
+        trace = traceback.format_exc()
+        curl.close()
+        return curl_failure(result, e, details=trace)
+
+    process_test_response(mytest, test_config, my_context, result,
+                          curl.getinfo(pycurl.RESPONSE_CODE), headers.getvalue(), body.getvalue())
+    headers.close()
+    body.close()
+    if curl_pool is not None:
+        curl_pool.release(templated_test.url, curl)
+    return result
+
+
+def create_transport(test_config=TestConfig(), curl_pool=None, curl_handles=None):
+    """ Create the Transport named in test_config, pycurl transports use curl_pool or curl_handles if given """
+    if test_config.transport == PycurlTransport.name:
+        return PycurlTransport(timeout=test_config.timeout, ssl_insecure=test_config.ssl_insecure,
+                               verbose=test_config.verbose, curl_pool=curl_pool, curl_handles=curl_handles)
+    return TRANSPORTS[test_config.transport](timeout=test_config.timeout, ssl_insecure=test_config.ssl_insecure,
+                                             verbose=test_config.verbose, connection_reuse=test_config.connection_reuse)
+
+
+def run_tests_parallel(mytests, test_config=TestConfig(), context=None, max_concurrent=None, curl_pool=None,
+                       transport=None):
+    """ Run tests concurrently on a Transport (by default pycurl, on a CurlMulti),
+        with up to max_concurrent requests in flight
+        Tests are started in order as soon as the tests they depend on (by data flow through
+        the context, see scheduling.build_dependency_graph) have finished.
+        If a test with stop_on_failure fails, no later tests are started.
+        Curl handles come from curl_pool if given, so connections are reused.
+
+        Returns list of (test, TestResponse) tuples in test order, for the tests actually run """
+
+    my_context = context
+    if my_context is None:
+        my_context = Context()
+    if max_concurrent is None:
+        max_concurrent = test_config.max_concurrent
+
+    # Count unfinished dependencies for each test, tests with none are ready to go
+    dependencies = build_dependency_graph(mytests)
+    waiting_on = [len(deps) for deps in dependencies]
+    dependents = [list() for x in mytests]
+    for index, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(index)
+    ready = [index for index, count in enumerate(waiting_on) if count == 0]
+    heapq.heapify(ready)
+
+    own_transport = transport is None
+    if own_transport:
+        transport = create_transport(test_config, curl_pool=curl_pool)
+    in_flight = dict()  # Maps test index to TestResponse, for tests started but not finished
+    results = dict()
+
+    while True:
+        # Start ready tests, in test order
+        while ready and len(in_flight) < max_concurrent:
+            index = heapq.heappop(ready)
+            test = mytests[index]
+            if test.delay > 0:  # Only runs once everything before it is done
+                print("Delaying for %ds" % test.delay)
+                time.sleep(test.delay)
+
+            templated_test, client_times = realize_timed(test, my_context)
+            result = TestResponse()
+            result.test = templated_test
+            in_flight[index] = result
+            configure_start = timer()
+            transport.start(templated_test, context=my_context, key=index)
+            client_times[2] = timer() - configure_start
+            result.client_times = client_times_map(client_times)
+
+        if not in_flight:
+            break
+
+        for index, response in transport.wait():
+            test = mytests[index]
+            result = in_flight.pop(index)
+            if response.error is not None:
+                curl_failure(result, response.error)
+            else:
+                process_test_response(test, test_config, my_context, result,
+                                      response.response_code, response.headers, response.body)
+            results[index] = result
+
+            # Everything after a failed stop_on_failure test depends on it, and never starts
+            if result.passed or not test.stop_on_failure:
+                for dependent in dependents[index]:
+                    waiting_on[dependent] = waiting_on[dependent] - 1
+                    if waiting_on[dependent] == 0:
+                        heapq.heappush(ready, dependent)
+
+    if own_transport:
+        transport.close()
+    return [(mytests[i], results[i]) for i in sorted(results.keys())]
+
+
+def run_benchmark(benchmark, test_config=TestConfig(), context=None, curl_pool=None, transport=None, *args, **kwargs):
+    """ Perform a benchmark and analyze the results, see collect_benchmark """
+    output = collect_benchmark(benchmark, test_config=test_config, context=context,
+                               curl_pool=curl_pool, transport=transport)
+    return analyze_benchmark_results(output, benchmark)
+
+
+def collect_benchmark(benchmark, test_config=TestConfig(), context=None, curl_pool=None, transport=None):
     """ Perform a benchmark, (re)using a given, configured CURL call to do so
-        The actual analysis of metrics is performed separately, to allow for testing
+        Returns a BenchmarkResult with raw results, the analysis of metrics is performed separately
+        With connection_reuse configured, connections are kept open (and shared via curl_pool)
+        If the benchmark has a rate or concurrency, several requests run at once on a Transport
+        Requests are run with the given transport, or one created for test_config.transport if not pycurl
     """
 
     # Context handling
@@ -473,20 +697,42 @@ def run_benchmark(benchmark, test_config=TestConfig(), context=None, *args, **kw
     output = BenchmarkResult()
     output.name = benchmark.name
     output.group = benchmark.group
-    metricnames = list(benchmark.metrics)
-    # Metric variable for curl, to avoid hash lookup for every metric name
-    metricvalues = [METRICS[name] for name in metricnames]
-    # Initialize arrays to store results for each metric
-    results = [list() for x in xrange(0, len(metricnames))]
-    curl = pycurl.Curl()
+    metricnames = benchmark.metrics
+    if benchmark.warmup_auto:  # Warmup is detected from the total_time of each request
+        metricnames = set(metricnames).union([WARMUP_METRIC])
+    collector = MetricCollector(metricnames, track_stages=bool(benchmark.stages),
+                                storage=benchmark.metric_storage, track_failures=True)
+
+    own_transport = transport is None and test_config.transport != PycurlTransport.name
+    if own_transport:
+        transport = create_transport(test_config)
+
+    curl = None
+    curl_share = None
+    own_pool = curl_pool is None and test_config.connection_reuse and transport is None
+    if own_pool:
+        curl_pool = CurlPool()
+    if transport is not None:
+        pass  # Transport handles connections itself
+    elif curl_pool is not None:
+        curl_share = curl_pool.share
+        curl = curl_pool.acquire(benchmark.url)
+    else:
+        curl = pycurl.Curl()
 
     # Benchmark warm-up to allow for caching, JIT compiling, on client
     logger.info('Warmup: ' + message + ' started')
     for x in xrange(0, warmup_runs):
         benchmark.update_context_before(my_context)
         templated = benchmark.realize(my_context)
+        if transport is not None:
+            response = transport.perform(templated, context=my_context, metrics=[], collect_body=False)
+            if response.error is not None:
+                raise response.error
+            continue
         curl = templated.configure_curl(
-            timeout=test_config.timeout, context=my_context, curl_handle=curl)
+            timeout=test_config.timeout, context=my_context, curl_handle=curl, curl_share=curl_share,
+            verbose=test_config.verbose, ssl_insecure=test_config.ssl_insecure)
         # Do not store actual response body at all.
         curl.setopt(pycurl.WRITEFUNCTION, lambda x: None)
         curl.perform()
@@ -494,69 +740,423 @@ def run_benchmark(benchmark, test_config=TestConfig(), context=None, *args, **kw
     logger.info('Warmup: ' + message + ' finished')
 
     logger.info('Benchmark: ' + message + ' starting')
+    if benchmark.interval_output:  # Rows for each interval are written as the benchmark runs
+        collector.intervals = IntervalRecorder(
+            open(benchmark.interval_output, 'w'), collector.metricnames, output_format=benchmark.interval_format,
+            interval=benchmark.interval, interval_requests=benchmark.interval_requests,
+            reported_metrics=benchmark.metrics)
+        collector.intervals.start()
+    start_time = timer()
+    try:
+        if transport is not None or benchmark.rate or benchmark.stages or (benchmark.concurrency or 1) > 1:
+            concurrent_transport = transport
+            if concurrent_transport is None:
+                concurrent_transport = PycurlTransport(timeout=test_config.timeout, ssl_insecure=test_config.ssl_insecure,
+                                                       verbose=test_config.verbose, curl_pool=curl_pool,
+                                                       curl_handles=[curl])
+            output.failures = run_benchmark_concurrent(benchmark, collector, test_config=test_config,
+                context=my_context, transport=concurrent_transport)
+            if transport is None:
+                concurrent_transport.close()
+        else:
+            for x in closed_loop_runs(benchmark, collector):  # Run the actual benchmarks
+                # Setup benchmark, timing the client overhead
+                templated, client_times = realize_timed(benchmark, my_context)
+                configure_start = timer()
+                curl = templated.configure_curl(
+                    timeout=test_config.timeout, context=my_context, curl_handle=curl, curl_share=curl_share,
+                    verbose=test_config.verbose, ssl_insecure=test_config.ssl_insecure)
+                headers = body = None
+                if is_validation_sample(benchmark, x):
+                    headers = MyIO()
+                    body = MyIO()
+                    curl.setopt(pycurl.WRITEFUNCTION, body.write)
+                    curl.setopt(pycurl.HEADERFUNCTION, headers.write)
+                else:  # Do not store actual response body at all.
+                    curl.setopt(pycurl.WRITEFUNCTION, lambda x: None)
+                client_times[2] = timer() - configure_start
+
+                try:  # Run the curl call, if it errors, then add to failure counts for benchmark
+                    curl.perform()
+                except Exception as e:
+                    output.failures = output.failures + 1
+                    collector.record_failure(error=e)
+                    curl.close()
+                    curl = pycurl.Curl()
+                    continue  # Skip metrics collection
+
+                if not check_benchmark_response(benchmark, my_context, collector, curl.getinfo(pycurl.RESPONSE_CODE),
+                                                headers=headers and headers.getvalue(), body=body and body.getvalue()):
+                    output.failures = output.failures + 1
+                    collector.record_failure(curl=curl, client_times=client_times)
+                    continue
+
+                # Get all metrics values for this run, and store to metric lists
+                collector.record(curl, client_times=client_times)
+
+            if curl_pool is not None:
+                curl_pool.release(benchmark.url, curl)
+            else:
+                curl.close()
+
+        output.elapsed = timer() - start_time
+    finally:
+        if collector.intervals is not None:  # Write the last interval and close the file, even if the run failed
+            collector.intervals.close()
+    output.count = collector.count
+    if output.elapsed > 0:
+        output.throughput = collector.count / output.elapsed
+    logger.info('Benchmark: ' + message + ' ending')
+    if own_pool:
+        curl_pool.close()
+    if own_transport:
+        transport.close()
+
+    output.results = collector.get_results()
+    output.sample_stages = collector.stages
+    output.stage_results = collector.get_stage_results()
+    output.status_counts = collector.status_counts
+    output.error_counts = collector.error_counts
+    if collector.failed.count:
+        output.failure_results = collector.failed.get_results()
+    output.validated = collector.validated
+    output.validation_failures = collector.validation_failures
+    if benchmark.warmup_auto:
+        drop_warmup(output)
+    return output
 
-    for x in xrange(0, benchmark_runs):  # Run the actual benchmarks
-        # Setup benchmark
-        benchmark.update_context_before(my_context)
-        templated = benchmark.realize(my_context)
-        curl = templated.configure_curl(
-            timeout=test_config.timeout, context=my_context, curl_handle=curl)
-        # Do not store actual response body at all.
-        curl.setopt(pycurl.WRITEFUNCTION, lambda x: None)
 
-        try:  # Run the curl call, if it errors, then add to failure counts for benchmark
-            curl.perform()
-        except Exception:
-            output.failures = output.failures + 1
-            curl.close()
-            curl = pycurl.Curl()
-            continue  # Skip metrics collection
+def is_validation_sample(benchmark, index):
+    """ True if the response to a benchmark's request (by index) should be validated, see validate_sample_rate """
+    return bool(benchmark.validate_sample_rate and benchmark.validators) and index % benchmark.validate_sample_rate == 0
 
-        # Get all metrics values for this run, and store to metric lists
-        for i in xrange(0, len(metricnames)):
-            results[i].append(curl.getinfo(metricvalues[i]))
 
-    logger.info('Benchmark: ' + message + ' ending')
+def check_benchmark_response(benchmark, context, collector, response_code, headers=None, body=None):
+    """ Check a benchmark response has an expected status code, and if it was sampled for validation
+        (raw headers and body given), that it passes the benchmark's validators
+        Counts the status code and validation in the collector. Returns True if the response succeeded """
+    collector.record_status(response_code)
+    if response_code not in benchmark.expected_status:
+        return False
+    if body is None:
+        return True
+
+    collector.validated = collector.validated + 1
+    failure = None
+    try:
+        head = parse_headers(text_type(headers, HEADER_ENCODING))
+        for validator in benchmark.validators:
+            validate_result = validator.validate(body=body, headers=head, context=context)
+            if not validate_result:
+                failure = validate_result
+                break
+    except Exception as e:
+        failure = Failure(message="Validation exception: {0}".format(e), details=traceback.format_exc(),
+                          failure_type=validators.FAILURE_TEST_EXCEPTION)
+    if failure is None:
+        return True
+
+    collector.validation_failures = collector.validation_failures + 1
+    if collector.validation_failures == 1:  # Only the first, to avoid flooding the log
+        logger.warning("Benchmark response failed validation: {0}".format(getattr(failure, 'message', failure)))
+    return False
+
+
+def drop_warmup(benchmark_result):
+    """ Detect where warmup ends in raw results (see benchmarks.mser_truncation) and drop the results before it
+        Sets warmup_cutoff to the count of requests dropped. Count, elapsed and throughput still cover all requests """
+    cutoff = mser_truncation(benchmark_result.results[WARMUP_METRIC])
+    benchmark_result.warmup_cutoff = cutoff
+    if cutoff:
+        logger.info("Benchmark warmup detected, leaving out the first {0} requests".format(cutoff))
+        benchmark_result.results = dict([(metric, values[cutoff:])
+                                         for metric, values in benchmark_result.results.items()])
+        if benchmark_result.sample_stages is not None:
+            benchmark_result.sample_stages = benchmark_result.sample_stages[cutoff:]
+
+
+def run_benchmark_concurrent(benchmark, collector, test_config=TestConfig(), context=None, transport=None):
+    """ Run a benchmark with several requests in flight at once on a Transport
+        Each virtual user has its own copy of the context and sends one request at a time.
+
+        If the benchmark has a rate or stages, this is an open-loop benchmark: requests start on
+        a fixed schedule (see benchmarks.request_schedule), no matter how long earlier responses
+        take. The schedule_lag of each request (actual minus intended start time) is recorded,
+        so latency can be reported from the intended start.
+        Concurrency (if set) limits the virtual users, and a request starts late if none are free.
+
+        Otherwise each of benchmark.concurrency virtual users sends its next request as soon as
+        the last one finishes, until benchmark_runs requests are done (see benchmarks.closed_loop_runs
+        for duration and target_precision).
+
+        Returns count of failed requests """
+
+    open_loop = bool(benchmark.rate or benchmark.stages)
+    if open_loop:
+        schedule = request_schedule(benchmark)
+        max_users = benchmark.concurrency or OPEN_LOOP_MAX_IN_FLIGHT
+    else:  # Start every request right away, as soon as a virtual user is free
+        schedule = ((0.0, None) for x in closed_loop_runs(benchmark, collector))
+        max_users = benchmark.concurrency or 1
+
+    own_transport = transport is None
+    if own_transport:
+        transport = create_transport(test_config)
+    metric_names = collector.transport_metrics
+    idle_users = list()  # Contexts of virtual users that can send a request
+    user_count = 0
+    failures = 0
+    started = 0  # Requests started, to sample responses for validation
+    next_request = next(schedule, None)  # (start time, stage index) of next request to start
+    start_time = timer()
+
+    while next_request is not None or transport.in_flight():
+        # Start every request whose time has come, if a virtual user is free for it
+        now = timer()
+        while next_request is not None and start_time + next_request[0] <= now:
+            if idle_users:
+                user_context = idle_users.pop()
+            elif user_count < max_users:
+                user_context = context.copy()
+                user_count = user_count + 1
+            else:
+                break
+
+            templated, client_times = realize_timed(benchmark, user_context)
+            actual = timer()
+            intended = actual
+            if open_loop:
+                intended = start_time + next_request[0]
+            sample = is_validation_sample(benchmark, started)
+            transport.start(templated, context=user_context, metrics=metric_names, collect_body=sample,
+                            key=(user_context, intended, actual, next_request[1], client_times))
+            client_times[2] = timer() - actual  # Before the response comes back with the key
+            started = started + 1
+            next_request = next(schedule, None)
+
+        # Wait for transfers, or until the next request is due to start
+        wait = 1.0
+        if next_request is not None and (idle_users or user_count < max_users):
+            wait = min(start_time + next_request[0] - timer(), 1.0)
+        if transport.in_flight():
+            for key, response in transport.wait(max(wait, 0)):
+                user_context, intended, actual, stage, client_times = key
+                idle_users.append(user_context)
+                if response.error is not None:
+                    failures = failures + 1
+                    collector.record_failure(error=response.error)
+                elif not check_benchmark_response(benchmark, user_context, collector, response.response_code,
+                                                  headers=response.headers, body=response.body):
+                    failures = failures + 1
+                    collector.record_failure(metrics=response.metrics, schedule_lag=actual - intended,
+                                             client_times=client_times)
+                else:
+                    collector.record_metrics(response.metrics, schedule_lag=actual - intended, stage=stage,
+                                             client_times=client_times)
+        elif wait > 0:
+            time.sleep(wait)
+        if collector.intervals is not None:  # Write intervals that had no requests end, too
+            collector.intervals.tick()
+
+    if own_transport:
+        transport.close()
+    return failures
+
+
+def run_benchmark_distributed(benchmark, test_config=TestConfig(), context=None, agents=None, agent_token=None):
+    """ Run a benchmark on distributed agents (list of (host, port)) at once, each with a share of the load
+        Agents parse the benchmark again from its configuration, with the test config and context variables,
+        and seed their random generators differently. Their raw results are merged and then analyzed.
+        Jobs are sent with agent_token, the agents' shared secret, and a body from a file is read here and sent """
+    if context is None:
+        context = Context()
+    body = None
+    if isinstance(benchmark._body, ContentHandler) and benchmark._body.is_file:
+        if benchmark._body.is_template_path:
+            raise ValueError("Benchmarks with a templated body file path can't run on distributed agents")
+        handler = benchmark._body.create_noread_version()
+        body = {u'content': handler.content, u'template': handler.is_template_content}
+    config = {u'timeout': test_config.timeout,
+              u'transport': test_config.transport,
+              u'connection_reuse': test_config.connection_reuse}
+    if test_config.generator_configs:
+        config[u'generators'] = test_config.generator_configs
+
+    base_seed = random.SystemRandom().randint(0, generators.INT32_MAX_VALUE)
+    jobs = list()
+    for index in xrange(0, len(agents)):
+        jobs.append({u'base_url': benchmark.base_url,
+                     u'benchmark': benchmark.source_node,
+                     u'config': config,
+                     u'ssl_insecure': test_config.ssl_insecure,
+                     u'variables': context.get_values(),
+                     u'share': [index, len(agents)],
+                     u'seed': base_seed + index})
+        if body is not None:
+            jobs[-1][u'body'] = body
+    merged = distributed.merge_results(distributed.run_on_agents(agents, jobs, agent_token))
 
-    temp_results = dict()
-    for i in xrange(0, len(metricnames)):
-        temp_results[metricnames[i]] = results[i]
-    output.results = temp_results
+    output = BenchmarkResult()
+    output.name = benchmark.name
+    output.group = benchmark.group
+    output.results = merged[u'results']
+    output.failures = merged[u'failures']
+    output.count = merged[u'count']
+    output.elapsed = merged[u'elapsed']
+    if output.elapsed > 0:
+        output.throughput = output.count / output.elapsed
+    output.sample_stages = merged[u'sample_stages']
+    output.stage_results = merged[u'stage_results']
+    output.warmup_cutoff = merged[u'warmup_cutoff']
+    output.status_counts = merged[u'status_counts']
+    output.error_counts = merged[u'error_counts']
+    output.failure_results = merged[u'failure_results'] or None
+    output.validated = merged[u'validated']
+    output.validation_failures = merged[u'validation_failures']
     return analyze_benchmark_results(output, benchmark)
 
 
+def has_file_content(value, seen=None):
+    """ True if a parsed validator or extractor (or a list or dict of them) has content read from a file,
+        such as the schema of a json_schema validator """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return False
+    seen.add(id(value))
+    if isinstance(value, ContentHandler):
+        return value.is_file
+    if isinstance(value, dict):
+        return any([has_file_content(item, seen) for item in value.values()])
+    if isinstance(value, (list, tuple)):
+        return any([has_file_content(item, seen) for item in value])
+    if hasattr(value, '__dict__'):
+        return has_file_content(vars(value), seen)
+    return False
+
+
+def run_benchmark_job(job):
+    """ Run a benchmark job from run_benchmark_distributed, as a distributed agent
+        Agents don't touch their own files: bodies from files are refused unless the coordinator sent the content,
+        jobs with curl options (which can read or write files, such as cookiejar) or with validators and extractors
+        using files are refused, and output files (interval_output, output_file, history_file) are ignored
+        Returns the raw results, to merge with those from other agents """
+    random.seed(job[u'seed'])
+    test_config = parse_configuration(job[u'config'])
+    test_config.ssl_insecure = job[u'ssl_insecure']
+    context = Context()
+    context.bind_variables(job[u'variables'])
+    if test_config.generators:
+        for key, value in test_config.generators.items():
+            context.add_generator(key, value)
+
+    benchmark = parse_benchmark(job[u'base_url'], job[u'benchmark'])
+    if benchmark.curl_options:
+        raise ValueError("Agents don't run benchmarks with curl options: " + ', '.join(sorted(benchmark.curl_options)))
+    if has_file_content([benchmark.validators, benchmark.extract_binds]):
+        raise ValueError("Agents don't read files for validators or extractors")
+    if isinstance(benchmark._body, ContentHandler) and benchmark._body.is_file:
+        if not job.get(u'body'):
+            raise ValueError("Agents don't read body files, the coordinator must send the body")
+        handler = ContentHandler()
+        handler.setup(job[u'body'][u'content'], is_template_content=job[u'body'][u'template'])
+        benchmark.body = handler
+    benchmark.interval_output = None
+    benchmark.output_file = None
+    benchmark.history_file = None
+    distributed.apply_share(benchmark, job[u'share'][0], job[u'share'][1])
+    logger.info("Agent running benchmark: " + benchmark.name)
+    output = collect_benchmark(benchmark, test_config=test_config, context=context)
+    stage_results = None
+    if output.stage_results is not None:
+        stage_results = dict([(stage, distributed.encode_results(results))
+                              for stage, results in output.stage_results.items()])
+    return {u'results': distributed.encode_results(output.results),
+            u'failures': output.failures,
+            u'count': output.count,
+            u'elapsed': output.elapsed,
+            u'sample_stages': None if output.sample_stages is None else list(output.sample_stages),
+            u'stage_results': stage_results,
+            u'warmup_cutoff': output.warmup_cutoff,
+            u'status_counts': output.status_counts,
+            u'error_counts': output.error_counts,
+            u'failure_results': None if output.failure_results is None
+            else distributed.encode_results(output.failure_results),
+            u'validated': output.validated,
+            u'validation_failures': output.validation_failures}
+
+
 def analyze_benchmark_results(benchmark_result, benchmark):
     """ Take a benchmark result containing raw benchmark results, and do aggregation by
     applying functions
 
-    Aggregates come out in format of metricname, aggregate_name, result """
+    Aggregates come out in format of metricname, aggregate_name, result
+    Raw metrics stored in a Histogram are output as a list of (value, count) for its buckets """
 
     output = BenchmarkResult()
     output.name = benchmark_result.name
     output.group = benchmark_result.group
     output.failures = benchmark_result.failures
+    output.count = benchmark_result.count
+    output.elapsed = benchmark_result.elapsed
+    output.throughput = benchmark_result.throughput
+    output.warmup_cutoff = benchmark_result.warmup_cutoff
+    output.status_counts = benchmark_result.status_counts
+    output.error_counts = benchmark_result.error_counts
+    output.validated = benchmark_result.validated
+    output.validation_failures = benchmark_result.validation_failures
 
     # Copy raw metric arrays over where necessary
-    raw_results = benchmark_result.results
+    raw_results = derive_metrics(benchmark_result.results, benchmark.metrics)
     temp = dict()
     for metric in benchmark.raw_metrics:
-        temp[metric] = raw_results[metric]
+        if isinstance(raw_results[metric], Histogram):
+            temp[metric] = raw_results[metric].value_counts()
+        else:
+            temp[metric] = list(raw_results[metric])
     output.results = temp
 
-    # Compute aggregates for each metric, and add tuples to aggregate results
+    output.aggregates = compute_aggregates(raw_results, benchmark)
+
+    # Latency of failed responses is kept apart, so errors don't skew the aggregates
+    if benchmark_result.failure_results:
+        output.failure_aggregates = compute_aggregates(
+            derive_metrics(benchmark_result.failure_results, benchmark.metrics), benchmark)
+
+    # For staged benchmarks, also compute aggregates for results from each stage
+    if benchmark.stages and benchmark_result.stage_results is not None:
+        output.stage_aggregates = list()
+        for index, stage in enumerate(benchmark.stages):
+            stage_results = benchmark_result.stage_results.get(index)
+            if stage_results is None:  # No requests succeeded in this stage
+                stage_results = dict([(metricname, Histogram()) for metricname in benchmark.aggregated_metrics.keys()])
+            for metricname, aggregate_name, value in compute_aggregates(stage_results, benchmark):
+                output.stage_aggregates.append((stage.name, metricname, aggregate_name, value))
+    elif benchmark.stages and benchmark_result.sample_stages is not None:
+        output.stage_aggregates = list()
+        sample_stages = benchmark_result.sample_stages
+        for index, stage in enumerate(benchmark.stages):
+            stage_results = dict()
+            for metricname in benchmark.aggregated_metrics.keys():
+                stage_results[metricname] = select_stage(raw_results[metricname], sample_stages, index)
+            for metricname, aggregate_name, value in compute_aggregates(stage_results, benchmark):
+                output.stage_aggregates.append((stage.name, metricname, aggregate_name, value))
+    return output
+
+
+def compute_aggregates(raw_results, benchmark):
+    """ Compute the benchmark's aggregates over raw results (map of metric name to values)
+        Returns list of tuples of (metricname, aggregate, result) """
     aggregate_results = list()
     for metricname, aggregate_list in benchmark.aggregated_metrics.items():
-        numbers = raw_results[metricname]
+        numbers = presort(raw_results[metricname], aggregate_list)
         for aggregate_name in aggregate_list:
-            if numbers:  # Only compute aggregates if numbers exist
-                aggregate_function = AGGREGATES[aggregate_name]
+            if len(numbers):  # Only compute aggregates if numbers exist
                 aggregate_results.append(
-                    (metricname, aggregate_name, aggregate_function(numbers)))
+                    (metricname, aggregate_name, compute_aggregate(aggregate_name, numbers)))
             else:
                 aggregate_results.append((metricname, aggregate_name, None))
-
-    output.aggregates = aggregate_results
-    return output
+    return aggregate_results
 
 
 def metrics_to_tuples(raw_metrics):
@@ -575,13 +1175,14 @@ def metrics_to_tuples(raw_metrics):
     metrics = sorted(raw_metrics.keys())
     arrays = [raw_metrics[metric] for metric in metrics]
 
-    num_rows = len(arrays[0])  # Assume all same size or this fails
+    num_rows = max([len(array) for array in arrays])  # Shorter arrays are padded with blanks
     output = list()
     output.append(tuple(metrics))  # Add headers
 
     # Create list of tuples mimicking 2D array from input
     for row in xrange(0, num_rows):
-        new_row = tuple([arrays[col][row] for col in xrange(0, len(arrays))])
+        new_row = tuple([arrays[col][row] if row < len(arrays[col]) else u''
+                         for col in xrange(0, len(arrays))])
         output.append(new_row)
     return output
 
@@ -597,6 +1198,15 @@ def write_benchmark_csv(file_out, benchmark_result, benchmark, test_config=TestC
     writer.writerow(('Benchmark', benchmark_result.name))
     writer.writerow(('Benchmark Group', benchmark_result.group))
     writer.writerow(('Failures', benchmark_result.failures))
+    writer.writerow(('Count', benchmark_result.count))
+    if benchmark_result.throughput is not None:
+        writer.writerow(('Elapsed', benchmark_result.elapsed))
+        writer.writerow(('Throughput', benchmark_result.throughput))
+    if benchmark_result.warmup_cutoff is not None:
+        writer.writerow(('Warmup Cutoff', benchmark_result.warmup_cutoff))
+    if benchmark_result.validated:
+        writer.writerow(('Validated', benchmark_result.validated))
+        writer.writerow(('Validation Failures', benchmark_result.validation_failures))
 
     # Write result arrays
     if benchmark_result.results:
@@ -605,11 +1215,92 @@ def write_benchmark_csv(file_out, benchmark_result, benchmark, test_config=TestC
     if benchmark_result.aggregates:
         writer.writerow(('Aggregates', ''))
         writer.writerows(benchmark_result.aggregates)
+    if benchmark_result.stage_aggregates:
+        writer.writerow(('Stage Aggregates', ''))
+        writer.writerows(benchmark_result.stage_aggregates)
+    if benchmark_result.status_counts:
+        writer.writerow(('Status Codes', ''))
+        writer.writerows(sorted(benchmark_result.status_counts.items()))
+    if benchmark_result.error_counts:
+        writer.writerow(('Errors', ''))
+        writer.writerows(sorted(benchmark_result.error_counts.items(), key=lambda item: str(item[0])))
+    if benchmark_result.failure_aggregates:
+        writer.writerow(('Failure Aggregates', ''))
+        writer.writerows(benchmark_result.failure_aggregates)
+    if benchmark_result.comparisons:
+        writer.writerow(('Baseline Comparison', ''))
+        writer.writerow(('Metric', 'Aggregate', 'Baseline', 'Result', 'Change', 'P-Value', 'Regressed'))
+        writer.writerows(benchmark_result.comparisons)
+    if benchmark_result.threshold_checks:
+        writer.writerow(('Thresholds', ''))
+        writer.writerow(('Metric', 'Aggregate', 'Threshold', 'Result', 'Passed'))
+        writer.writerows(benchmark_result.threshold_checks)
 
 # Method to call when writing benchmark file
 OUTPUT_METHODS = {u'csv': write_benchmark_csv, u'json': write_benchmark_json}
 
 
+def check_baseline(benchmark_result, benchmark):
+    """ Compare an analyzed benchmark result to the benchmark's baseline file, if it has one
+        Sets comparisons on the result, and returns the number of aggregates that regressed
+        A baseline file that can't be read counts as 1, so a wrong path fails the run instead of passing it,
+        but a file without this benchmark doesn't (it may be new since the baseline was saved) """
+    if not benchmark.baseline_file:
+        return 0
+    try:
+        previous = baseline.load_baseline(benchmark.baseline_file, benchmark_result.name)
+    except (IOError, OSError, ValueError) as e:
+        logger.error("Could not load benchmark baseline from {0}: {1}".format(benchmark.baseline_file, e))
+        return 1
+    if previous is None:
+        logger.warning("No baseline for benchmark '{0}' in {1}".format(benchmark_result.name, benchmark.baseline_file))
+        return 0
+
+    comparisons = baseline.compare_to_baseline(benchmark_result, previous,
+                                               threshold=benchmark.regression_threshold,
+                                               significance=benchmark.baseline_significance)
+    benchmark_result.comparisons = [comparison.to_tuple() for comparison in comparisons]
+    regressions = [comparison for comparison in comparisons if comparison.regressed]
+    for comparison in regressions:
+        logger.error("Benchmark Regression: {0} {1} {2} went from {3} to {4} ({5:+.1%})".format(
+            benchmark_result.name, comparison.metricname, comparison.aggregate,
+            comparison.baseline, comparison.value, comparison.change))
+    return len(regressions)
+
+
+def threshold_value(benchmark_result, threshold):
+    """ Value of an analyzed benchmark result that a Threshold applies to, None if not available """
+    if threshold.aggregate is None:
+        if threshold.metricname == u'error_rate':
+            requests = benchmark_result.count + benchmark_result.failures
+            return benchmark_result.failures / float(requests) if requests else None
+        return getattr(benchmark_result, threshold.metricname)
+    for metricname, aggregate, value in benchmark_result.aggregates or ():
+        if metricname == threshold.metricname and aggregate == threshold.aggregate:
+            return value
+    return None
+
+
+def check_thresholds(benchmark_result, benchmark):
+    """ Check an analyzed benchmark result against the benchmark's thresholds, if it has any
+        Sets threshold_checks on the result, and returns the number of thresholds breached """
+    if not benchmark.thresholds:
+        return 0
+    benchmark_result.threshold_checks = list()
+    breaches = 0
+    for threshold in benchmark.thresholds:
+        value = threshold_value(benchmark_result, threshold)
+        passed = threshold.is_met(value)
+        benchmark_result.threshold_checks.append(
+            (threshold.metricname, threshold.aggregate, threshold.expression(), value, passed))
+        if not passed:
+            breaches = breaches + 1
+            logger.error("Benchmark Threshold Breached: {0} {1} was {2}, needs {3}".format(
+                benchmark_result.name, u' '.join([threshold.metricname, threshold.aggregate or u'']).strip(),
+                value, threshold.expression()))
+    return breaches
+
+
 def log_failure(failure, context=None, test_config=TestConfig()):
     """ Log a failure from a test """
     logger.error("Test Failure, failure type: {0}, Reason: {1}".format(
@@ -618,107 +1309,223 @@ def log_failure(failure, context=None, test_config=TestConfig()):
         logger.error("Validator/Error details:" + str(failure.details))
 
 
-def run_testsets(testsets):
-    """ Execute a set of tests, using given TestSet list input """
-    group_results = dict()  # results, by group
+def run_testset(testset, group_results, group_failure_counts, curl_handle=None, agents=None, agent_token=None):
+    """ Run the tests and benchmarks of a single test set, in a new Context
+        Results are added to group_results (group name to list of TestResponse)
+        and group_failure_counts (group name to count of failed tests)
+        If agents (list of (host, port)) are given, benchmarks run on them instead of locally, using agent_token
+        Returns the number of benchmarks that failed, by regressing from their baseline """
+    mytests = testset.tests
+    myconfig = testset.config
+    mybenchmarks = testset.benchmarks
+    context = Context()
+
+    # Bind variables & add generators if pertinent
+    if myconfig.variable_binds:
+        context.bind_variables(myconfig.variable_binds)
+    if myconfig.generators:
+        for key, value in myconfig.generators.items():
+            context.add_generator(key, value)
+
+    curl_pool = None
+    transport = None
+    benchmark_failures = 0
+    if myconfig.transport != PycurlTransport.name:
+        transport = create_transport(myconfig)
+    elif myconfig.connection_reuse:
+        curl_pool = CurlPool()
+
+    # Run tests, collecting statistics as needed
+    if myconfig.test_parallel and not myconfig.interactive:
+        test_results = run_tests_parallel(
+            mytests, test_config=myconfig, context=context, curl_pool=curl_pool, transport=transport)
+    else:  # Lazily run tests one at a time
+        if curl_handle is None and transport is None:
+            curl_handle = pycurl.Curl()
+        test_results = ((test, run_test(test, test_config=myconfig, context=context,
+                                        curl_handle=curl_handle, curl_pool=curl_pool, transport=transport))
+                        for test in mytests)
+
+    for test, result in test_results:
+        # Initialize the dictionaries to store test fail counts and results
+        if test.group not in group_results:
+            group_results[test.group] = list()
+            group_failure_counts[test.group] = 0
+
+        result.body = None  # Remove the body, save some memory!
+
+        if not result.passed:  # Print failure, increase failure counts for that test group
+            # Use result test URL to allow for templating
+            logger.error('Test Failed: ' + test.name + " URL=" + result.test.url +
+                         " Group=" + test.group + " HTTP Status Code: " + str(result.response_code))
+
+            # Print test failure reasons
+            if result.failures:
+                for failure in result.failures:
+                    log_failure(failure, context=context,
+                                test_config=myconfig)
+
+            # Increment test failure counts for that group (adding an entry
+            # if not present)
+            failures = group_failure_counts[test.group]
+            failures = failures + 1
+            group_failure_counts[test.group] = failures
+
+        else:  # Test passed, print results
+            logger.info('Test Succeeded: ' + test.name +
+                        " URL=" + test.url + " Group=" + test.group)
+
+        # Add results for this test group to the resultset
+        group_results[test.group].append(result)
+
+        # handle stop_on_failure flag
+        if not result.passed and test.stop_on_failure is not None and test.stop_on_failure:
+            print(
+                'STOP ON FAILURE! stopping test set execution, continuing with other test sets')
+            break
+
+    for benchmark in mybenchmarks:  # Run benchmarks, analyze, write
+        if not benchmark.metrics:
+            logger.debug('Skipping benchmark, no metrics to collect')
+            continue
+
+        logger.info("Benchmark Starting: " + benchmark.name +
+                    " Group: " + benchmark.group)
+        if agents:
+            benchmark_result = run_benchmark_distributed(
+                benchmark, myconfig, context=context, agents=agents, agent_token=agent_token)
+        else:
+            benchmark_result = run_benchmark(
+                benchmark, myconfig, context=context, curl_pool=curl_pool, transport=transport)
+        regressions = check_baseline(benchmark_result, benchmark)
+        if regressions + check_thresholds(benchmark_result, benchmark):
+            benchmark_failures = benchmark_failures + 1
+        print(benchmark_result)
+        logger.info("Benchmark Done: " + benchmark.name +
+                    " Group: " + benchmark.group)
+
+        if benchmark.output_file:  # Write file
+            logger.debug(
+                'Writing benchmark to file in format: ' + benchmark.output_format)
+            write_method = OUTPUT_METHODS[benchmark.output_format]
+            my_file = open(benchmark.output_file, 'w')  # Overwrites file
+            logger.debug("Benchmark writing to file: " +
+                         benchmark.output_file)
+            write_method(my_file, benchmark_result,
+                         benchmark, test_config=myconfig)
+            my_file.close()
+
+        if benchmark.history_file:  # Add to results of earlier runs
+            history.record_result(benchmark.history_file, benchmark_result,
+                                  base_url=benchmark.base_url, label=benchmark.history_label)
+
+    if curl_pool is not None:
+        curl_pool.close()
+    if transport is not None:
+        transport.close()
+    return benchmark_failures
+
+
+# Test sets to run in worker processes, inherited by forking
+WORKER_TESTSETS = list()
+
+
+def run_testset_worker(args):
+    """ Run one test set in a worker process, seeding random generators first
+        Returns (map of group name to (test count, failure count), count of benchmark failures) """
+    index, seed = args
+    random.seed(seed)
+    group_results = dict()
     group_failure_counts = dict()
+    benchmark_failures = run_testset(WORKER_TESTSETS[index], group_results, group_failure_counts)
+    return (dict([(group, (len(results), group_failure_counts[group]))
+                  for group, results in group_results.items()]), benchmark_failures)
+
+
+def run_testsets_sharded(testsets, workers):
+    """ Shard test sets across a pool of worker processes, each test set still gets its own Context
+        Returns (map of group name to [test count, failure count], count of benchmark failures)
+        merged over all test sets, or None if worker processes can't be forked on this platform """
+    try:
+        pool_context = multiprocessing.get_context('fork')
+    except AttributeError:  # Python 2 forks on all POSIX platforms
+        pool_context = multiprocessing if hasattr(os, 'fork') else None
+    except ValueError:
+        pool_context = None
+    if pool_context is None:
+        logger.warning("Cannot fork worker processes on this platform, running test sets serially")
+        return None
+
+    WORKER_TESTSETS[:] = testsets
+    base_seed = random.SystemRandom().randint(0, generators.INT32_MAX_VALUE)
+    shards = [(index, base_seed + index) for index in xrange(0, len(testsets))]
+
+    pool = pool_context.Pool(workers)
+    try:
+        shard_counts = pool.map(run_testset_worker, shards, 1)
+    finally:
+        pool.close()
+        pool.join()
+        WORKER_TESTSETS[:] = list()
+
+    group_counts = dict()
+    benchmark_failures = 0
+    for counts, shard_benchmark_failures in shard_counts:
+        for group, (test_count, failures) in counts.items():
+            totals = group_counts.setdefault(group, [0, 0])
+            totals[0] = totals[0] + test_count
+            totals[1] = totals[1] + failures
+        benchmark_failures = benchmark_failures + shard_benchmark_failures
+    return (group_counts, benchmark_failures)
+
+
+def run_testsets(testsets, workers=1, agents=None, agent_token=None):
+    """ Execute a set of tests, using given TestSet list input
+        With workers > 1, test sets are run in that many worker processes
+        With agents (list of (host, port)), benchmarks are run on those distributed agents,
+        which need agent_token, their shared secret """
     total_failures = 0
-    myinteractive = False
-    curl_handle = pycurl.Curl()
+    myconfig = TestConfig()
 
+    # Test sets up to the first one without tests, which are probably just imports
+    runnable = list()
     for testset in testsets:
-        mytests = testset.tests
         myconfig = testset.config
-        mybenchmarks = testset.benchmarks
-        context = Context()
-
-        # Bind variables & add generators if pertinent
-        if myconfig.variable_binds:
-            context.bind_variables(myconfig.variable_binds)
-        if myconfig.generators:
-            for key, value in myconfig.generators.items():
-                context.add_generator(key, value)
-
-        # Make sure we actually have tests to execute
-        if not mytests and not mybenchmarks:
-            # no tests in this test set, probably just imports.. skip to next
-            # test set
+        if not testset.tests and not testset.benchmarks:
             break
-
-        myinteractive = True if myinteractive or myconfig.interactive else False
-
-        # Run tests, collecting statistics as needed
-        for test in mytests:
-            # Initialize the dictionaries to store test fail counts and results
-            if test.group not in group_results:
-                group_results[test.group] = list()
-                group_failure_counts[test.group] = 0
-
-            result = run_test(test, test_config=myconfig, context=context, curl_handle=curl_handle)
-            result.body = None  # Remove the body, save some memory!
-
-            if not result.passed:  # Print failure, increase failure counts for that test group
-                # Use result test URL to allow for templating
-                logger.error('Test Failed: ' + test.name + " URL=" + result.test.url +
-                             " Group=" + test.group + " HTTP Status Code: " + str(result.response_code))
-
-                # Print test failure reasons
-                if result.failures:
-                    for failure in result.failures:
-                        log_failure(failure, context=context,
-                                    test_config=myconfig)
-
-                # Increment test failure counts for that group (adding an entry
-                # if not present)
-                failures = group_failure_counts[test.group]
-                failures = failures + 1
-                group_failure_counts[test.group] = failures
-
-            else:  # Test passed, print results
-                logger.info('Test Succeeded: ' + test.name +
-                            " URL=" + test.url + " Group=" + test.group)
-
-            # Add results for this test group to the resultset
-            group_results[test.group].append(result)
-
-            # handle stop_on_failure flag
-            if not result.passed and test.stop_on_failure is not None and test.stop_on_failure:
-                print(
-                    'STOP ON FAILURE! stopping test set execution, continuing with other test sets')
-                break
-
-        for benchmark in mybenchmarks:  # Run benchmarks, analyze, write
-            if not benchmark.metrics:
-                logger.debug('Skipping benchmark, no metrics to collect')
-                continue
-
-            logger.info("Benchmark Starting: " + benchmark.name +
-                        " Group: " + benchmark.group)
-            benchmark_result = run_benchmark(
-                benchmark, myconfig, context=context)
-            print(benchmark_result)
-            logger.info("Benchmark Done: " + benchmark.name +
-                        " Group: " + benchmark.group)
-
-            if benchmark.output_file:  # Write file
-                logger.debug(
-                    'Writing benchmark to file in format: ' + benchmark.output_format)
-                write_method = OUTPUT_METHODS[benchmark.output_format]
-                my_file = open(benchmark.output_file, 'w')  # Overwrites file
-                logger.debug("Benchmark writing to file: " +
-                             benchmark.output_file)
-                write_method(my_file, benchmark_result,
-                             benchmark, test_config=myconfig)
-                my_file.close()
+        runnable.append(testset)
+    myinteractive = any([testset.config.interactive for testset in runnable])
+
+    group_counts = None
+    benchmark_failures = 0
+    if workers > 1 and len(runnable) > 1:
+        if agents:
+            logger.warning("Benchmarks on distributed agents can't use worker processes, running test sets serially")
+        elif myinteractive:
+            logger.warning("Interactive mode can't use worker processes, running test sets serially")
+        else:
+            sharded = run_testsets_sharded(runnable, workers)
+            if sharded is not None:
+                group_counts, benchmark_failures = sharded
+
+    if group_counts is None:
+        group_results = dict()  # results, by group
+        group_failure_counts = dict()
+        curl_handle = pycurl.Curl()
+        for testset in runnable:
+            benchmark_failures = benchmark_failures + run_testset(
+                testset, group_results, group_failure_counts, curl_handle=curl_handle, agents=agents,
+                agent_token=agent_token)
+        group_counts = dict([(group, (len(results), group_failure_counts[group]))
+                             for group, results in group_results.items()])
 
     if myinteractive:
         # a break for when interactive bits are complete, before summary data
         print("===================================")
 
     # Print summary results
-    for group in sorted(group_results.keys()):
-        test_count = len(group_results[group])
-        failures = group_failure_counts[group]
+    for group in sorted(group_counts.keys()):
+        test_count, failures = group_counts[group]
         total_failures = total_failures + failures
 
         passfail = {True: u'SUCCEEDED: ', False: u'FAILED: '}
@@ -732,6 +1539,15 @@ def run_testsets(testsets):
             else:
                 print('\033[92m' + output_string + '\033[0m')
 
+    if benchmark_failures:  # Benchmarks that regressed or breached thresholds count as failures too
+        total_failures = total_failures + benchmark_failures
+        output_string = "Benchmarks FAILED: {0} regressed from baseline, had an unreadable baseline, or breached thresholds".format(
+            benchmark_failures)
+        if myconfig.skip_term_colors:
+            print(output_string)
+        else:
+            print('\033[91m' + output_string + '\033[0m')
+
     return total_failures
 
 
@@ -799,6 +1615,14 @@ def main(args):
         interactive   - OPTIONAL - mode that prints info before and after test exectuion and pauses for user input for each test
         absolute_urls - OPTIONAL - mode that treats URLs in tests as absolute/full URLs instead of relative URLs
         skip_term_colors - OPTIONAL - mode that turn off the output term colors
+        workers       - OPTIONAL - number of worker processes to run test sets in (default 1)
+        coordinator   - OPTIONAL - comma-separated HOST:PORT addresses of agents to run benchmarks on
+        agent         - OPTIONAL - run as an agent for a coordinator, listening on this [HOST:]PORT (url and test not needed)
+        agent_token   - OPTIONAL - shared secret between a coordinator and its agents, needed by both
+        baseline_file - OPTIONAL - JSON benchmark result to check benchmarks for regressions against
+        regression_threshold - OPTIONAL - relative change in an aggregate that counts as a regression, ex: 10%
+        history_file  - OPTIONAL - SQLite database to record benchmark results in, see pyresttest-history
+        history_label - OPTIONAL - label for benchmark results recorded in history
     """
 
     if 'log' in args and args['log'] is not None:
@@ -814,6 +1638,18 @@ def main(args):
             sys.path.insert(0, working_folder)
         register_extensions(extensions)
 
+    if 'agent' in args and args['agent']:
+        if not args.get('agent_token'):
+            raise ValueError("Agents need a shared secret, set it with --agent-token")
+        server = distributed.AgentServer(
+            distributed.parse_address(args['agent']), run_benchmark_job, args['agent_token'])
+        print("Benchmark agent listening on {0}:{1}".format(*server.server_address))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return
+
     test_file = args['test']
     test_structure = read_test_file(test_file)
 
@@ -852,8 +1688,30 @@ def main(args):
         if 'skip_term_colors' in args and args['skip_term_colors'] is not None:
             t.config.skip_term_colors = safe_to_bool(args['skip_term_colors'])
 
+        for b in t.benchmarks:
+            if 'baseline_file' in args and args['baseline_file']:
+                b.baseline_file = args['baseline_file']
+            if 'regression_threshold' in args and args['regression_threshold'] is not None:
+                b.regression_threshold = baseline.parse_threshold(args['regression_threshold'])
+            if 'history_file' in args and args['history_file']:
+                b.history_file = args['history_file']
+            if 'history_label' in args and args['history_label'] is not None:
+                b.history_label = args['history_label']
+
+    workers = 1
+    if 'workers' in args and args['workers'] is not None:
+        workers = int(args['workers'])
+        if workers < 1:
+            raise ValueError("Number of workers must be at least 1")
+
+    agents = None
+    if 'coordinator' in args and args['coordinator']:
+        agents = distributed.parse_agents(args['coordinator'])
+        if not args.get('agent_token'):
+            raise ValueError("Agents need their shared secret, set it with --agent-token")
+
     # Execute all testsets
-    failures = run_testsets(tests)
+    failures = run_testsets(tests, workers=workers, agents=agents, agent_token=args.get('agent_token'))
 
     sys.exit(failures)
 
@@ -886,12 +1744,30 @@ def parse_command_line_args(args_in):
                       action="store_true", dest="absolute_urls")
     parser.add_option(u'--skip_term_colors', help='Turn off the output term colors',
                       action='store_true', default=False, dest="skip_term_colors")
+    parser.add_option(u'--workers', help='Run test sets in this many worker processes',
+                      action="store", type="int", dest="workers")
+    parser.add_option(u'--coordinator', help='Run benchmarks on distributed agents, at these comma-separated HOST:PORT addresses',
+                      action="store", type="string", dest="coordinator")
+    parser.add_option(u'--agent', help='Run as a distributed benchmark agent, listening on [HOST:]PORT (default host 127.0.0.1)',
+                      action="store", type="string", dest="agent")
+    parser.add_option(u'--agent-token', help='Shared secret between a coordinator and its agents, needed by both',
+                      action="store", type="string", dest="agent_token")
+    parser.add_option(u'--baseline-file', help='Check benchmarks for regressions against this JSON benchmark result',
+                      action="store", type="string", dest="baseline_file")
+    parser.add_option(u'--regression-threshold', help='Relative change in a benchmark aggregate that is a regression, ex: 10%',
+                      action="store", type="string", dest="regression_threshold")
+    parser.add_option(u'--history-file', help='Record benchmark results in this SQLite database, see pyresttest-history',
+                      action="store", type="string", dest="history_file")
+    parser.add_option(u'--history-label', help='Label for benchmark results recorded in history, ex: a build number',
+                      action="store", type="string", dest="history_label")
 
     (args, unparsed_args) = parser.parse_args(args_in)
     args = vars(args)
 
     # Handle url/test as named, or, failing that, positional arguments
-    if not args['url'] or not args['test']:
+    if args['agent']:
+        pass  # Agents get benchmarks from the coordinator
+    elif not args['url'] or not args['test']:
         if len(unparsed_args) == 2:
             args[u'url'] = unparsed_args[0]
             args[u'test'] = unparsed_args[1]
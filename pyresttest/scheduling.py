@@ -0,0 +1,184 @@
+import string
+import sys
+import logging
+
+from . import contenthandling
+from .contenthandling import ContentHandler
+from . import validators
+from .validators import AbstractExtractor, ComparatorValidator
+
+# Python 2/3 switches
+if sys.version_info[0] > 2:
+    from past.builtins import basestring
+
+"""
+Data-flow analysis of tests, used to decide which tests may run concurrently
+- Find the variables that each test reads (templates) and writes (binds/extracts)
+- Build a dependency graph (DAG) of tests in a test set from that
+"""
+
+logger = logging.getLogger('pyresttest.scheduling')
+
+# Marks a read set that cannot be determined, the test may read any variable
+READS_ANYTHING = None
+
+
+def template_variables(template_string):
+    """ Get set of variable names used in a string.Template string """
+    names = set()
+    if template_string is None:
+        return names
+    if not isinstance(template_string, basestring):
+        template_string = str(template_string)
+    for match in string.Template.pattern.finditer(template_string):
+        name = match.group('named') or match.group('braced')
+        if name:
+            names.add(name)
+    return names
+
+
+def content_reads(content_handler):
+    """ Variables read when templating a ContentHandler, or READS_ANYTHING if unknowable """
+    if not content_handler.is_dynamic():
+        return set()
+    if not content_handler.is_file:
+        return template_variables(content_handler.content)
+
+    output = set()
+    if content_handler.is_template_path:
+        output.update(template_variables(content_handler.content))
+        if content_handler.is_template_content:
+            return READS_ANYTHING  # Can't know content until path is templated
+    elif content_handler.is_template_content:
+        try:
+            with open(content_handler.content, 'r') as f:
+                output.update(template_variables(f.read()))
+        except IOError:
+            return READS_ANYTHING
+    return output
+
+
+def object_reads(obj):
+    """ Variables read from the context by an extractor, validator, or content
+        Validators from extensions are scanned for extractors and content handlers they hold """
+    if obj is None:
+        return set()
+    if isinstance(obj, ContentHandler):
+        return content_reads(obj)
+    if isinstance(obj, AbstractExtractor):
+        if obj.is_templated:
+            return template_variables(obj.query)
+        return set()
+
+    output = set()
+    if isinstance(obj, ComparatorValidator) and obj.isTemplateExpected:
+        output.update(template_variables(obj.expected))
+    if hasattr(obj, '__dict__'):
+        for value in vars(obj).values():
+            if isinstance(value, (ContentHandler, AbstractExtractor)):
+                reads = object_reads(value)
+                if reads is READS_ANYTHING:
+                    return READS_ANYTHING
+                output.update(reads)
+    return output
+
+
+def get_reads(mytest):
+    """ Set of variable names a test reads from the context, or READS_ANYTHING """
+    output = set()
+    templates = mytest.templates or dict()
+
+    if mytest.NAME_URL in templates:
+        output.update(template_variables(mytest._url))
+    if mytest.NAME_HEADERS in templates and mytest._headers:
+        for key, value in mytest._headers.items():
+            output.update(template_variables(key))
+            output.update(template_variables(value))
+
+    readers = list()
+    if isinstance(mytest._body, ContentHandler):
+        readers.append(mytest._body)
+    if mytest.validators:
+        readers.extend(mytest.validators)
+    if mytest.extract_binds:
+        readers.extend(mytest.extract_binds.values())
+
+    for reader in readers:
+        reads = object_reads(reader)
+        if reads is READS_ANYTHING:
+            return READS_ANYTHING
+        output.update(reads)
+    return output
+
+
+def get_writes(mytest):
+    """ Set of variables (and generators, as ('generator', name) tuples) a test modifies
+        Generators are included because drawing from one changes what later tests get """
+    output = set()
+    if mytest.variable_binds:
+        output.update([str(x) for x in mytest.variable_binds.keys()])
+    if mytest.extract_binds:
+        output.update([str(x) for x in mytest.extract_binds.keys()])
+    if mytest.generator_binds:
+        for variable_name, generator_name in mytest.generator_binds.items():
+            output.add(str(variable_name))
+            output.add(('generator', str(generator_name)))
+    return output
+
+
+def build_dependency_graph(mytests):
+    """ Build the DAG of data-flow dependencies between a list of tests
+        Returns a list where entry i is the set of indices of earlier tests that test i must wait for
+        Dependencies implied by others (transitively) are not always listed.
+
+        Test j depends on an earlier test i if:
+            - j reads a variable that i writes
+            - j writes a variable that i reads or writes (keeps binds and generator draws in order)
+            - i has stop_on_failure set, or either test has a delay (these run in order, alone)
+    """
+    dependencies = list()
+    last_writer = dict()  # Variable name to index of last test writing it
+    readers = dict()  # Variable name to indices of tests reading it since last write
+    wildcard_readers = set()  # Tests that may read anything
+    since_barrier = set()  # Tests since the last test that ran alone
+    barrier = None  # Last test that all later tests wait on
+
+    for j in range(0, len(mytests)):
+        test = mytests[j]
+        reads = get_reads(test)
+        writes = get_writes(test)
+        deps = set()
+
+        if barrier is not None:
+            deps.add(barrier)
+        if test.delay > 0:  # Wait for everything in flight
+            deps.update(since_barrier)
+
+        if reads is READS_ANYTHING:
+            deps.update(last_writer.values())
+            wildcard_readers.add(j)
+        else:
+            for name in reads:
+                if name in last_writer:
+                    deps.add(last_writer[name])
+                readers.setdefault(name, set()).add(j)
+
+        if writes:
+            deps.update(wildcard_readers)
+            for name in writes:
+                if name in last_writer:
+                    deps.add(last_writer[name])
+                deps.update(readers.get(name, set()))
+                last_writer[name] = j
+                readers[name] = set()
+
+        deps.discard(j)
+        dependencies.append(deps)
+
+        if test.delay > 0:
+            barrier = j
+            since_barrier = set()
+        elif test.stop_on_failure:
+            barrier = j
+        since_barrier.add(j)
+    return dependencies
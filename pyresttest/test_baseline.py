@@ -0,0 +1,201 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from . import baseline
+from .baseline import *
+from . import resttest
+from .resttest import BenchmarkResult, TestSet, analyze_benchmark_results, check_baseline, run_testsets, write_benchmark_json
+from .benchmarks import Benchmark, parse_benchmark
+from .six.moves import BaseHTTPServer
+
+
+class OkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers every GET with an empty 200 response """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BaselineTest(unittest.TestCase):
+    """ Tests for comparing benchmark results to a baseline """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_baseline(self, samples, name=u'bench'):
+        """ Write analyzed results for samples as a baseline file, returns the path """
+        benchmark = Benchmark()
+        benchmark.add_metric(u'total_time').add_metric(u'total_time', u'p95').add_metric(u'total_time', u'mean')
+        result = BenchmarkResult()
+        result.name = name
+        result.results = {u'total_time': samples}
+        path = os.path.join(self.directory, name + u'.json')
+        with open(path, 'w') as baseline_file:
+            write_benchmark_json(baseline_file, analyze_benchmark_results(result, benchmark), benchmark)
+        return path
+
+    def analyzed(self, samples, name=u'bench', benchmark=None):
+        if benchmark is None:
+            benchmark = Benchmark()
+        benchmark.add_metric(u'total_time').add_metric(u'total_time', u'p95').add_metric(u'total_time', u'mean')
+        result = BenchmarkResult()
+        result.name = name
+        result.results = {u'total_time': samples}
+        return analyze_benchmark_results(result, benchmark)
+
+    def test_parse_threshold(self):
+        self.assertAlmostEqual(0.1, parse_threshold('10%'))
+        self.assertAlmostEqual(0.25, parse_threshold(0.25))
+        self.assertAlmostEqual(1.5, parse_threshold('150 %'))
+        self.assertRaises(ValueError, parse_threshold, '-5%')
+
+    def test_mann_whitney(self):
+        """ Shifted samples are significant, identical ones aren't, ties are handled """
+        rand = random.Random(7)
+        before = [rand.gauss(1.0, 0.1) for x in range(0, 200)]
+        after = [rand.gauss(1.2, 0.1) for x in range(0, 200)]
+        self.assertTrue(mann_whitney_p(after, before) < 0.001)
+        self.assertTrue(mann_whitney_p(before, after) > 0.999)
+        self.assertTrue(mann_whitney_p(before, list(before)) > 0.4)
+        self.assertEqual(1.0, mann_whitney_p([1, 1, 1], [1, 1]))
+        self.assertEqual(None, mann_whitney_p([], [1]))
+
+        # Small example: all current values above baseline, U = n1 * n2
+        p_value = mann_whitney_p([4, 5, 6], [1, 2, 3])
+        self.assertTrue(0.03 < p_value < 0.05)
+
+    def test_compare_regression(self):
+        """ A slower p95 past the threshold is a regression, if significant """
+        rand = random.Random(11)
+        path = self.write_baseline([rand.uniform(0.1, 0.2) for x in range(0, 100)])
+        previous = load_baseline(path, u'bench')
+
+        slower = self.analyzed([rand.uniform(0.15, 0.3) for x in range(0, 100)])
+        comparisons = compare_to_baseline(slower, previous, threshold=0.1)
+        self.assertEqual(set([(u'total_time', u'p95'), (u'total_time', u'mean')]),
+                         set([(c.metricname, c.aggregate) for c in comparisons]))
+        for comparison in comparisons:
+            self.assertTrue(comparison.change > 0.1)
+            self.assertTrue(comparison.p_value < 0.05)
+            self.assertTrue(comparison.regressed)
+
+        # Within the threshold
+        similar = self.analyzed([rand.uniform(0.1, 0.2) for x in range(0, 100)])
+        self.assertFalse(any([c.regressed for c in compare_to_baseline(similar, previous, threshold=0.2)]))
+
+        # Faster is never a regression
+        faster = self.analyzed([rand.uniform(0.05, 0.1) for x in range(0, 100)])
+        self.assertFalse(any([c.regressed for c in compare_to_baseline(faster, previous, threshold=0.0)]))
+
+    def test_compare_not_significant(self):
+        """ A change past the threshold that is just noise, with few samples, isn't a regression """
+        previous = load_baseline(self.write_baseline([0.1, 0.3, 0.2]))
+        noisy = self.analyzed([0.12, 0.35, 0.2])
+        comparisons = compare_to_baseline(noisy, previous, threshold=0.05)
+        p95 = [c for c in comparisons if c.aggregate == u'p95'][0]
+        self.assertTrue(p95.change > 0.05)
+        self.assertTrue(p95.p_value > 0.05)
+        self.assertFalse(p95.regressed)
+
+    def test_compare_without_samples(self):
+        """ Without raw samples, only the threshold applies """
+        previous = {u'name': u'bench', u'aggregates': [[u'total_time', u'mean', 1.0],
+                                                       [u'speed_download', u'mean', 1000.0]]}
+        result = BenchmarkResult()
+        result.aggregates = [(u'total_time', u'mean', 1.05), (u'speed_download', u'mean', 800.0),
+                             (u'size_download', u'mean', 10)]
+        comparisons = compare_to_baseline(result, previous, threshold=0.1)
+        self.assertEqual(2, len(comparisons))
+        self.assertFalse(comparisons[0].regressed)
+        self.assertTrue(comparisons[1].regressed)  # Slower download speed
+        self.assertEqual(None, comparisons[1].p_value)
+        self.assertAlmostEqual(-0.2, comparisons[1].change)
+
+    def test_load_baseline(self):
+        path = os.path.join(self.directory, 'several.json')
+        with open(path, 'w') as baseline_file:
+            json.dump([{u'name': u'first'}, {u'name': u'second'}], baseline_file)
+        self.assertEqual(u'second', load_baseline(path, u'second')[u'name'])
+        self.assertEqual(None, load_baseline(path, u'third'))
+        single = self.write_baseline([1.0], name=u'other')
+        self.assertEqual(u'other', load_baseline(single, u'other')[u'name'])
+        self.assertEqual(None, load_baseline(single, u'renamed'))  # Never another benchmark's result
+
+    def test_check_baseline_other_benchmark(self):
+        """ A baseline file holding one result for a different benchmark isn't compared, and doesn't fail """
+        benchmark = parse_benchmark('http://localhost', {
+            'name': 'slow', 'baseline_file': self.write_baseline([0.001, 0.001, 0.001], name=u'fast')})
+        result = self.analyzed([0.2, 0.2, 0.2], name=u'slow', benchmark=benchmark)
+        self.assertEqual(0, check_baseline(result, benchmark))
+        self.assertFalse(result.comparisons)
+
+    def test_check_baseline(self):
+        """ Comparisons are added to results, regressions counted and written to CSV """
+        rand = random.Random(3)
+        benchmark = parse_benchmark('http://localhost', {
+            'name': 'bench', 'baseline_file': self.write_baseline([rand.uniform(1, 2) for x in range(0, 50)]),
+            'regression_threshold': '5%'})
+        self.assertAlmostEqual(0.05, benchmark.regression_threshold)
+        result = self.analyzed([rand.uniform(2, 3) for x in range(0, 50)], benchmark=benchmark)
+        self.assertEqual(2, check_baseline(result, benchmark))
+        self.assertEqual(2, len(result.comparisons))
+        self.assertTrue(all([comparison[6] for comparison in result.comparisons]))
+
+        out = StringIO()
+        resttest.write_benchmark_csv(out, result, benchmark)
+        self.assertTrue('Baseline Comparison,' in out.getvalue().splitlines())
+
+        # A baseline that can't be read fails, a baseline without this benchmark only warns
+        benchmark.baseline_file = os.path.join(self.directory, 'missing.json')
+        self.assertEqual(1, check_baseline(result, benchmark))
+        benchmark.baseline_file = os.path.join(self.directory, 'invalid.json')
+        with open(benchmark.baseline_file, 'w') as baseline_file:
+            baseline_file.write('not json')
+        self.assertEqual(1, check_baseline(result, benchmark))
+        benchmark.baseline_file = os.path.join(self.directory, 'others.json')
+        with open(benchmark.baseline_file, 'w') as baseline_file:
+            json.dump([{u'name': u'other', u'aggregates': []}, {u'name': u'another', u'aggregates': []}], baseline_file)
+        self.assertEqual(0, check_baseline(result, benchmark))
+        self.assertRaises(ValueError, parse_benchmark, 'http://localhost', {'baseline_significance': 1.5})
+
+    def test_run_testsets_regression_fails(self):
+        """ Regressed benchmarks add to the failure count used as the exit code """
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), OkHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        path = os.path.join(self.directory, 'instant.json')
+        with open(path, 'w') as baseline_file:  # Impossibly fast baseline, without raw samples
+            json.dump({u'name': u'local', u'aggregates': [[u'total_time', u'mean', 1e-9]]}, baseline_file)
+        benchmark = parse_benchmark('http://127.0.0.1:{0}'.format(server.server_address[1]), {
+            'name': 'local', 'url': '/', 'warmup_runs': 0, 'benchmark_runs': 3,
+            'metrics': [{'total_time': 'mean'}], 'baseline_file': path})
+        testset = TestSet()
+        testset.config.skip_term_colors = True
+        testset.benchmarks = [benchmark]
+        self.assertEqual(1, run_testsets([testset]))
+
+        benchmark.regression_threshold = float('inf')
+        self.assertEqual(0, run_testsets([testset]))
+
+if __name__ == '__main__':
+    unittest.main()
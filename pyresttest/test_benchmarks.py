@@ -1,4 +1,9 @@
+import json
+import math
+import array
+import random
 import unittest
+import pycurl
 from . import benchmarks
 from .benchmarks import *
 
@@ -68,6 +73,51 @@ class BenchmarkTest(unittest.TestCase):
         result = std_deviation([1])
         self.assertTrue(math.fabs(float(result) - 0.0) < 0.001)
 
+    def check_aggregates(self):
+        """ Aggregates over an array('d') and a list of integers agree """
+        numbers = [float(x) for x in range(1, 1001)]
+        random.shuffle(numbers)
+        for values in (array.array('d', numbers), [int(x) for x in numbers]):
+            self.assertAlmostEqual(500.5, AGGREGATES['mean'](values))
+            self.assertAlmostEqual(500.5, AGGREGATES['median'](values))
+            self.assertAlmostEqual(500.5, AGGREGATES['p50'](values))
+            self.assertAlmostEqual(900.1, AGGREGATES['p90'](values))
+            self.assertAlmostEqual(950.05, AGGREGATES['p95'](values))
+            self.assertAlmostEqual(990.01, AGGREGATES['p99'](values))
+            self.assertAlmostEqual(999.001, AGGREGATES['p999'](values))
+            self.assertAlmostEqual(499.5, AGGREGATES['iqr'](values))
+            self.assertEqual(1, AGGREGATES['min'](values))
+            self.assertEqual(1000, AGGREGATES['max'](values))
+            self.assertEqual(500500, AGGREGATES['sum'](values))
+            self.assertAlmostEqual(288.6749902, AGGREGATES['std_deviation'](values), places=5)
+        self.assertEqual(7, AGGREGATES['p99']([7]))
+        self.assertEqual(0, AGGREGATES['iqr']([7]))
+
+        # Compact arrays of integers (INTEGER_METRICS) have integer sums and extremes, with or without numpy
+        integers = array.array('l', [3, 1, 2])
+        for aggregate, expected in (('sum', '6'), ('min', '1'), ('max', '3')):
+            self.assertEqual(expected, json.dumps(AGGREGATES[aggregate](integers)))
+        self.assertEqual('6.0', json.dumps(AGGREGATES['sum'](array.array('d', [3, 1, 2]))))
+
+        # Sorting once for several aggregates, only without numpy
+        values = array.array('d', [3.0, 1.0, 2.0])
+        self.assertEqual(values, presort(values, ['mean', 'p99']))
+        if benchmarks.numpy is None:
+            self.assertEqual([1.0, 2.0, 3.0], presort(values, ['median', 'p99']))
+        self.assertEqual([3.0], list(select_stage(values, array.array('i', [1, 0, 1]), 1))[:1])
+        self.assertEqual([1.0], list(select_stage(values, array.array('i', [1, 0, 1]), 0)))
+
+    def test_aggregates(self):
+        self.check_aggregates()
+
+    def test_aggregates_without_numpy(self):
+        original = benchmarks.numpy
+        benchmarks.numpy = None
+        try:
+            self.check_aggregates()
+        finally:
+            benchmarks.numpy = original
+
     def test_harmonic_mean(self):
         """ Test harmonic mean computation """
         function = AGGREGATES['mean_harmonic']
@@ -112,6 +162,369 @@ class BenchmarkTest(unittest.TestCase):
         self.assertEqual(2, len(benchmark_config.raw_metrics))
         self.assertEqual(2, len(benchmark_config.aggregated_metrics.keys()))
 
+    def test_add_metric_client_metrics(self):
+        """ Metrics measured by pyresttest rather than curl are accepted """
+        benchmark_config = Benchmark()
+        benchmark_config.add_metric('schedule_lag', 'mean')
+        benchmark_config.add_metric('response_time')
+        benchmark_config.add_metric('server_time', 'p99')
+        self.assertEqual(set(['schedule_lag', 'response_time', 'server_time']), benchmark_config.metrics)
+        try:
+            benchmark_config.add_metric('not_a_metric')
+            self.fail("Should throw exception for invalid metric name")
+        except Exception:
+            pass
+
+    def test_parse_duration(self):
+        self.assertEqual(30.0, parse_duration(30))
+        self.assertEqual(1.5, parse_duration('1.5'))
+        self.assertEqual(30.0, parse_duration('30s'))
+        self.assertAlmostEqual(0.5, parse_duration('500ms'))
+        self.assertEqual(300.0, parse_duration('5m'))
+        self.assertEqual(7200.0, parse_duration(' 2H '))
+        self.assertRaises(ValueError, parse_duration, 'ms')
+        self.assertRaises(ValueError, parse_duration, '5 days')
+
+    def test_parse_open_loop(self):
+        """ Parse rate and duration for open-loop benchmarks """
+        cfg = parse_benchmark('what', {'rate': '20', 'duration': '1m'})
+        self.assertEqual(20.0, cfg.rate)
+        self.assertEqual(60.0, cfg.duration)
+
+        cfg = parse_benchmark('what', {'rate': 5})
+        self.assertEqual(5.0, cfg.rate)
+        self.assertTrue(cfg.duration is None)
+
+        self.assertRaises(ValueError, parse_benchmark, 'what', {'rate': 0})
+        self.assertRaises(ValueError, parse_benchmark, 'what', {'rate': 5, 'duration': '-1s'})
+
+        # Without a rate, duration bounds a closed-loop benchmark
+        cfg = parse_benchmark('what', {'duration': '10s'})
+        self.assertEqual(10.0, cfg.duration)
+        self.assertTrue(cfg.rate is None)
+
+    def test_parse_target_precision(self):
+        cfg = parse_benchmark('what', {'target_precision': '5%', 'metrics': ['total_time']})
+        self.assertAlmostEqual(0.05, cfg.target_precision.precision)
+        self.assertEqual(u'total_time', cfg.target_precision.metric)
+        self.assertEqual(u'mean', cfg.target_precision.aggregate)
+
+        cfg = parse_benchmark('what', {'metrics': [{'pretransfer_time': 'median'}], 'target_precision': {
+            'precision': 0.02, 'metric': 'pretransfer_time', 'aggregate': 'median',
+            'confidence': '99%', 'max_runs': 500}})
+        target = cfg.target_precision
+        self.assertEqual((0.02, u'pretransfer_time', u'median', 0.99, 500),
+                         (target.precision, target.metric, target.aggregate, target.confidence, target.max_runs))
+
+        self.assertRaises(ValueError, parse_benchmark, 'what', {'target_precision': '5%'})  # Metric not collected
+        self.assertRaises(ValueError, parse_benchmark, 'what', {'target_precision': 2, 'metrics': ['total_time']})
+        self.assertRaises(ValueError, parse_benchmark, 'what',
+                          {'target_precision': {'precision': 0.1, 'aggregate': 'sum'}, 'metrics': ['total_time']})
+        self.assertRaises(ValueError, parse_benchmark, 'what',
+                          {'target_precision': 0.1, 'rate': 10, 'metrics': ['total_time']})
+
+    def test_confidence_interval(self):
+        self.assertAlmostEqual(1.959964, z_score(0.95), places=5)
+        self.assertAlmostEqual(2.575829, z_score(0.99), places=5)
+        self.assertTrue(confidence_interval([1, 2, 3], u'mean') is None)
+
+        array = [1.0, 2.0, 3.0, 4.0, 5.0] * 20
+        low, high = confidence_interval(array, u'mean', 0.95)
+        half_width = 1.959964 * std_deviation(array) / math.sqrt(100)
+        self.assertAlmostEqual(3.0 - half_width, low, places=5)
+        self.assertAlmostEqual(3.0 + half_width, high, places=5)
+
+        low, high = confidence_interval(list(range(0, 100)), u'median', 0.95)
+        self.assertTrue(low < 49.5 < high)
+        self.assertEqual((40, 60), (low, high))  # Ranks 50 -/+ 1.96 * sqrt(100) / 2
+
+    def test_closed_loop_runs(self):
+        """ Stop after benchmark_runs, or at a duration, or when precision is reached """
+        cfg = parse_benchmark('what', {'benchmark_runs': 7, 'metrics': ['total_time']})
+        collector = MetricCollector(['total_time'])
+        self.assertEqual(7, len(list(closed_loop_runs(cfg, collector))))
+
+        cfg = parse_benchmark('what', {'duration': '50ms', 'benchmark_runs': 1})
+        runs = 0
+        for x in closed_loop_runs(cfg, collector):
+            runs = runs + 1
+        self.assertTrue(runs > 1)
+
+        # Constant results: precise as soon as there are enough of them
+        cfg = parse_benchmark('what', {'benchmark_runs': 20, 'target_precision': '1%', 'metrics': ['total_time']})
+        collector = MetricCollector(['total_time'])
+        for x in closed_loop_runs(cfg, collector):
+            collector.record_metrics({'total_time': 0.5})
+        self.assertEqual(20, collector.count)
+
+        # Noisy results never get precise enough, so stop at max_runs
+        cfg = parse_benchmark('what', {'benchmark_runs': 20, 'metrics': ['total_time'],
+                                       'target_precision': {'precision': '0.1%', 'max_runs': 300}})
+        collector = MetricCollector(['total_time'])
+        for x in closed_loop_runs(cfg, collector):
+            collector.record_metrics({'total_time': float(x % 2)})
+        self.assertEqual(300, collector.count)
+
+    def test_mser_truncation(self):
+        """ Finds the end of a slow start, and doesn't cut much from a steady series """
+        rand = random.Random(5)
+        warming = [1.0 + 0.05 * (100 - x) + rand.uniform(-0.1, 0.1) for x in range(0, 100)]
+        steady = [1.0 + rand.uniform(-0.1, 0.1) for x in range(0, 900)]
+        cutoff = mser_truncation(array.array('d', warming + steady))
+        self.assertTrue(80 <= cutoff <= 120, cutoff)
+        self.assertEqual(0, cutoff % WARMUP_BATCH_SIZE)
+
+        self.assertTrue(mser_truncation(steady) <= 100)
+        self.assertEqual(0, mser_truncation([5.0, 1.0, 1.0]))  # Too short to tell
+        self.assertEqual(0, mser_truncation([1.0] * 100))
+
+    def test_parse_warmup(self):
+        benchmark = parse_benchmark('http://localhost', {'warmup': 'auto'})
+        self.assertTrue(benchmark.warmup_auto)
+        self.assertEqual(0, benchmark.warmup_runs)
+        benchmark = parse_benchmark('http://localhost', {'warmup': 'Auto', 'warmup_runs': 3})
+        self.assertEqual(3, benchmark.warmup_runs)
+        benchmark = parse_benchmark('http://localhost', {'warmup': 25})
+        self.assertFalse(benchmark.warmup_auto)
+        self.assertEqual(25, benchmark.warmup_runs)
+        self.assertRaises(ValueError, parse_benchmark, 'http://localhost',
+                          {'warmup': 'auto', 'metric_storage': 'histogram'})
+
+    def test_parse_concurrency(self):
+        cfg = parse_benchmark('what', {'concurrency': '8'})
+        self.assertEqual(8, cfg.concurrency)
+        self.assertTrue(Benchmark().concurrency is None)
+        self.assertRaises(ValueError, parse_benchmark, 'what', {'concurrency': 0})
+
+    def test_parse_stages(self):
+        """ Parse staged load profiles """
+        cfg = parse_benchmark('what', {'stages': [
+            {'duration': '1m', 'from': 10, 'to': 500, 'name': 'ramp'},
+            [{'duration': '5m'}, {'rate': '500'}],
+            {'duration': 30, 'rate': 100}]})
+        self.assertEqual(3, len(cfg.stages))
+        self.assertEqual(u'ramp', cfg.stages[0].name)
+        self.assertEqual((60.0, 10.0, 500.0), (cfg.stages[0].duration,
+                         cfg.stages[0].rate_from, cfg.stages[0].rate_to))
+        self.assertEqual((300.0, 500.0, 500.0), (cfg.stages[1].duration,
+                         cfg.stages[1].rate_from, cfg.stages[1].rate_to))
+        self.assertEqual(u'stage 3', cfg.stages[2].name)
+
+        self.assertRaises(ValueError, parse_benchmark, 'what', {'stages': []})
+        self.assertRaises(ValueError, parse_benchmark, 'what', {'stages': [{'rate': 5}]})
+        self.assertRaises(ValueError, parse_benchmark, 'what', {'stages': [{'duration': 5}]})
+        self.assertRaises(ValueError, parse_benchmark, 'what',
+                          {'stages': [{'duration': 5, 'from': 0, 'to': 0}]})
+        self.assertRaises(ValueError, parse_benchmark, 'what',
+                          {'stages': [{'duration': 5, 'rate': 5}], 'rate': 10})
+
+    def test_stage_start_times(self):
+        """ Requests are spread out to follow the rate of each stage """
+        hold = Stage(2, 5)
+        self.assertEqual(10, hold.request_count())
+        self.assertEqual([x / 5.0 for x in range(0, 10)], list(hold.start_times()))
+
+        ramp = Stage(10, 0, 20)  # 100 requests, starting slow and speeding up
+        times = list(ramp.start_times())
+        self.assertEqual(100, len(times))
+        self.assertEqual(0, times[0])
+        self.assertTrue(times[-1] < 10)
+        # Half the requests in the last 30% of the ramp: 0.5 = 1 - 0.7^2, roughly
+        self.assertAlmostEqual(10 * math.sqrt(0.5), times[50], places=5)
+        gaps = [times[i + 1] - times[i] for i in range(0, len(times) - 1)]
+        self.assertEqual(sorted(gaps, reverse=True), gaps)
+
+        ramp_down = Stage(10, 20, 0)
+        times = list(ramp_down.start_times())
+        self.assertEqual(100, len(times))
+        gaps = [times[i + 1] - times[i] for i in range(0, len(times) - 1)]
+        self.assertEqual(sorted(gaps), gaps)
+
+    def test_request_schedule(self):
+        cfg = parse_benchmark('what', {'rate': 4, 'duration': 1})
+        self.assertEqual([(0.0, None), (0.25, None), (0.5, None), (0.75, None)],
+                         list(request_schedule(cfg)))
+
+        cfg = parse_benchmark('what', {'rate': 2, 'benchmark_runs': 3})
+        self.assertEqual([(0.0, None), (0.5, None), (1.0, None)], list(request_schedule(cfg)))
+
+        cfg = parse_benchmark('what', {'stages': [{'duration': 1, 'rate': 2}, {'duration': 1, 'rate': 1}]})
+        self.assertEqual([(0.0, 0), (0.5, 0), (1.0, 1)], list(request_schedule(cfg)))
+
+    def test_metric_collector(self):
+        """ Collects curl metrics plus schedule lag and corrected response time """
+        class FakeCurl(object):
+            def getinfo(self, info):
+                return {pycurl.TOTAL_TIME: 0.5, pycurl.SIZE_DOWNLOAD: 100}[info]
+
+        collector = MetricCollector(['total_time', 'size_download', 'schedule_lag', 'response_time'])
+        collector.record(FakeCurl())
+        collector.record(FakeCurl(), schedule_lag=0.25)
+        results = collector.get_results()
+        self.assertEqual([0.5, 0.5], list(results['total_time']))
+        self.assertEqual([100, 100], list(results['size_download']))
+        self.assertEqual([0.0, 0.25], list(results['schedule_lag']))
+        self.assertEqual([0.5, 0.75], list(results['response_time']))
+        self.assertEqual(2, collector.count)
+
+        # Same results from a transport's metrics
+        collector = MetricCollector(['total_time', 'size_download', 'schedule_lag', 'response_time'])
+        self.assertEqual(['total_time', 'size_download'], collector.transport_metrics)
+        collector.record_metrics({'total_time': 0.5, 'size_download': 100}, schedule_lag=0.25)
+        results = collector.get_results()
+        self.assertEqual([0.5], list(results['total_time']))
+        self.assertEqual([0.25], list(results['schedule_lag']))
+        self.assertEqual([0.75], list(results['response_time']))
+        self.assertEqual(['total_time'], MetricCollector(['response_time']).transport_metrics)
+        self.assertTrue(collector.stages is None)
+
+        # Integer metrics stay integers in raw output
+        collector = MetricCollector(['total_time', 'request_size', 'num_connects'])
+        collector.record_metrics({'total_time': 0.5, 'request_size': 123, 'num_connects': 1})
+        results = collector.get_results()
+        self.assertEqual('[123]', json.dumps(list(results['request_size'])))
+        self.assertEqual('[1]', json.dumps(list(results['num_connects'])))
+        self.assertEqual('[0.5]', json.dumps(list(results['total_time'])))
+
+        collector = MetricCollector(['total_time'], track_stages=True)
+        collector.record(FakeCurl(), stage=0)
+        collector.record(FakeCurl(), stage=1)
+        self.assertEqual([0, 1], list(collector.stages))
+        self.assertTrue(collector.get_stage_results() is None)
+
+        # Histogram storage, with one histogram per stage instead of stage indices
+        collector = MetricCollector(['total_time', 'response_time'], track_stages=True, storage=u'histogram')
+        collector.record(FakeCurl(), schedule_lag=0.25, stage=0)
+        collector.record(FakeCurl(), stage=0)
+        results = collector.get_results()
+        self.assertEqual(2, len(results['total_time']))
+        self.assertAlmostEqual(0.625, compute_aggregate('mean', results['response_time']))
+        self.assertTrue(collector.stages is None)
+        self.assertEqual(2, collector.get_stage_results()[0]['total_time'].count)
+
+        # Precision targets work from histograms too
+        target = PrecisionTarget(0.01)
+        self.assertFalse(target.is_met(results['total_time']))  # Too few samples
+        for x in range(0, 20):
+            collector.record(FakeCurl(), stage=0)
+        self.assertTrue(target.is_met(collector.get_results()['total_time']))
+
+    def test_collector_failures(self):
+        """ Errors are counted by curl code or exception type, failed responses' metrics kept apart """
+        self.assertEqual(7, error_key(pycurl.error(7, "Failed to connect")))
+        self.assertEqual('ValueError', error_key(ValueError("bad")))
+
+        collector = MetricCollector(['total_time'], track_failures=True)
+        collector.record_status(200)
+        collector.record_metrics({'total_time': 0.1})
+        collector.record_status(500)
+        collector.record_failure(metrics={'total_time': 2.0})
+        collector.record_failure(error=pycurl.error(28, "Timeout"))
+        collector.record_failure(error=pycurl.error(28, "Timeout"))
+        self.assertEqual({200: 1, 500: 1}, collector.status_counts)
+        self.assertEqual({28: 2}, collector.error_counts)
+        self.assertEqual([0.1], list(collector.get_results()['total_time']))
+        self.assertEqual(1, collector.count)
+        self.assertEqual([2.0], list(collector.failed.get_results()['total_time']))
+
+        # Without tracking, failures are only counted
+        collector = MetricCollector(['total_time'])
+        collector.record_failure(metrics={'total_time': 2.0})
+        self.assertTrue(collector.failed is None)
+
+    def test_collector_client_times(self):
+        """ Client overhead for each phase, and their total, 0 if not measured """
+        benchmark = Benchmark()
+        benchmark.add_metric('template_time', 'mean').add_metric('client_prepare_time', 'max')
+        collector = MetricCollector(benchmark.metrics)
+        self.assertEqual([], collector.transport_metrics)
+        collector.record_metrics({}, client_times=(0.001, 0.002, 0.004))
+        collector.record_metrics({})
+        results = collector.get_results()
+        self.assertEqual([0.002, 0.0], list(results['template_time']))
+        self.assertAlmostEqual(0.007, results['client_prepare_time'][0])
+        self.assertEqual(0.0, results['client_prepare_time'][1])
+
+    def test_parse_thresholds(self):
+        """ Thresholds on aggregates and run values, with their aggregates added to the benchmark """
+        benchmark = parse_benchmark('http://localhost', {
+            'metrics': [{'total_time': 'mean'}],
+            'thresholds': {'total_time': {'p99': '<250ms', 'mean': '< 0.08'}, 'error_rate': '<0.01',
+                           'throughput': '>=500'}})
+        thresholds = dict([((t.metricname, t.aggregate), t) for t in benchmark.thresholds])
+        self.assertEqual(4, len(thresholds))
+        self.assertAlmostEqual(0.25, thresholds[('total_time', 'p99')].limit)
+        self.assertEqual('<0.08', thresholds[('total_time', 'mean')].expression())
+        self.assertEqual(500.0, thresholds[('throughput', None)].limit)
+        self.assertEqual(['mean', 'p99'], benchmark.aggregated_metrics['total_time'])
+
+        threshold = thresholds[('throughput', None)]
+        self.assertTrue(threshold.is_met(500))
+        self.assertFalse(threshold.is_met(499.9))
+        self.assertFalse(threshold.is_met(None))
+
+        self.assertRaises(ValueError, parse_thresholds, {'total_time': {'p99': '0.25'}})
+        self.assertRaises(ValueError, parse_thresholds, {'total_time': {'p42': '<0.25'}})
+        self.assertRaises(ValueError, parse_thresholds, {'bogus_time': {'p99': '<0.25'}})
+        self.assertRaises(ValueError, parse_thresholds, {'total_time': '<0.25'})
+
+    def test_parse_validate_sample_rate(self):
+        benchmark = parse_benchmark('http://localhost', {'validate_sample_rate': '10'})
+        self.assertEqual(10, benchmark.validate_sample_rate)
+        self.assertRaises(ValueError, parse_benchmark, 'http://localhost', {'validate_sample_rate': 0})
+
+    def check_derived_metrics(self):
+        """ Phase times from cumulative curl timings, never negative """
+        results = {'namelookup_time': array.array('d', [0.01, 0.0]),
+                   'connect_time': array.array('d', [0.03, 0.0]),
+                   'appconnect_time': array.array('d', [0.0, 0.0]),  # No TLS
+                   'pretransfer_time': array.array('d', [0.04, 0.001]),
+                   'starttransfer_time': array.array('d', [0.24, 0.101]),
+                   'total_time': array.array('d', [0.25, 0.201])}
+        derived = derive_metrics(results, ['dns_time', 'tcp_time', 'tls_time', 'server_time', 'transfer_time', 'total_time'])
+        self.assertEqual([0.01, 0.0], list(derived['dns_time']))
+        self.assertAlmostEqual(0.02, derived['tcp_time'][0])
+        self.assertEqual([0.0, 0.0], list(derived['tls_time']))
+        self.assertAlmostEqual(0.2, derived['server_time'][0])
+        self.assertAlmostEqual(0.1, derived['server_time'][1])
+        self.assertAlmostEqual(0.1, derived['transfer_time'][1])
+        self.assertTrue(derived['total_time'] is results['total_time'])
+        self.assertTrue(results is derive_metrics(results, ['total_time']))
+
+    def test_derived_metrics(self):
+        self.check_derived_metrics()
+
+    def test_derived_metrics_without_numpy(self):
+        original = benchmarks.numpy
+        benchmarks.numpy = None
+        try:
+            self.check_derived_metrics()
+        finally:
+            benchmarks.numpy = original
+
+    def test_collect_derived_metrics(self):
+        """ Collectors gather what derived metrics need, histograms compute them as values are stored """
+        timings = {'namelookup_time': 0.01, 'connect_time': 0.03, 'appconnect_time': 0.05,
+                   'pretransfer_time': 0.06, 'starttransfer_time': 0.26, 'total_time': 0.3}
+        benchmark = Benchmark()
+        benchmark.add_metric('server_time', 'mean').add_metric('tls_time', 'max')
+        self.assertEqual(set(['server_time', 'tls_time']), benchmark.metrics)
+
+        collector = MetricCollector(benchmark.metrics)
+        self.assertEqual(set(['starttransfer_time', 'pretransfer_time', 'appconnect_time', 'connect_time']),
+                         set(collector.metricnames))
+        collector.record_metrics(timings)
+        self.assertAlmostEqual(0.2, derive_metrics(collector.get_results(), ['server_time'])['server_time'][0])
+
+        collector = MetricCollector(['dns_time', 'server_time'], storage=u'histogram')
+        self.assertEqual(['dns_time', 'server_time', 'namelookup_time', 'starttransfer_time', 'pretransfer_time'],
+                         collector.metricnames)
+        collector.record_metrics(timings)
+        results = collector.get_results()
+        self.assertAlmostEqual(0.2, results['server_time'].mean())
+        self.assertAlmostEqual(0.01, results['dns_time'].mean())
+        self.assertTrue(results is derive_metrics(results, ['dns_time', 'server_time']))
+
 
 if __name__ == '__main__':
     unittest.main()
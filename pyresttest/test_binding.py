@@ -30,6 +30,22 @@ class BindingTest(unittest.TestCase):
         self.assertEqual('bar2', context.get_value('foo'))
         self.assertEqual(2, context.mod_count)
 
+    def test_versions(self):
+        """ Each variable's version changes only when its own value changes """
+        context = Context()
+        self.assertEqual((0, 0), context.get_versions(['foo', 'bar']))
+        context.bind_variable('foo', 'x')
+        context.bind_variable('bar', 'y')
+        self.assertEqual((1, 2), context.get_versions(['foo', 'bar']))
+        context.bind_variable('foo', 'x')  # Same value
+        context.bind_variable('bar', 'z')
+        self.assertEqual((1, 3), context.get_versions(['foo', 'bar']))
+
+        copied = context.copy()
+        copied.bind_variable('foo', 'changed')
+        self.assertEqual((4, 3), copied.get_versions(['foo', 'bar']))
+        self.assertEqual((1, 3), context.get_versions(['foo', 'bar']))
+
     def test_generator(self):
         """ Test adding a generator """
         context = Context()
@@ -64,5 +80,19 @@ class BindingTest(unittest.TestCase):
         self.assertEqual(1, context.get_value('foo'))
         self.assertEqual(2, context.mod_count)
 
+    def test_copy(self):
+        """ Copied context has its own variables but shares generators """
+        context = Context()
+        context.add_generator('gen', count_gen())
+        context.bind_variable('foo', 'bar')
+        copied = context.copy()
+        self.assertEqual('bar', copied.get_value('foo'))
+        copied.bind_variable('foo', 'baz')
+        self.assertEqual('bar', context.get_value('foo'))
+        self.assertEqual('baz', copied.get_value('foo'))
+
+        self.assertEqual(1, context.bind_generator_next('x', 'gen'))
+        self.assertEqual(2, copied.bind_generator_next('x', 'gen'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import pycurl
+
+from . import connections
+from .connections import CurlPool
+
+
+class ConnectionsTest(unittest.TestCase):
+    """ Tests for pooled curl handles """
+
+    def test_host_key(self):
+        self.assertEqual(('http', 'localhost:8000'),
+                         CurlPool.host_key('http://localhost:8000/api/person/'))
+        self.assertEqual(('https', 'api.github.com'),
+                         CurlPool.host_key('HTTPS://API.github.com/users'))
+
+    def test_acquire_release(self):
+        """ Handles are reused only for the same host """
+        pool = CurlPool()
+        first = pool.acquire('http://localhost:8000/api/person/')
+        self.assertTrue(isinstance(first, type(pycurl.Curl())))
+        pool.release('http://localhost:8000/api/person/', first)
+
+        self.assertTrue(first is pool.acquire('http://localhost:8000/other/'))
+        pool.release('http://localhost:8000/other/', first)
+        other_host = pool.acquire('http://localhost:9000/api/person/')
+        self.assertFalse(first is other_host)
+
+        # Two handles out at once for the same host must differ
+        second = pool.acquire('http://localhost:8000/api/person/')
+        third = pool.acquire('http://localhost:8000/api/person/')
+        self.assertFalse(second is third)
+        pool.release('http://localhost:9000/', other_host)
+        pool.release('http://localhost:8000/', second)
+        pool.release('http://localhost:8000/', third)
+        pool.close()
+        self.assertEqual(0, len(pool.idle))
+
+
+if __name__ == '__main__':
+    unittest.main()
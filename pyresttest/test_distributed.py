@@ -0,0 +1,203 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from . import distributed
+from .distributed import *
+from . import resttest
+from . import validators
+from .contenthandling import ContentHandler
+from .benchmarks import Benchmark, parse_benchmark
+from .histogram import Histogram
+
+TOKEN = u'secret'
+
+
+class DistributedTest(unittest.TestCase):
+    """ Tests for distributed benchmarks, agents run in threads on localhost """
+
+    def start_agent(self, run_job=resttest.run_benchmark_job):
+        server = AgentServer(('127.0.0.1', 0), run_job, TOKEN)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address
+
+    def test_parse_address(self):
+        self.assertEqual(('127.0.0.1', 7777), parse_address('7777'))  # Only localhost unless a host is given
+        self.assertEqual(('0.0.0.0', 7777), parse_address('0.0.0.0:7777'))
+        self.assertEqual(('127.0.0.1', 8000), parse_address('127.0.0.1:8000'))
+        self.assertEqual(('::1', 8000), parse_address('[::1]:8000'))
+        self.assertEqual([('localhost', 7000), ('10.0.0.2', 7001)],
+                         parse_agents('7000, 10.0.0.2:7001'))
+
+    def test_share_of(self):
+        self.assertEqual([4, 3, 3], [share_of(10, i, 3) for i in range(0, 3)])
+        self.assertEqual([1, 0, 0], [share_of(1, i, 3) for i in range(0, 3)])
+
+    def test_apply_share(self):
+        benchmark = parse_benchmark('', {
+            'url': '/', 'benchmark_runs': 5, 'concurrency': 3,
+            'stages': [{'duration': 1, 'rate': 10}, {'duration': 1, 'from': 10, 'to': 20}]})
+        apply_share(benchmark, 0, 2)
+        self.assertEqual(3, benchmark.benchmark_runs)
+        self.assertEqual(2, benchmark.concurrency)
+        self.assertEqual(5.0, benchmark.stages[1].rate_from)
+        self.assertEqual(10.0, benchmark.stages[1].rate_to)
+
+        benchmark = parse_benchmark('', {'url': '/', 'benchmark_runs': 1, 'rate': 9})
+        apply_share(benchmark, 2, 3)
+        self.assertEqual(1, benchmark.benchmark_runs)  # Every agent runs at least one
+        self.assertEqual(3.0, benchmark.rate)
+
+    def test_merge_results(self):
+        merged = merge_results([
+            {u'results': {u'total_time': [1, 2]}, u'failures': 1, u'count': 2, u'elapsed': 3.0, u'sample_stages': [0, 1],
+             u'warmup_cutoff': 5},
+            {u'results': {u'total_time': [3]}, u'failures': 0, u'count': 1, u'elapsed': 4.0, u'sample_stages': [1],
+             u'warmup_cutoff': 10}])
+        self.assertEqual([1, 2, 3], merged[u'results'][u'total_time'])
+        self.assertEqual(1, merged[u'failures'])
+        self.assertEqual(3, merged[u'count'])
+        self.assertEqual(4.0, merged[u'elapsed'])
+        self.assertEqual([0, 1, 1], merged[u'sample_stages'])
+        self.assertEqual(15, merged[u'warmup_cutoff'])
+
+    def test_merge_results_errors(self):
+        """ Status and error counts are summed, with status codes back to integers after JSON """
+        merged = merge_results([
+            {u'results': {}, u'failures': 2, u'count': 1, u'elapsed': 1.0,
+             u'status_counts': {u'200': 1, u'500': 1}, u'error_counts': {u'7': 1},
+             u'failure_results': {u'total_time': [0.5]}, u'validated': 1, u'validation_failures': 0},
+            {u'results': {}, u'failures': 1, u'count': 1, u'elapsed': 1.0,
+             u'status_counts': {u'500': 1}, u'error_counts': {u'ValueError': 1},
+             u'failure_results': {u'total_time': [0.25]}, u'validated': 1, u'validation_failures': 1}])
+        self.assertEqual({200: 1, 500: 2}, merged[u'status_counts'])
+        self.assertEqual({7: 1, u'ValueError': 1}, merged[u'error_counts'])
+        self.assertEqual([0.5, 0.25], merged[u'failure_results'][u'total_time'])
+        self.assertEqual(2, merged[u'validated'])
+        self.assertEqual(1, merged[u'validation_failures'])
+
+    def test_merge_results_histograms(self):
+        first = Histogram()
+        second = Histogram()
+        first.append(1.0)
+        second.append(3.0)
+        merged = merge_results([
+            {u'results': encode_results({u'total_time': first}), u'failures': 0, u'count': 1, u'elapsed': 1.0,
+             u'stage_results': {u'0': encode_results({u'total_time': first})}},
+            {u'results': encode_results({u'total_time': second}), u'failures': 0, u'count': 1, u'elapsed': 1.0,
+             u'stage_results': {u'0': encode_results({u'total_time': second})}}])
+        self.assertEqual(2, merged[u'results'][u'total_time'].count)
+        self.assertAlmostEqual(2.0, merged[u'results'][u'total_time'].mean())
+        self.assertEqual(2, merged[u'stage_results'][0][u'total_time'].count)
+
+    def test_run_on_agents(self):
+        """ Jobs go to each agent, replies come back in order """
+        agents = [self.start_agent(lambda job: {u'echo': job}) for x in range(0, 2)]
+        replies = run_on_agents(agents, [1, 2], TOKEN)
+        self.assertEqual([{u'echo': 1}, {u'echo': 2}], replies)
+
+    def test_agent_token(self):
+        """ Agents refuse jobs without their token, and can't be started without one """
+        ran = list()
+        agents = [self.start_agent(lambda job: ran.append(job) or {})]
+        for token in (u'wrong', None):
+            try:
+                run_on_agents(agents, [1], token)
+                self.fail("Should refuse a job with a wrong token")
+            except Exception as e:
+                self.assertTrue('token' in str(e))
+        self.assertEqual([], ran)
+        self.assertTrue(token_matches(u'secret', u'secret'))
+        self.assertFalse(token_matches(u'secre', u'secret'))
+        self.assertRaises(ValueError, AgentServer, ('127.0.0.1', 0), ran.append, None)
+
+    def test_run_on_agents_error(self):
+        def fail(job):
+            raise ValueError("bad job")
+        agents = [self.start_agent(fail)]
+        try:
+            run_on_agents(agents, [1], TOKEN)
+            self.fail("Should raise an exception for an agent failure")
+        except Exception as e:
+            self.assertTrue('bad job' in str(e))
+
+    def test_run_benchmark_distributed(self):
+        """ Benchmark with load split over two agents, against a closed port so every request fails """
+        agents = [self.start_agent() for x in range(0, 2)]
+        benchmark = parse_benchmark('http://127.0.0.1:1', {
+            'url': '/', 'warmup_runs': 0, 'benchmark_runs': 5, 'concurrency': 2,
+            'metrics': [{'total_time': 'mean'}]})
+        config = resttest.TestConfig()
+        config.timeout = 5
+        result = resttest.run_benchmark_distributed(benchmark, config, agents=agents, agent_token=TOKEN)
+        self.assertEqual(5, result.failures)
+        self.assertEqual(0, result.count)
+        self.assertEqual([(u'total_time', u'mean', None)], result.aggregates)
+
+    def test_run_benchmark_job_files(self):
+        """ Agents don't read body files or write output files, body content comes from the coordinator """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        interval_path = os.path.join(directory, 'intervals.json')
+        node = {'url': '/', 'method': 'POST', 'body': {'file': '/nonexistent/body.json'}, 'warmup_runs': 0,
+                'benchmark_runs': 1, 'interval_output': interval_path, 'metrics': [{'total_time': 'mean'}]}
+        job = {u'base_url': 'http://127.0.0.1:1', u'benchmark': node, u'config': {u'timeout': 5},
+               u'ssl_insecure': False, u'variables': {}, u'share': [0, 1], u'seed': 1}
+        self.assertRaises(ValueError, resttest.run_benchmark_job, job)
+
+        job[u'body'] = {u'content': u'sent', u'template': False}
+        reply = resttest.run_benchmark_job(job)
+        self.assertEqual(1, reply[u'failures'])
+        self.assertFalse(os.path.exists(interval_path))
+
+    def test_run_benchmark_job_refused(self):
+        """ Agents refuse curl options and validators with file content, either could touch the agent's files """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        cookie_path = os.path.join(directory, 'cookies.txt')
+        node = {'url': '/', 'warmup_runs': 0, 'benchmark_runs': 1, 'curl_option_cookiejar': cookie_path,
+                'metrics': [{'total_time': 'mean'}]}
+        job = {u'base_url': 'http://127.0.0.1:1', u'benchmark': node, u'config': {u'timeout': 5},
+               u'ssl_insecure': False, u'variables': {}, u'share': [0, 1], u'seed': 1}
+        self.assertRaises(ValueError, resttest.run_benchmark_job, job)
+        self.assertFalse(os.path.exists(cookie_path))
+
+        class FileValidator(validators.AbstractValidator):
+            @classmethod
+            def parse(cls, config):
+                validator = FileValidator()
+                validator.schema = ContentHandler.parse_content(config['schema'])
+                return validator
+        validators.register_validator('file_content', FileValidator.parse)
+        self.addCleanup(validators.VALIDATORS.pop, 'file_content')
+        del node['curl_option_cookiejar']
+        node['validators'] = [{'file_content': {'schema': {'file': '/nonexistent/schema.json'}}}]
+        self.assertRaises(ValueError, resttest.run_benchmark_job, job)
+
+        node['validators'] = [{'file_content': {'schema': '{}'}}]
+        self.assertEqual(1, resttest.run_benchmark_job(job)[u'failures'])
+
+    def test_run_benchmark_distributed_body_file(self):
+        """ The coordinator reads a body file and sends its content with the job """
+        jobs = list()
+        agents = [self.start_agent(lambda job: jobs.append(job) or resttest.run_benchmark_job(job))]
+        body_file = tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False)
+        self.addCleanup(os.remove, body_file.name)
+        body_file.write(u'{"id": "$id"}')
+        body_file.close()
+        benchmark = parse_benchmark('http://127.0.0.1:1', {
+            'url': '/', 'method': 'POST', 'body': {'template': {'file': body_file.name}},
+            'warmup_runs': 0, 'benchmark_runs': 1, 'metrics': [{'total_time': 'mean'}]})
+        config = resttest.TestConfig()
+        config.timeout = 5
+        resttest.run_benchmark_distributed(benchmark, config, agents=agents, agent_token=TOKEN)
+        self.assertEqual({u'content': u'{"id": "$id"}', u'template': True}, jobs[0][u'body'])
+
+
+if __name__ == '__main__':
+    unittest.main()
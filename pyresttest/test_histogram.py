@@ -0,0 +1,93 @@
+import random
+import unittest
+
+from . import histogram
+from .histogram import *
+from . import benchmarks
+
+
+class HistogramTest(unittest.TestCase):
+    """ Tests for constant-memory metric histograms """
+
+    def test_relative_error(self):
+        """ Bucket values are within the relative error of values in them """
+        hist = Histogram(0.01)
+        for value in [1e-6, 0.0031, 0.5, 1.0, 7.25, 1000.0, 123456.789]:
+            bucket_value = hist.bucket_value(hist.bucket_index(value))
+            self.assertTrue(abs(bucket_value - value) <= value * 0.01)
+        self.assertRaises(ValueError, Histogram, 0)
+        self.assertRaises(ValueError, hist.append, -1)
+
+    def test_aggregates(self):
+        """ Aggregates match those from a list, exact or within the relative error """
+        values = [random.expovariate(50) for x in range(0, 2001)] + [0, 0]
+        hist = Histogram()
+        for value in values:
+            hist.append(value)
+
+        self.assertEqual(len(values), len(hist))
+        self.assertAlmostEqual(sum(values), hist.aggregate('sum'))
+        self.assertAlmostEqual(benchmarks.AGGREGATES['mean'](values), hist.aggregate('mean'))
+        self.assertAlmostEqual(benchmarks.std_deviation(values), hist.aggregate('std_deviation'))
+        median = benchmarks.median(values)
+        self.assertTrue(abs(hist.aggregate('median') - median) <= median * 0.001)
+        self.assertEqual(0, hist.value_at_rank(0))
+        self.assertEqual(max(values), hist.value_at_rank(len(values) - 1))
+        self.assertEqual(max(values), hist.aggregate('max'))
+        for name in ('p90', 'p99', 'iqr'):
+            expected = benchmarks.AGGREGATES[name](values)
+            self.assertTrue(abs(benchmarks.compute_aggregate(name, hist) - expected) <= expected * 0.001)
+        self.assertEqual(0.0, hist.aggregate('mean_harmonic'))  # Zeros present
+        self.assertRaises(ValueError, hist.aggregate, 'nonsense')
+
+    def test_median_even_count(self):
+        hist = Histogram()
+        for value in [1.0, 2.0, 3.0, 4.0]:
+            hist.append(value)
+        self.assertTrue(abs(2.5 - hist.median()) < 0.01)
+        self.assertTrue(abs(benchmarks.AGGREGATES['mean_harmonic']([1.0, 2.0, 3.0, 4.0]) -
+                            hist.mean_harmonic()) < 0.01)
+
+    def test_constant_memory(self):
+        """ Repeated values don't add buckets """
+        hist = Histogram()
+        for x in range(0, 10000):
+            hist.append(0.25)
+            hist.append(0.5)
+        self.assertEqual(2, len(hist.counts))
+        self.assertEqual(20000, hist.count)
+
+    def test_merge(self):
+        values = [random.uniform(0.001, 2.0) for x in range(0, 1000)]
+        whole = Histogram()
+        first = Histogram()
+        second = Histogram()
+        for index, value in enumerate(values):
+            whole.append(value)
+            (first if index < 300 else second).append(value)
+        first.merge(second).merge(Histogram())
+
+        self.assertEqual(whole.count, first.count)
+        self.assertEqual(whole.counts, first.counts)
+        self.assertAlmostEqual(whole.mean(), first.mean())
+        self.assertAlmostEqual(whole.std_deviation(), first.std_deviation())
+        self.assertEqual((whole.min_value, whole.max_value), (first.min_value, first.max_value))
+        self.assertRaises(ValueError, first.merge, Histogram(0.01))
+
+        empty = Histogram()
+        empty.merge(whole)
+        self.assertEqual(whole.median(), empty.median())
+
+    def test_to_from_dict(self):
+        hist = Histogram()
+        for value in [0, 0.5, 0.75, 3.0]:
+            hist.append(value)
+        copied = Histogram.from_dict(hist.to_dict())
+        self.assertEqual(hist.value_counts(), copied.value_counts())
+        self.assertEqual(hist.mean(), copied.mean())
+        self.assertEqual(hist.std_deviation(), copied.std_deviation())
+        self.assertEqual(4, len(copied))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from . import history
+from .history import *
+from .resttest import BenchmarkResult, TestSet, run_testsets
+from .benchmarks import parse_benchmark
+
+
+class HistoryTest(unittest.TestCase):
+    """ Tests for the benchmark history database """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'history.db')
+
+    def result(self, p99, name=u'Basic GET'):
+        result = BenchmarkResult()
+        result.name = name
+        result.group = u'Default'
+        result.count = 100
+        result.failures = 1
+        result.elapsed = 2.0
+        result.throughput = 50.0
+        result.aggregates = [(u'total_time', u'p99', p99), (u'total_time', u'mean', p99 / 2)]
+        result.stage_aggregates = [(u'warm', u'total_time', u'p99', p99 * 2)]
+        return result
+
+    def test_record_query(self):
+        store = HistoryStore(self.path)
+        self.addCleanup(store.close)
+        for index in range(0, 5):
+            store.record(self.result(0.1 * (index + 1)), base_url=u'http://localhost',
+                         label=u'build-' + str(index), revision=u'abc123', timestamp=1000.0 + index)
+        store.record(self.result(9.0, name=u'Other'), timestamp=2000.0)
+
+        rows = store.query(u'Basic GET', u'total_time', u'p99')
+        self.assertEqual(5, len(rows))
+        self.assertEqual((1000.0, u'build-0', u'abc123'), rows[0][0:3])
+        self.assertAlmostEqual(0.5, rows[-1][3])
+
+        last = store.query(u'Basic GET', u'total_time', u'p99', last=2)
+        self.assertEqual([u'build-3', u'build-4'], [row[1] for row in last])
+        self.assertAlmostEqual(0.2, store.query(u'Basic GET', u'total_time', u'p99', stage=u'warm')[0][3])
+        self.assertEqual(1, len(store.query(u'Basic GET', u'total_time', u'mean', label=u'build-2')))
+        self.assertEqual([50.0] * 5, [row[3] for row in store.query(u'Basic GET', u'throughput')])
+        self.assertEqual([], store.query(u'Missing', u'total_time', u'p99'))
+        self.assertRaises(ValueError, store.query, u'Basic GET', u'total_time')
+
+        self.assertEqual([(u'Basic GET', u'total_time', u'mean', 5), (u'Basic GET', u'total_time', u'p99', 5),
+                          (u'Other', u'total_time', u'mean', 1), (u'Other', u'total_time', u'p99', 1)],
+                         store.summary())
+
+    def test_write_history(self):
+        rows = [(0.0, u'build-1', None, 0.25), (60.0, None, u'abc123', None)]
+        out = StringIO()
+        write_history(out, rows, u'csv')
+        self.assertEqual([u'timestamp,label,revision,value', u'1970-01-01T00:00:00Z,build-1,,0.25',
+                          u'1970-01-01T00:01:00Z,,abc123,'], out.getvalue().splitlines())
+
+        out = StringIO()
+        write_history(out, rows, u'json')
+        self.assertEqual({u'timestamp': u'1970-01-01T00:00:00Z', u'label': u'build-1',
+                          u'revision': None, u'value': 0.25}, json.loads(out.getvalue())[0])
+
+        out = StringIO()
+        write_history(out, rows)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith(u'timestamp             label'))
+
+    def test_command_line(self):
+        store = HistoryStore(self.path)
+        store.record(self.result(0.25), label=u'nightly')
+        store.close()
+        export = self.path + u'.csv'
+        history.command_line_run([self.path, '--benchmark', 'Basic GET', '--aggregate', 'p99',
+                                  '--last', '30', '--format', 'csv', '--output', export])
+        with open(export, 'r') as export_file:
+            lines = export_file.read().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[1].endswith(u',nightly,{0},0.25'.format(lines[1].split(',')[2])))
+        self.assertRaises(ValueError, history.main, {'history': self.path + u'.missing'})
+        self.assertRaises(ValueError, history.main, {'history': self.path, 'format': 'xml'})
+
+    def test_run_testsets_records_history(self):
+        """ Benchmarks with a history file add a run to it each time """
+        benchmark = parse_benchmark('http://127.0.0.1:1', {
+            'name': 'unreachable', 'url': '/', 'warmup_runs': 0, 'benchmark_runs': 2,
+            'metrics': ['total_time'], 'history_file': self.path, 'history_label': 42})
+        self.assertEqual(u'42', benchmark.history_label)
+        testset = TestSet()
+        testset.config.skip_term_colors = True
+        testset.benchmarks = [benchmark]
+        run_testsets([testset])
+        run_testsets([testset])
+
+        store = HistoryStore(self.path)
+        self.addCleanup(store.close)
+        rows = store.query(u'unreachable', u'failures')
+        self.assertEqual([(u'42', 2), (u'42', 2)], [(row[1], row[3]) for row in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
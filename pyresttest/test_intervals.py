@@ -0,0 +1,157 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from . import intervals
+from .intervals import *
+from .benchmarks import MetricCollector, parse_benchmark
+from . import resttest
+
+
+class KeepOpen(StringIO):
+    """ StringIO that keeps its contents when closed """
+
+    def close(self):
+        pass
+
+
+class IntervalsTest(unittest.TestCase):
+    """ Tests for interval output while benchmarks run """
+
+    def rows(self, out):
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_intervals_by_time(self):
+        """ A row per second, including seconds with no requests """
+        out = KeepOpen()
+        recorder = IntervalRecorder(out, ['total_time', 'size_download'], interval=1.0)
+        recorder.start(now=100.0)
+        recorder.record([0.1, 10], now=100.2)
+        recorder.record([0.3, 10], now=100.5)
+        recorder.record_failure(now=100.7)
+        self.assertEqual(u'', out.getvalue())  # Nothing until the interval ends
+
+        recorder.record([0.2, 10], now=102.5)  # Second 1 has no requests
+        recorder.close(now=102.75)
+
+        rows = self.rows(out)
+        self.assertEqual([0, 1, 2], [row['interval'] for row in rows])
+        self.assertEqual([2, 0, 1], [row['count'] for row in rows])
+        self.assertEqual([1, 0, 0], [row['failures'] for row in rows])
+        self.assertEqual(2.0, rows[0]['throughput'])
+        self.assertEqual(0.0, rows[1]['throughput'])
+        self.assertAlmostEqual(0.2, rows[0]['total_time_p50'])
+        self.assertAlmostEqual(0.3, rows[0]['total_time_max'])
+        self.assertEqual(None, rows[1]['total_time_p99'])
+        self.assertAlmostEqual(0.75, rows[2]['end'] - rows[2]['start'])
+        self.assertFalse('size_download_p50' in rows[0])  # Only times get percentiles
+
+    def test_intervals_by_requests(self):
+        out = KeepOpen()
+        recorder = IntervalRecorder(out, ['total_time'], output_format=u'csv', interval_requests=2)
+        recorder.start(now=0.0)
+        recorder.record([1.0], now=1.0)
+        recorder.record_failure(now=2.0)
+        recorder.record([3.0], now=5.0)
+        recorder.tick(now=50.0)  # No effect, not by time
+        recorder.close(now=6.0)
+
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(['interval', 'start', 'end', 'count', 'failures', 'throughput',
+                          'total_time_p50', 'total_time_p90', 'total_time_p99', 'total_time_max'], rows[0])
+        self.assertEqual(3, len(rows))
+        self.assertEqual(['0', '0.0', '2.0', '1', '1', '0.5', '1.0', '1.0', '1.0', '1.0'], rows[1])
+        self.assertEqual(['1', '2.0', '6.0', '1', '0'], rows[2][0:5])
+        self.assertRaises(ValueError, IntervalRecorder, out, ['total_time'], output_format=u'xml')
+
+    def test_intervals_derived_metrics(self):
+        """ Derived metrics are computed from the values they come from, if not passed themselves """
+        out = KeepOpen()
+        recorder = IntervalRecorder(out, ['starttransfer_time', 'pretransfer_time', 'size_download'],
+                                    interval_requests=1, reported_metrics=set(['server_time', 'size_download']))
+        self.assertEqual(['server_time_p50', 'server_time_p90', 'server_time_p99', 'server_time_max'],
+                         recorder.columns[6:])
+        recorder.start()
+        recorder.record([0.5, 0.25, 100])
+        self.assertAlmostEqual(0.25, self.rows(out)[0]['server_time_max'])
+
+    def test_collector_intervals(self):
+        """ Collectors pass values and failures on to their interval recorder """
+        out = KeepOpen()
+        collector = MetricCollector(['total_time'])
+        collector.intervals = IntervalRecorder(out, collector.metricnames, interval_requests=3)
+        collector.intervals.start()
+        collector.record_metrics({'total_time': 0.5})
+        collector.record_failure()
+        collector.record_metrics({'total_time': 1.5})
+        rows = self.rows(out)
+        self.assertEqual(1, len(rows))
+        self.assertEqual((2, 1), (rows[0]['count'], rows[0]['failures']))
+        self.assertEqual(2, collector.count)
+
+    def test_parse_interval_options(self):
+        benchmark = parse_benchmark('http://localhost', {'interval_output': 'soak.CSV', 'interval': '500ms'})
+        self.assertEqual(u'csv', benchmark.interval_format)
+        self.assertAlmostEqual(0.5, benchmark.interval)
+        benchmark = parse_benchmark('http://localhost', {'interval_output': 'soak.log', 'interval_requests': 100})
+        self.assertEqual(u'json', benchmark.interval_format)
+        self.assertEqual(100, benchmark.interval_requests)
+        benchmark = parse_benchmark('http://localhost', {'interval_output': 'soak.log', 'interval_format': 'CSV'})
+        self.assertEqual(u'csv', benchmark.interval_format)
+        self.assertRaises(ValueError, parse_benchmark, 'http://localhost', {'interval_format': 'xml'})
+        self.assertRaises(ValueError, parse_benchmark, 'http://localhost', {'interval': 0})
+        self.assertRaises(ValueError, parse_benchmark, 'http://localhost', {'interval_requests': 0})
+
+    def test_benchmark_interval_output(self):
+        """ Failed requests to an unreachable server are written to the interval file """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'intervals.jsonl')
+        benchmark = parse_benchmark('http://127.0.0.1:1', {
+            'url': '/', 'warmup_runs': 0, 'benchmark_runs': 4, 'metrics': ['total_time'],
+            'interval_output': path, 'interval_requests': 2})
+        result = resttest.collect_benchmark(benchmark)
+        self.assertEqual(4, result.failures)
+        with open(path, 'r') as interval_file:
+            rows = [json.loads(line) for line in interval_file]
+        self.assertEqual([2, 2], [row['failures'] for row in rows])
+
+    def test_benchmark_interval_output_interrupted(self):
+        """ If a benchmark is stopped by an exception, the last interval is written and the file closed """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'intervals.jsonl')
+        benchmark = parse_benchmark('http://127.0.0.1:1', {
+            'url': '/', 'warmup_runs': 0, 'benchmark_runs': 4, 'metrics': ['total_time'],
+            'interval_output': path, 'interval': 60})
+
+        def interrupted_runs(benchmark, collector):
+            yield 0
+            raise KeyboardInterrupt()
+        opened = list()
+        original_runs = resttest.closed_loop_runs
+        original_recorder = resttest.IntervalRecorder
+        resttest.closed_loop_runs = interrupted_runs
+        resttest.IntervalRecorder = lambda file_out, *args, **kwargs: (
+            opened.append(file_out) or original_recorder(file_out, *args, **kwargs))
+        try:
+            self.assertRaises(KeyboardInterrupt, resttest.collect_benchmark, benchmark)
+        finally:
+            resttest.closed_loop_runs = original_runs
+            resttest.IntervalRecorder = original_recorder
+        self.assertTrue(opened[0].closed)
+        with open(path, 'r') as interval_file:
+            rows = [json.loads(line) for line in interval_file]
+        self.assertEqual([1], [row['failures'] for row in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
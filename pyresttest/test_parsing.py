@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import unittest
+import string
 import sys
 
 from . import parsing
@@ -127,6 +128,36 @@ class TestParsing(unittest.TestCase):
 
         self.assertEqual({'newval': 'cherries'}, safe_to_json(Special()))
 
+    def test_compiled_template(self):
+        """ Compiled templates substitute exactly like string.Template """
+        variables = {'a': 1, 'b': u'漢', 'a_b': 'AB'}
+        for text in [u'$a and ${b} $$ $c $ $1 ${', u'plain', u'', u'$a$b', u'x${a}y$bz', u'$$a',
+                     u'${ a}', u'$a_b $a.b', u'指$a', u'$$']:
+            self.assertEqual(string.Template(text).safe_substitute(variables),
+                             CompiledTemplate(text).safe_substitute(variables))
+            self.assertEqual(string.Template(text).safe_substitute(variables, c=3),
+                             CompiledTemplate(text).safe_substitute(variables, c=3))
+        self.assertEqual(u'no $vars', CompiledTemplate(u'no $$vars').literal)
+
+    def test_template_cache(self):
+        """ Templates are compiled once, and the least recently used dropped when full """
+        cache = TemplateCache(max_size=2)
+        first = cache.get(u'$a')
+        self.assertTrue(first is cache.get(u'$a'))
+        cache.get(u'$b')
+        cache.get(u'$a')  # Now $b is the least recently used
+        cache.get(u'$c')
+        self.assertEqual(2, len(cache))
+        self.assertEqual(3, cache.misses)
+        self.assertTrue(first is cache.get(u'$a'))
+        self.assertEqual(3, cache.misses)
+        cache.get(u'$b')
+        self.assertEqual(4, cache.misses)
+
+        self.assertTrue(get_template(u'shared $x') is get_template(u'shared $x'))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
     def test_run_configure(self):
         """ Test the configure function use """
         converter = safe_to_bool
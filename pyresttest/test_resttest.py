@@ -1,11 +1,31 @@
 import json
 import math
+import random
 import string
+import threading
 import yaml
 import unittest
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 from . import resttest
 from .resttest import *
+from .six.moves import BaseHTTPServer
+
+
+class OkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers every GET with an empty 200 response """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
 
 
 class TestRestTest(unittest.TestCase):
@@ -38,6 +58,232 @@ class TestRestTest(unittest.TestCase):
         self.assertEqual(3, len(distinct_aggregates))
         self.assertEqual(3, len(analyzed.aggregates))
 
+    def test_analyze_benchmark_throughput(self):
+        """ Elapsed time and throughput carry over, and are written to CSV """
+        benchmark_result = BenchmarkResult()
+        benchmark_result.results = {'total_time': [0.5, 0.7]}
+        benchmark_result.count = 2
+        benchmark_result.elapsed = 2.0
+        benchmark_result.throughput = 1.0
+        benchmark_config = Benchmark()
+        benchmark_config.add_metric('total_time', 'mean')
+
+        analyzed = analyze_benchmark_results(benchmark_result, benchmark_config)
+        self.assertEqual(2.0, analyzed.elapsed)
+        self.assertEqual(1.0, analyzed.throughput)
+
+        out = StringIO()
+        write_benchmark_csv(out, analyzed, benchmark_config)
+        lines = out.getvalue().splitlines()
+        self.assertTrue('Count,2' in lines)
+        self.assertTrue('Elapsed,2.0' in lines)
+        self.assertTrue('Throughput,1.0' in lines)
+
+    def test_analyze_benchmark_stages(self):
+        """ Staged benchmarks get aggregates for each stage as well as overall """
+        benchmark_config = parse_benchmark('http://localhost', {'stages': [
+            {'duration': 1, 'rate': 5, 'name': 'warm'},
+            {'duration': 1, 'rate': 10}]})
+        benchmark_config.add_metric('total_time', 'mean').add_metric('size_download')
+        benchmark_result = BenchmarkResult()
+        benchmark_result.results = {'total_time': [1.0, 2.0, 4.0, 6.0],
+                                    'size_download': [1, 2, 3, 4]}
+        benchmark_result.sample_stages = [0, 1, 0, 1]
+
+        analyzed = analyze_benchmark_results(benchmark_result, benchmark_config)
+        self.assertEqual([('total_time', 'mean', 3.25)], analyzed.aggregates)
+        self.assertEqual([(u'warm', 'total_time', 'mean', 2.5),
+                          (u'stage 2', 'total_time', 'mean', 4.0)],
+                         analyzed.stage_aggregates)
+
+        out = StringIO()
+        write_benchmark_csv(out, analyzed, benchmark_config)
+        lines = out.getvalue().splitlines()
+        self.assertTrue('Stage Aggregates,' in lines)
+        self.assertTrue('warm,total_time,mean,2.5' in lines)
+
+    def test_analyze_benchmark_histograms(self):
+        """ With histogram storage, aggregates come from histograms, raw metrics are bucket counts """
+        benchmark_config = parse_benchmark('http://localhost', {
+            'metric_storage': 'histogram',
+            'stages': [{'duration': 1, 'rate': 5, 'name': 'warm'}, {'duration': 1, 'rate': 10}, {'duration': 1, 'rate': 1}]})
+        benchmark_config.add_metric('total_time', 'mean').add_metric('size_download')
+        collector = MetricCollector(benchmark_config.metrics, track_stages=True, storage=u'histogram')
+        for total_time, size, stage in [(1.0, 1, 0), (2.0, 2, 1), (4.0, 1, 0), (6.0, 4, 1)]:
+            collector.record_metrics({'total_time': total_time, 'size_download': size}, stage=stage)
+        benchmark_result = BenchmarkResult()
+        benchmark_result.results = collector.get_results()
+        benchmark_result.stage_results = collector.get_stage_results()
+
+        analyzed = analyze_benchmark_results(benchmark_result, benchmark_config)
+        self.assertEqual([('total_time', 'mean', 3.25)], analyzed.aggregates)
+        self.assertEqual([(u'warm', 'total_time', 'mean', 2.5),
+                          (u'stage 2', 'total_time', 'mean', 4.0),
+                          (u'stage 3', 'total_time', 'mean', None)],
+                         analyzed.stage_aggregates)
+        buckets = analyzed.results['size_download']
+        self.assertEqual([1, 1], [count for value, count in buckets[1:]])
+        self.assertEqual(2, buckets[0][1])
+        self.assertTrue(abs(buckets[0][0] - 1) < 0.001)
+
+        out = StringIO()
+        write_benchmark_csv(out, analyzed, benchmark_config)
+        self.assertTrue('warm,total_time,mean,2.5' in out.getvalue().splitlines())
+
+    def test_analyze_benchmark_histograms_without_numpy(self):
+        """ Several order aggregates of a histogram work without numpy, which would presort a list """
+        benchmark_config = parse_benchmark('http://localhost', {'metric_storage': 'histogram'})
+        benchmark_config.add_metric('total_time', 'median').add_metric('total_time', 'p95')
+        collector = MetricCollector(benchmark_config.metrics, storage=u'histogram')
+        for total_time in (1.0, 2.0, 3.0):
+            collector.record_metrics({'total_time': total_time})
+        benchmark_result = BenchmarkResult()
+        benchmark_result.results = collector.get_results()
+
+        original = benchmarks.numpy
+        benchmarks.numpy = None
+        try:
+            analyzed = analyze_benchmark_results(benchmark_result, benchmark_config)
+        finally:
+            benchmarks.numpy = original
+        aggregates = dict([(aggregate, value) for metricname, aggregate, value in analyzed.aggregates])
+        self.assertTrue(abs(aggregates['median'] - 2.0) < 0.01)
+        self.assertTrue(abs(aggregates['p95'] - 2.9) < 0.05)  # Interpolated, as for lists
+
+    def test_analyze_benchmark_derived_metrics(self):
+        """ Derived phase times are computed from the raw curl timings, per stage too """
+        benchmark_config = parse_benchmark('http://localhost', {'stages': [
+            {'duration': 1, 'rate': 5}, {'duration': 1, 'rate': 10}]})
+        benchmark_config.add_metric('server_time', 'mean').add_metric('transfer_time')
+        benchmark_result = BenchmarkResult()
+        benchmark_result.results = {'pretransfer_time': [0.1, 0.1, 0.1],
+                                    'starttransfer_time': [0.2, 0.5, 0.4],
+                                    'total_time': [0.25, 0.5, 0.5]}
+        benchmark_result.sample_stages = [0, 1, 1]
+
+        analyzed = analyze_benchmark_results(benchmark_result, benchmark_config)
+        self.assertEqual(1, len(analyzed.aggregates))
+        self.assertAlmostEqual(0.8 / 3, analyzed.aggregates[0][2])
+        self.assertEqual(['transfer_time'], list(analyzed.results.keys()))
+        self.assertEqual(3, len(analyzed.results['transfer_time']))
+        self.assertAlmostEqual(0.35, analyzed.stage_aggregates[1][3])
+
+    def test_drop_warmup(self):
+        """ Results from the detected warmup are left out of aggregates, and the cutoff reported """
+        benchmark_config = parse_benchmark('http://localhost', {'warmup': 'auto', 'stages': [
+            {'duration': 1, 'rate': 5}, {'duration': 1, 'rate': 10}]})
+        benchmark_config.add_metric('size_download', 'max')
+        benchmark_result = BenchmarkResult()
+        benchmark_result.count = 200
+        benchmark_result.results = {'total_time': [5.0 - x * 0.1 for x in range(0, 40)] + [1.0] * 160,
+                                    'size_download': [1000] * 40 + [10] * 160}
+        benchmark_result.sample_stages = [0] * 100 + [1] * 100
+        drop_warmup(benchmark_result)
+        self.assertEqual(40, benchmark_result.warmup_cutoff)
+        self.assertEqual(160, len(benchmark_result.results['size_download']))
+        self.assertEqual(160, len(benchmark_result.sample_stages))
+
+        analyzed = analyze_benchmark_results(benchmark_result, benchmark_config)
+        self.assertEqual([('size_download', 'max', 10)], analyzed.aggregates)
+        self.assertEqual(200, analyzed.count)
+        out = StringIO()
+        write_benchmark_csv(out, analyzed, benchmark_config)
+        self.assertTrue('Warmup Cutoff,40' in out.getvalue().splitlines())
+
+    def test_analyze_benchmark_failures(self):
+        """ Failed responses get their own aggregates, status codes and errors are reported """
+        benchmark_config = Benchmark()
+        benchmark_config.add_metric('total_time', 'mean')
+        benchmark_result = BenchmarkResult()
+        benchmark_result.failures = 3
+        benchmark_result.results = {'total_time': [0.1, 0.3]}
+        benchmark_result.status_counts = {200: 2, 503: 2}
+        benchmark_result.error_counts = {7: 1}
+        benchmark_result.failure_results = {'total_time': [2.0, 4.0]}
+
+        analyzed = analyze_benchmark_results(benchmark_result, benchmark_config)
+        self.assertAlmostEqual(0.2, analyzed.aggregates[0][2])
+        self.assertEqual([('total_time', 'mean', 3.0)], analyzed.failure_aggregates)
+        self.assertEqual({200: 2, 503: 2}, analyzed.status_counts)
+        out = StringIO()
+        write_benchmark_csv(out, analyzed, benchmark_config)
+        lines = out.getvalue().splitlines()
+        self.assertTrue('503,2' in lines)
+        self.assertTrue('7,1' in lines)
+        self.assertTrue('total_time,mean,3.0' in lines)
+
+    def test_check_benchmark_response(self):
+        """ Unexpected status codes fail, and sampled responses must pass validators """
+        benchmark = parse_benchmark('http://localhost', {'validate_sample_rate': 2, 'validators': [
+            {'compare': {'jsonpath_mini': 'id', 'expected': 1}}]})
+        collector = MetricCollector(['total_time'], track_failures=True)
+        self.assertTrue(is_validation_sample(benchmark, 4))
+        self.assertFalse(is_validation_sample(benchmark, 3))
+        self.assertFalse(is_validation_sample(parse_benchmark('http://localhost', {'validate_sample_rate': 1}), 0))
+
+        headers = b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n'
+        context = Context()
+        self.assertTrue(check_benchmark_response(benchmark, context, collector, 200))
+        self.assertFalse(check_benchmark_response(benchmark, context, collector, 500))
+        self.assertTrue(check_benchmark_response(benchmark, context, collector, 200, headers, b'{"id": 1}'))
+        self.assertFalse(check_benchmark_response(benchmark, context, collector, 200, headers, b'{"id": 2}'))
+        self.assertFalse(check_benchmark_response(benchmark, context, collector, 200, headers, b'not json'))
+        self.assertEqual({200: 4, 500: 1}, collector.status_counts)
+        self.assertEqual(3, collector.validated)
+        self.assertEqual(2, collector.validation_failures)
+
+    def test_check_thresholds(self):
+        """ Thresholds are checked against aggregates and run values, and breaches counted """
+        benchmark_config = parse_benchmark('http://localhost', {'thresholds': {
+            'total_time': {'mean': '<0.25', 'max': '<0.25'}, 'error_rate': '<=0.2', 'throughput': '>100'}})
+        benchmark_result = BenchmarkResult()
+        benchmark_result.count = 4
+        benchmark_result.failures = 1
+        benchmark_result.throughput = 50.0
+        benchmark_result.results = {'total_time': [0.1, 0.2, 0.2, 0.3]}
+        analyzed = analyze_benchmark_results(benchmark_result, benchmark_config)
+
+        self.assertEqual(2, check_thresholds(analyzed, benchmark_config))
+        checks = dict([((metric, aggregate), (value, passed))
+                       for metric, aggregate, threshold, value, passed in analyzed.threshold_checks])
+        self.assertEqual((0.3, False), checks[('total_time', 'max')])
+        self.assertTrue(checks[('total_time', 'mean')][1])
+        self.assertEqual((0.2, True), checks[('error_rate', None)])
+        self.assertEqual((50.0, False), checks[('throughput', None)])
+        out = StringIO()
+        write_benchmark_csv(out, analyzed, benchmark_config)
+        self.assertTrue('throughput,,>100.0,50.0,False' in out.getvalue().splitlines())
+
+    def test_run_testsets_threshold_fails(self):
+        """ Breached thresholds add to the failure count used as the exit code """
+        benchmark = parse_benchmark('http://localhost:9', {  # Nothing listening, so every request fails
+            'url': '/', 'warmup_runs': 0, 'benchmark_runs': 3,
+            'metrics': [{'total_time': 'mean'}], 'thresholds': {'error_rate': '<0.5'}})
+        testset = TestSet()
+        testset.config.skip_term_colors = True
+        testset.benchmarks = [benchmark]
+        self.assertEqual(1, run_testsets([testset]))
+
+        benchmark.thresholds[0].limit = 1.0
+        benchmark.thresholds[0].comparison = '<='
+        self.assertEqual(0, run_testsets([testset]))
+
+    def test_realize_timed(self):
+        """ Templating a test reports the time taken in each client phase """
+        context = Context()
+        context.bind_variable('id', 7)
+        test = Test()
+        test.set_url('http://localhost/api/$id', isTemplate=True)
+        templated, client_times = realize_timed(test, context)
+        self.assertEqual('http://localhost/api/7', templated.url)
+        self.assertEqual(3, len(client_times))
+        self.assertTrue(client_times[1] >= 0)
+        self.assertEqual(0.0, client_times[2])
+
+        times = client_times_map([0.25, 0.5, 0.125])
+        self.assertEqual(0.5, times['template_time'])
+        self.assertEqual(0.875, times['client_prepare_time'])
+
     def test_metrics_to_tuples(self):
         """ Test method to build list(tuples) from raw metrics """
         array1 = [-1, 5.6, 0]
@@ -94,6 +340,115 @@ class TestRestTest(unittest.TestCase):
         self.assertEqual(('accept', 'text/html'), headers[1])
         self.assertEqual(('accept', 'application/json'), headers[2])
 
+    def test_parse_configuration_parallel(self):
+        """ Parallel execution options are read from the config """
+        config = parse_configuration(
+            [{'test_parallel': 'true'}, {'max_concurrent': 4}])
+        self.assertTrue(config.test_parallel)
+        self.assertEqual(4, config.max_concurrent)
+
+        config = parse_configuration({'timeout': 5})
+        self.assertFalse(config.test_parallel)
+        self.assertEqual(DEFAULT_MAX_CONCURRENT, config.max_concurrent)
+        self.assertFalse(config.connection_reuse)
+
+        config = parse_configuration({'connection_reuse': True})
+        self.assertTrue(config.connection_reuse)
+
+        try:
+            parse_configuration({'max_concurrent': 0})
+            self.fail("Should have rejected a max_concurrent below 1")
+        except ValueError:
+            pass
+
+        self.assertEqual(u'pycurl', config.transport)
+        config = parse_configuration({'transport': 'Pycurl'})
+        self.assertEqual(u'pycurl', config.transport)
+        self.assertRaises(ValueError, parse_configuration, {'transport': 'carrier_pigeon'})
+
+    def test_run_testsets_workers(self):
+        """ Results from test sets run in worker processes merge into one summary """
+        testsets = list()
+        for x in range(0, 3):
+            testset = TestSet()
+            testset.config.skip_term_colors = True
+            test = Test()
+            test.url = 'http://127.0.0.1:1/unreachable'  # Fails fast, no server needed
+            test.group = 'Unreachable'
+            testset.tests = [test, test]
+            testsets.append(testset)
+
+        self.assertEqual(6, run_testsets(testsets, workers=2))
+        self.assertEqual(6, run_testsets(testsets, workers=1))
+
+    def test_run_testset_ssl_insecure_not_kept(self):
+        """ A curl handle shared by test sets doesn't keep insecure SSL settings into a later, secure test set """
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), OkHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        curl_handle = pycurl.Curl()
+        applied = list()
+        for ssl_insecure in (True, False):
+            testset = TestSet()
+            testset.config.skip_term_colors = True
+            testset.config.ssl_insecure = ssl_insecure
+            test = Test()
+            test.url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+            testset.tests = [test]
+            group_failure_counts = dict()
+            run_testset(testset, dict(), group_failure_counts, curl_handle=curl_handle)
+            self.assertEqual({u'Default': 0}, group_failure_counts)
+            options = tests.APPLIED_CURL_OPTIONS[curl_handle]
+            applied.append((options[pycurl.SSL_VERIFYPEER], options[pycurl.SSL_VERIFYHOST]))
+        self.assertEqual([(0, 0), (1, 2)], applied)
+        curl_handle.close()
+
+    def test_collect_benchmark_ssl_insecure(self):
+        """ Warmup and closed-loop benchmark requests use the test config's SSL settings """
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), OkHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        benchmark = Benchmark()
+        benchmark.url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+        benchmark.warmup_runs = 1
+        benchmark.benchmark_runs = 2
+        benchmark.add_metric('total_time')
+        config = TestConfig()
+        config.ssl_insecure = True
+        curl_pool = CurlPool()
+        self.addCleanup(curl_pool.close)
+
+        output = collect_benchmark(benchmark, test_config=config, curl_pool=curl_pool)
+        self.assertEqual(0, output.failures)
+        self.assertEqual(2, len(output.results['total_time']))
+        curl = curl_pool.acquire(benchmark.url)
+        options = tests.APPLIED_CURL_OPTIONS[curl]
+        self.assertEqual((0, 0, 0), (options[pycurl.SSL_VERIFYPEER], options[pycurl.SSL_VERIFYHOST],
+                                     options[pycurl.VERBOSE]))
+        curl_pool.release(benchmark.url, curl)
+
+    def test_run_testset_worker_seeds(self):
+        """ Each worker shard seeds random generators with its own seed """
+        testset = TestSet()
+        resttest.WORKER_TESTSETS[:] = [testset]
+        try:
+            self.assertEqual((dict(), 0), run_testset_worker((0, 42)))
+            first = random.random()
+            run_testset_worker((0, 42))
+            self.assertEqual(first, random.random())
+            run_testset_worker((0, 43))
+            self.assertNotEqual(first, random.random())
+        finally:
+            resttest.WORKER_TESTSETS[:] = list()
+
     def test_jmespath_import(self):
         """ Verify that JMESPath extractor loads if class present """
 
@@ -118,6 +473,10 @@ class TestRestTest(unittest.TestCase):
         self.assertEqual('my_url', args['url'])
         self.assertEqual('my_test_filename', args['test'])
         self.assertEqual('True', args['print_bodies'])
+        self.assertEqual(None, args['workers'])
+
+        args = parse_command_line_args(cmdline + ['--workers', '4'])
+        self.assertEqual(4, args['workers'])
 
     def test_cmdline_args_parsing_positional(self):
         """ Tests cases where test and url are from named arguments, not positional """
@@ -0,0 +1,116 @@
+import unittest
+
+from . import scheduling
+from .scheduling import *
+from . import tests
+from .tests import Test
+from .contenthandling import ContentHandler
+
+
+class SchedulingTest(unittest.TestCase):
+    """ Tests for data-flow analysis and test dependency graphs """
+
+    def test_template_variables(self):
+        self.assertEqual(set(), template_variables('/api/person/'))
+        self.assertEqual(set(['id']), template_variables('/api/person/$id/'))
+        self.assertEqual(set(['id', 'name']), template_variables(
+            '/api/${name}/$id/$id'))
+        self.assertEqual(set(), template_variables('costs $$5'))
+        self.assertEqual(set(), template_variables(None))
+
+    def test_reads_writes_parsed(self):
+        """ Reads and writes found for a parsed test using templates everywhere """
+        node = {
+            'url': {'template': '/api/person/$id/'},
+            'headers': {'template': {'X-Login': '$login'}},
+            'body': {'template': '{"name": "$name"}'},
+            'method': 'PUT',
+            'validators': [{'compare': {'jsonpath_mini': {'template': '$field'},
+                                        'expected': {'template': '$expected'}}}],
+            'extract_binds': [{'newid': {'jsonpath_mini': 'id'}}],
+            'generator_binds': {'name': 'names'},
+            'variable_binds': {'login': 'bob'}
+        }
+        test = Test.parse_test('http://localhost', node)
+        self.assertEqual(set(['id', 'login', 'name', 'field', 'expected']),
+                         get_reads(test))
+        self.assertEqual(set(['newid', 'name', 'login', ('generator', 'names')]),
+                         get_writes(test))
+
+    def test_reads_templated_file_path(self):
+        """ Templated content from a templated file path can't be known ahead of time """
+        test = Test()
+        handler = ContentHandler()
+        handler.setup('$dir/body.json', is_file=True,
+                      is_template_path=True, is_template_content=True)
+        test.body = handler
+        self.assertTrue(get_reads(test) is READS_ANYTHING)
+
+    def test_dependency_graph_independent(self):
+        """ Static tests don't depend on each other """
+        mytests = [Test() for x in range(0, 4)]
+        self.assertEqual([set(), set(), set(), set()],
+                         build_dependency_graph(mytests))
+
+    def test_dependency_graph_data_flow(self):
+        """ Create-then-get style chains keep their order, other tests don't wait """
+        create = Test.parse_test('http://localhost', {
+            'url': '/api/person/', 'method': 'POST',
+            'extract_binds': [{'id': {'jsonpath_mini': 'id'}}]})
+        fetch = Test.parse_test('http://localhost', {
+            'url': {'template': '/api/person/$id/'}})
+        other = Test.parse_test('http://localhost', {'url': '/api/other/'})
+        delete = Test.parse_test('http://localhost', {
+            'url': {'template': '/api/person/$id/'}, 'method': 'DELETE'})
+        recreate = Test.parse_test('http://localhost', {
+            'url': '/api/person/', 'method': 'POST',
+            'extract_binds': [{'id': {'jsonpath_mini': 'id'}}]})
+
+        graph = build_dependency_graph([create, fetch, other, delete, recreate])
+        self.assertEqual(set(), graph[0])
+        self.assertEqual(set([0]), graph[1])
+        self.assertEqual(set(), graph[2])
+        self.assertEqual(set([0]), graph[3])
+        # Rebinding id has to wait for everything reading the old value
+        self.assertEqual(set([0, 1, 3]), graph[4])
+
+    def test_dependency_graph_generators(self):
+        """ Tests drawing from the same generator stay in order """
+        first = Test()
+        first.generator_binds = {'id': 'gen'}
+        second = Test()
+        second.generator_binds = {'other_id': 'gen'}
+        third = Test()
+        third.generator_binds = {'third_id': 'another_gen'}
+        graph = build_dependency_graph([first, second, third])
+        self.assertEqual([set(), set([0]), set()], graph)
+
+    def test_dependency_graph_barriers(self):
+        """ stop_on_failure and delay tests order everything after them """
+        mytests = [Test() for x in range(0, 5)]
+        mytests[1].stop_on_failure = True
+        mytests[3].delay = 1
+        graph = build_dependency_graph(mytests)
+        self.assertEqual(set(), graph[0])
+        self.assertEqual(set(), graph[1])
+        self.assertEqual(set([1]), graph[2])
+        self.assertEqual(set([0, 1, 2]), graph[3])
+        self.assertEqual(set([3]), graph[4])
+
+    def test_dependency_graph_unknown_reads(self):
+        """ A test that may read anything waits on all writers, and writers wait on it """
+        writer = Test()
+        writer.variable_binds = {'a': 1}
+        unknown = Test()
+        handler = ContentHandler()
+        handler.setup('$dir/body.json', is_file=True,
+                      is_template_path=True, is_template_content=True)
+        unknown.body = handler
+        later_writer = Test()
+        later_writer.variable_binds = {'b': 2}
+        graph = build_dependency_graph([writer, unknown, later_writer])
+        self.assertEqual([set(), set([0]), set([1])], graph)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -202,6 +202,87 @@ class TestsTest(unittest.TestCase):
         mock_handle.setopt.assert_any_call(mock_handle.MAXREDIRS, 5)
         mock_handle.close()
 
+    def test_prepare_curl(self):
+        """ Prepared request values are reused until the test changes """
+        test = Test()
+        test.url = 'http://localhost/api'
+        test.method = u'POST'
+        test.body = u'{"name": "\u00e9"}'
+        test.headers = {u'content-type': u'application/json'}
+        test.auth_username = u'bobbyg'
+        test.auth_password = 'password'
+        test.curl_options = {'MAXREDIRS': 5}
+
+        prepared = test.prepare_curl()
+        self.assertEqual('http://localhost/api', prepared.url)
+        self.assertEqual(u'{"name": "\u00e9"}'.encode('UTF-8'), prepared.body)
+        self.assertEqual(b'bobbyg:password', prepared.userpwd)
+        self.assertEqual(('content-type:application/json ; charset=UTF-8', 'Expect:'), prepared.headers)
+        self.assertEqual(prepared.headers + ('Connection: close',), prepared.closing_headers)
+        self.assertEqual(((pycurl.MAXREDIRS, 5),), prepared.curl_options)
+        self.assertTrue(prepared is test.prepare_curl())
+
+        test.url = 'http://localhost/other'
+        changed = test.prepare_curl()
+        self.assertEqual('http://localhost/other', changed.url)
+        self.assertTrue(changed.body is prepared.body)  # Not encoded again
+
+        # Templated tests are prepared each time, their realized copies are kept
+        test.set_url('http://localhost/$id', isTemplate=True)
+        context = Context()
+        context.bind_variable('id', 1)
+        self.assertFalse(test.prepare_curl(context) is test.prepare_curl(context))
+        realized = test.realize(context)
+        self.assertTrue(realized.prepare_curl() is realized.prepare_curl())
+        self.assertEqual('http://localhost/1', realized.prepare_curl().url)
+
+    def test_configure_curl_incremental(self):
+        """ A reused curl handle only has changed options set, and is reset if an option must be unset """
+        class RecordingCurl(object):
+            def __init__(self):
+                self.curl = pycurl.Curl()
+                self.calls = list()
+
+            def getinfo(self, info):
+                return self.curl.getinfo(info)
+
+            def setopt(self, option, value):
+                self.calls.append(option)
+                self.curl.setopt(option, value)
+
+            def unsetopt(self, option):
+                self.curl.unsetopt(option)
+
+            def reset(self):
+                self.calls.append('reset')
+                self.curl.reset()
+
+        handle = RecordingCurl()
+        test = Test()
+        test.url = 'http://localhost/api'
+        self.assertTrue(handle is test.configure_curl(curl_handle=handle))
+        self.assertEqual(['reset', pycurl.COOKIELIST], handle.calls[0:2])  # No record of its options yet
+
+        handle.calls = list()
+        test.configure_curl(curl_handle=handle)
+        self.assertEqual([pycurl.COOKIELIST], handle.calls)
+
+        test.url = 'http://localhost/other'
+        test.method = u'POST'
+        test.body = 'data'
+        handle.calls = list()
+        test.configure_curl(curl_handle=handle)
+        self.assertEqual([pycurl.COOKIELIST, pycurl.URL, pycurl.READFUNCTION, pycurl.POST, pycurl.POSTFIELDSIZE],
+                         handle.calls)
+
+        test.method = u'GET'
+        test.body = None
+        handle.calls = list()
+        test.configure_curl(curl_handle=handle)
+        self.assertEqual(['reset', pycurl.COOKIELIST], handle.calls[0:2])
+        self.assertTrue(pycurl.URL in handle.calls)
+        handle.curl.close()
+
     def test_basic_auth(self):
         """ Test that basic auth configures correctly """
         if PYTHON_MAJOR_VERSION > 2:
@@ -409,6 +490,71 @@ class TestsTest(unittest.TestCase):
         realized = test.realize(context)
         self.assertEqual('stilton', realized.url)
 
+    def test_realize_cached(self):
+        """ Templating is reused until the context's variables or the test change """
+        test = Test()
+        test.set_url('/api/$id', isTemplate=True)
+        context = Context()
+        context.bind_variable('id', 1)
+
+        realized = test.realize(context)
+        self.assertTrue(realized is test.realize(context))
+        context.bind_variable('id', 1)  # Same value, nothing changes
+        self.assertTrue(realized is test.realize(context))
+
+        context.bind_variable('id', 2)
+        changed = test.realize(context)
+        self.assertFalse(realized is changed)
+        self.assertEqual('/api/2', changed.url)
+
+        test.set_url('/other/$id', isTemplate=True)
+        self.assertEqual('/other/2', test.realize(context).url)
+
+        # Copies of a context don't share templated tests, their variables can diverge
+        user_context = context.copy()
+        user_context.bind_variable('id', 3)
+        self.assertEqual('/other/3', test.realize(user_context).url)
+        self.assertEqual('/other/2', test.realize(context).url)
+
+    def test_realize_changed_fields(self):
+        """ Only fields using variables that changed are templated again, others are reused """
+        test = Test()
+        test.set_url('/api/$id', isTemplate=True)
+        test.set_headers({'Token': '$token'}, isTemplate=True)
+        handler = ContentHandler()
+        handler.setup(u'{"name": "$name"}', is_template_content=True)
+        test.body = handler
+        self.assertEqual({Test.NAME_URL: ('id',), Test.NAME_HEADERS: ('token',), Test.NAME_BODY: ('name',)},
+                         test.template_variables())
+
+        context = Context()
+        context.bind_variable('id', 1)
+        context.bind_variable('token', 'abc')
+        context.bind_variable('name', u'\u00e9')
+        realized = test.realize(context)
+        body, is_unicoded = realized.encode_body()
+        self.assertTrue(is_unicoded)
+        self.assertEqual(u'{"name": "\u00e9"}'.encode('UTF-8'), body)
+
+        context.bind_variable('id', 2)
+        changed = test.realize(context)
+        self.assertEqual('/api/2', changed.url)
+        self.assertTrue(changed._headers is realized._headers)
+        self.assertTrue(changed._body is realized._body)
+        self.assertTrue(changed.encode_body()[0] is body)  # Not encoded again
+
+        context.bind_variable('name', 'Bob')
+        changed = test.realize(context)
+        self.assertEqual(u'{"name": "Bob"}', changed.body)
+        self.assertEqual(b'{"name": "Bob"}', changed.encode_body()[0])
+        self.assertEqual({'Token': 'abc'}, changed.headers)
+
+        # Variables in templated file content aren't known, so it is always templated again
+        handler = ContentHandler()
+        handler.setup('dummy.json', is_file=True, is_template_content=True)
+        test.body = handler
+        self.assertEqual(None, test.template_variables()[Test.NAME_BODY])
+
     def test_test_content_templating(self):
         test = Test()
         handler = ContentHandler()
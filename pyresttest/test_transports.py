@@ -0,0 +1,111 @@
+import base64
+import unittest
+
+from . import transports
+from .transports import *
+from .tests import Test
+
+try:
+    from . import asynciotransport
+    from .asynciotransport import prepare_request
+except (ImportError, SyntaxError):
+    asynciotransport = None
+
+
+class TransportsTest(unittest.TestCase):
+    """ Tests for transports that don't need a server """
+
+    def test_transport_registry(self):
+        self.assertTrue(TRANSPORTS[u'pycurl'] is PycurlTransport)
+        if asynciotransport is not None:
+            self.assertTrue(TRANSPORTS[u'asyncio'] is asynciotransport.AsyncioTransport)
+
+    def test_pycurl_transport_connection_failure(self):
+        """ Failed requests come back from wait with an error, not an exception """
+        transport = PycurlTransport(timeout=5)
+        test = Test()
+        test.url = 'http://127.0.0.1:1/'
+        transport.start(test, key='refused')
+        self.assertEqual(1, transport.in_flight())
+        results = list()
+        while transport.in_flight():
+            results.extend(transport.wait())
+        self.assertEqual(1, len(results))
+        self.assertEqual('refused', results[0][0])
+        self.assertTrue(results[0][1].error is not None)
+        transport.close()
+
+    def test_asyncio_transport_connection_failure(self):
+        if asynciotransport is None:
+            raise unittest.SkipTest("asyncio transport not available")
+        transport = asynciotransport.AsyncioTransport(timeout=5)
+        test = Test()
+        test.url = 'http://127.0.0.1:1/'
+        response = transport.perform(test)
+        self.assertTrue(response.error is not None)
+        self.assertEqual(0, transport.in_flight())
+
+        # Options the transport can't send fail the request
+        test.curl_options = {'FOLLOWLOCATION': 1}
+        response = transport.perform(test)
+        self.assertTrue(isinstance(response.error, ValueError))
+        transport.close()
+
+    def test_prepare_request_get(self):
+        if asynciotransport is None:
+            raise unittest.SkipTest("asyncio transport not available")
+        test = Test.parse_test('http://localhost:8000', {
+            'url': '/api/person/?page=2', 'headers': {'Accept-Language': 'en'}})
+        request = prepare_request(test)
+        self.assertEqual(('http', 'localhost', 8000, u'GET'),
+                         (request.scheme, request.host, request.port, request.method))
+        self.assertTrue(request.body is None)
+        lines = request.head.decode('ISO-8859-1').split('\r\n')
+        self.assertEqual('GET /api/person/?page=2 HTTP/1.1', lines[0])
+        self.assertTrue('Host: localhost:8000' in lines)
+        self.assertTrue('Accept-Language: en' in lines)
+        self.assertTrue('Connection: close' in lines)
+        self.assertTrue(request.head.endswith(b'\r\n\r\n'))
+
+        request = prepare_request(test, connection_reuse=True)
+        self.assertFalse(b'Connection: close' in request.head)
+
+    def test_prepare_request_accept(self):
+        """ A test's own Accept header replaces the default one, as with curl """
+        if asynciotransport is None:
+            raise unittest.SkipTest("asyncio transport not available")
+        test = Test.parse_test('http://localhost:8000', {'url': '/api/person/'})
+        lines = prepare_request(test).head.decode('ISO-8859-1').split('\r\n')
+        self.assertTrue('Accept: */*' in lines)
+
+        test = Test.parse_test('http://localhost:8000', {
+            'url': '/api/person/', 'headers': {'Accept': 'application/xml'}})
+        lines = prepare_request(test).head.decode('ISO-8859-1').split('\r\n')
+        self.assertEqual(['Accept: application/xml'], [line for line in lines if line.lower().startswith('accept:')])
+
+    def test_prepare_request_body_auth(self):
+        if asynciotransport is None:
+            raise unittest.SkipTest("asyncio transport not available")
+        test = Test.parse_test('https://example.com', {
+            'url': '/api/person/', 'method': 'POST', 'body': u'{"name": "é"}',
+            'headers': {'content-type': 'application/json'},
+            'auth_username': 'user', 'auth_password': 'pass'})
+        request = prepare_request(test)
+        self.assertEqual(('https', 443), (request.scheme, request.port))
+        self.assertEqual(u'{"name": "é"}'.encode('UTF-8'), request.body)
+        lines = request.head.decode('ISO-8859-1').split('\r\n')
+        self.assertTrue('POST /api/person/ HTTP/1.1' == lines[0])
+        self.assertTrue('Content-Length: ' + str(len(request.body)) in lines)
+        self.assertTrue('content-type: application/json ; charset=UTF-8' in lines)
+        self.assertTrue('Authorization: Basic ' + base64.b64encode(b'user:pass').decode('ascii') in lines)
+
+        # POST without a body still sends a length
+        test = Test.parse_test('http://example.com', {'url': '/api/', 'method': 'POST'})
+        self.assertTrue(b'Content-Length: 0' in prepare_request(test).head)
+
+        test = Test.parse_test('ftp://example.com', {'url': '/file'})
+        self.assertRaises(ValueError, prepare_request, test)
+
+
+if __name__ == '__main__':
+    unittest.main()
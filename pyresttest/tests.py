@@ -4,6 +4,7 @@ import copy
 import json
 import pycurl
 import sys
+import weakref
 
 
 from . import contenthandling
@@ -48,6 +49,9 @@ BASECURL = pycurl.Curl()  # Used for some validation/parsing
 
 DEFAULT_TIMEOUT = 10  # Seconds
 
+# Options last set on each curl handle by configure_curl, maps handle to dict of curl option to value
+APPLIED_CURL_OPTIONS = weakref.WeakKeyDictionary()
+
 # Map HTTP method names to curl methods
 # Kind of obnoxious that it works this way...
 HTTP_METHODS = {u'GET': pycurl.HTTPGET,
@@ -90,6 +94,55 @@ def coerce_list_of_ints(val):
     else:
         return [int(val)]
 
+def apply_curl_options(curl, options, is_reused=False):
+    """ Set a list of (curl option, value) on a curl handle, and record them in APPLIED_CURL_OPTIONS
+        For a reused handle, only options that changed since the last call are set, and it is reset
+        (clearing its options) if the last call set an option that isn't in the list
+        Cookies are cleared, and the response callbacks set after the last call are removed, as reset() would """
+    applied = APPLIED_CURL_OPTIONS.get(curl) if is_reused else None
+    if is_reused:
+        wanted = dict(options)
+        if applied is None or any([option not in wanted for option in applied]):
+            # Below clears the cookies & curl options for clean run
+            # But retains the DNS cache and connection pool
+            curl.reset()
+            applied = None
+        else:
+            curl.unsetopt(pycurl.WRITEFUNCTION)
+            curl.unsetopt(pycurl.HEADERFUNCTION)
+        curl.setopt(pycurl.COOKIELIST, "ALL")
+
+    if applied is None:
+        applied = dict()
+        APPLIED_CURL_OPTIONS[curl] = applied
+    for option, value in options:
+        if option in applied:
+            previous = applied[option]
+            if previous is value or previous == value:
+                continue
+        if option == pycurl.SHARE:
+            try:
+                curl.setopt(pycurl.SHARE, value)
+            except pycurl.error:  # Reused handles stay attached to their share after reset()
+                curl.unsetopt(pycurl.SHARE)
+                curl.setopt(pycurl.SHARE, value)
+        else:
+            curl.setopt(option, value)
+        applied[option] = value
+
+
+class PreparedCurl(object):
+    """ Request values configure_curl sets, in the form curl takes them, built once by Test.prepare_curl
+        Shared by every run of the test, so it must not be modified """
+    key = None  # Test fields it was prepared from
+    url = None
+    body = None  # Body to send (bytes if it was unicode), or None
+    userpwd = None  # 'username:password' bytes for authentication, or None
+    headers = None  # Tuple of header lines
+    closing_headers = None  # Header lines when connections aren't kept open, with 'Connection: close'
+    curl_options = None  # Tuple of (curl option, value) for custom curl options
+
+
 class Test(object):
     """ Describes a REST test """
     _url = None
@@ -109,6 +162,8 @@ class Test(object):
     curl_options = None
 
     templates = None  # Dictionary of template to compiled template
+    _encoded_body = None  # Tuple of (body, its UTF-8 bytes), see encode_body
+    _prepared_curl = None  # PreparedCurl, see prepare_curl
 
     # Bind variables, generators, and contexts
     variable_binds = None
@@ -133,7 +188,7 @@ class Test(object):
         """ Add a templating instance for variable given """
         if self.templates is None:
             self.templates = dict()
-        self.templates[variable_name] = string.Template(template_string)
+        self.templates[variable_name] = get_template(template_string)
 
     def del_template(self, variable_name):
         """ Remove template instance, so we no longer use one for this test """
@@ -149,6 +204,8 @@ class Test(object):
         return self.templates[variable_name].safe_substitute(context.get_values())
 
     # These are variables that can be templated
+    NAME_BODY = 'body'
+
     def set_body(self, value):
         """ Set body, directly """
         self._body = value
@@ -203,7 +260,7 @@ class Test(object):
         vals = context.get_values()
 
         def template_tuple(tuple_input):
-            return (string.Template(str(tuple_item)).safe_substitute(vals) for tuple_item in tuple_input)
+            return (get_template(str(tuple_item)).safe_substitute(vals) for tuple_item in tuple_input)
         return dict(map(template_tuple, self._headers.items()))
 
     headers = property(get_headers, set_headers, None,
@@ -238,20 +295,74 @@ class Test(object):
             return True
         return False
 
+    def template_variables(self):
+        """ Names of the variables each templated field (NAME_URL, NAME_HEADERS, NAME_BODY) uses,
+            as a sorted tuple, or None if not known (templated file content) """
+        output = dict()
+        if self.templates and self.NAME_URL in self.templates:
+            output[self.NAME_URL] = tuple(sorted(self.templates[self.NAME_URL].variables))
+        if self.templates and self.NAME_HEADERS in self.templates:
+            names = set()
+            for key, value in self._headers.items():
+                names.update(get_template(str(key)).variables)
+                names.update(get_template(str(value)).variables)
+            output[self.NAME_HEADERS] = tuple(sorted(names))
+        if isinstance(self._body, ContentHandler):
+            names = self._body.template_variables()
+            output[self.NAME_BODY] = None if names is None else tuple(sorted(names))
+        return output
+
     def realize(self, context=None):
         """ Return a fully-templated test object, for configuring curl
             Warning: this is a SHALLOW copy, mutation of fields will cause problems!
-            Can accept a None context """
+            Can accept a None context
+
+            The templated copy is cached in the context, and returned again until the context's variables
+            change (its mod_count) or this test's url, headers or body are set again
+            When variables change, only fields using them are templated again, others are reused """
         if not self.is_dynamic() or context is None:
             return self
+
+        key = (self, self._url, self._headers, self._body)
+        cached = context.realized.get(id(self))
+        if cached is None or cached[0] != key:
+            cached = None
+            dependencies = self.template_variables()
+        elif cached[1] == context.mod_count:
+            return cached[2]
         else:
-            selfcopy = self.ninja_copy()
-            selfcopy.templates = None
-            if isinstance(self._body, ContentHandler):
+            dependencies = cached[3]
+
+        # Versions of the variables used by each field, any change to a field with unknown variables counts
+        stamps = dict()
+        for field, names in dependencies.items():
+            stamps[field] = context.mod_count if names is None else context.get_versions(names)
+        previous = None
+        if cached is not None:
+            previous = cached[2]
+            previous_stamps = cached[4]
+
+        selfcopy = self.ninja_copy()
+        selfcopy.templates = None
+        if isinstance(self._body, ContentHandler):
+            if previous is not None and previous_stamps[self.NAME_BODY] == stamps[self.NAME_BODY]:
+                selfcopy._body = previous._body
+                selfcopy._encoded_body = previous._encoded_body  # Reuse the bytes too
+            else:
                 selfcopy._body = self._body.get_content(context)
-            selfcopy._url = self.get_url(context=context)
-            selfcopy._headers = self.get_headers(context=context)
-            return selfcopy
+                selfcopy._encoded_body = None
+        if self.NAME_URL in dependencies:
+            if previous is not None and previous_stamps[self.NAME_URL] == stamps[self.NAME_URL]:
+                selfcopy._url = previous._url
+            else:
+                selfcopy._url = self.get_url(context=context)
+        if self.NAME_HEADERS in dependencies:
+            if previous is not None and previous_stamps[self.NAME_HEADERS] == stamps[self.NAME_HEADERS]:
+                selfcopy._headers = previous._headers
+            else:
+                selfcopy._headers = self.get_headers(context=context)
+        context.realized[id(self)] = (key, context.mod_count, selfcopy, dependencies, stamps)
+        return selfcopy
 
     def realize_partial(self, context=None):
         """ Attempt to template out what is static if possible, and load files.
@@ -283,21 +394,87 @@ class Test(object):
         self.expected_status = [200]
         self.templated = dict()
 
+    def encode_body(self):
+        """ Body to send, with unicode encoded as UTF-8 bytes
+            Returns tuple of (body, True if it was encoded), the encoding is kept and reused while the body is the same """
+        bod = self.body
+        if not isinstance(bod, text_type):
+            return bod, False
+        encoded = self._encoded_body
+        if encoded is None or encoded[0] is not bod:
+            encoded = (bod, bod.encode('UTF-8'))
+            self._encoded_body = encoded
+        return encoded[1], True
+
+    def prepare_curl(self, context=None):
+        """ PreparedCurl with the url, body, authentication, headers and curl options to send
+            For a test without templating (such as a realized one) it is kept and reused until those fields change """
+        key = (self._url, self._headers, self._body, self.auth_username, self.auth_password, self.curl_options)
+        prepared = self._prepared_curl
+        if prepared is not None and prepared.key == key:
+            return prepared
+
+        prepared = PreparedCurl()
+        prepared.key = key
+        prepared.url = str(self.url)
+        bod, is_unicoded = self.encode_body()
+        prepared.body = bod
+        if self.auth_username and self.auth_password:
+            prepared.userpwd = (parsing.encode_unicode_bytes(self.auth_username) + b':' +
+                                parsing.encode_unicode_bytes(self.auth_password))
+
+        # Template headers as needed and convert headers dictionary to list of header entries
+        head = self.get_headers(context=context)
+        head = copy.copy(head)  # We're going to mutate it, need to copy
+
+        # Set charset if doing unicode conversion and not set explicitly
+        # TESTME
+        if is_unicoded and u'content-type' in head.keys():
+            content = head[u'content-type']
+            if u'charset' not in content:
+                head[u'content-type'] = content + u' ; charset=UTF-8'
+
+        if head:
+            headers = [str(headername) + ':' + str(headervalue)
+                       for headername, headervalue in head.items()]
+        else:
+            headers = list()
+        # Fix for expecting 100-continue from server, which not all servers
+        # will send!
+        headers.append("Expect:")
+        prepared.headers = tuple(headers)
+        prepared.closing_headers = prepared.headers + ("Connection: close",)
+
+        # Custom curl options, which are KEY:VALUE pairs matching the pycurl option names
+        options = list()
+        if self.curl_options:
+            filterfunc = lambda x: x[0] is not None and x[1] is not None  # Must have key and value
+            for (key, value) in ifilter(filterfunc, self.curl_options.items()):
+                # getattr to look up constant for variable name
+                options.append((getattr(BASECURL, key), value))
+        prepared.curl_options = tuple(options)
+
+        if not self.is_dynamic():
+            self._prepared_curl = prepared
+        return prepared
+
     def __str__(self):
         return json.dumps(self, default=safe_to_json)
 
-    def configure_curl(self, timeout=DEFAULT_TIMEOUT, context=None, curl_handle=None):
-        """ Create and mostly configure a curl object for test, reusing existing if possible """
+    def configure_curl(self, timeout=DEFAULT_TIMEOUT, context=None, curl_handle=None, curl_share=None,
+                       verbose=False, ssl_insecure=False):
+        """ Create and mostly configure a curl object for test, reusing existing if possible
+            If a CurlShare is given, connections are kept open for reuse, otherwise they are closed
+            Verbose puts curl in verbose mode, and ssl_insecure turns off host and peer cert verification
+
+            A reused handle has a record of the options applied last (see apply_curl_options),
+            so only options that changed are set again, and it is only reset if an option must be unset """
 
         if curl_handle:
             curl = curl_handle
 
             try:  # Check the curl handle isn't closed, and reuse it if possible
-                curl.getinfo(curl.HTTP_CODE)                
-                # Below clears the cookies & curl options for clean run
-                # But retains the DNS cache and connection pool
-                curl.reset()
-                curl.setopt(curl.COOKIELIST, "ALL")
+                curl.getinfo(pycurl.HTTP_CODE)
             except pycurl.error:
                 curl = pycurl.Curl()
             
@@ -305,92 +482,73 @@ class Test(object):
             curl = pycurl.Curl()
 
         # curl.setopt(pycurl.VERBOSE, 1)  # Debugging convenience
-        curl.setopt(curl.URL, str(self.url))
-        curl.setopt(curl.TIMEOUT, timeout)
+        prepared = self.prepare_curl(context=context)
+        options = [(pycurl.URL, prepared.url), (pycurl.TIMEOUT, timeout)]
 
-        is_unicoded = False
-        bod = self.body
-        if isinstance(bod, text_type):  # Encode unicode
-            bod = bod.encode('UTF-8')
-            is_unicoded = True
+        bod = prepared.body
 
         # Set read function for post/put bodies
         if bod and len(bod) > 0:
-            curl.setopt(curl.READFUNCTION, MyIO(bod).read)
+            options.append((pycurl.READFUNCTION, MyIO(bod).read))
 
-        if self.auth_username and self.auth_password:
-            curl.setopt(pycurl.USERPWD, 
-                parsing.encode_unicode_bytes(self.auth_username) + b':' + 
-                parsing.encode_unicode_bytes(self.auth_password))
+        if prepared.userpwd is not None:
+            options.append((pycurl.USERPWD, prepared.userpwd))
             if self.auth_type:
-                curl.setopt(pycurl.HTTPAUTH, self.auth_type)
+                options.append((pycurl.HTTPAUTH, self.auth_type))
 
         if self.method == u'POST':
-            curl.setopt(HTTP_METHODS[u'POST'], 1)
+            options.append((HTTP_METHODS[u'POST'], 1))
             # Required for some servers
             if bod is not None:
-                curl.setopt(pycurl.POSTFIELDSIZE, len(bod))
+                options.append((pycurl.POSTFIELDSIZE, len(bod)))
             else:
-                curl.setopt(pycurl.POSTFIELDSIZE, 0)
+                options.append((pycurl.POSTFIELDSIZE, 0))
         elif self.method == u'PUT':
-            curl.setopt(HTTP_METHODS[u'PUT'], 1)
+            options.append((HTTP_METHODS[u'PUT'], 1))
             # Required for some servers
             if bod is not None:
-                curl.setopt(pycurl.INFILESIZE, len(bod))
+                options.append((pycurl.INFILESIZE, len(bod)))
             else:
-                curl.setopt(pycurl.INFILESIZE, 0)
+                options.append((pycurl.INFILESIZE, 0))
         elif self.method == u'PATCH':
-            curl.setopt(curl.POSTFIELDS, bod)
-            curl.setopt(curl.CUSTOMREQUEST, 'PATCH')
+            options.append((pycurl.POSTFIELDS, bod))
+            options.append((pycurl.CUSTOMREQUEST, 'PATCH'))
             # Required for some servers
             # I wonder: how compatible will this be?  It worked with Django but feels iffy.
             if bod is not None:
-                curl.setopt(pycurl.INFILESIZE, len(bod))
+                options.append((pycurl.INFILESIZE, len(bod)))
             else:
-                curl.setopt(pycurl.INFILESIZE, 0)
+                options.append((pycurl.INFILESIZE, 0))
         elif self.method == u'DELETE':
-            curl.setopt(curl.CUSTOMREQUEST, 'DELETE')
+            options.append((pycurl.CUSTOMREQUEST, 'DELETE'))
             if bod is not None:
-                curl.setopt(pycurl.POSTFIELDS, bod)
-                curl.setopt(pycurl.POSTFIELDSIZE, len(bod))
+                options.append((pycurl.POSTFIELDS, bod))
+                options.append((pycurl.POSTFIELDSIZE, len(bod)))
         elif self.method == u'HEAD':
-            curl.setopt(curl.NOBODY, 1)
-            curl.setopt(curl.CUSTOMREQUEST, 'HEAD')
+            options.append((pycurl.NOBODY, 1))
+            options.append((pycurl.CUSTOMREQUEST, 'HEAD'))
         elif self.method and self.method.upper() != 'GET':  # Alternate HTTP methods
-            curl.setopt(curl.CUSTOMREQUEST, self.method.upper())
+            options.append((pycurl.CUSTOMREQUEST, self.method.upper()))
             if bod is not None:
-                curl.setopt(pycurl.POSTFIELDS, bod)
-                curl.setopt(pycurl.POSTFIELDSIZE, len(bod))
+                options.append((pycurl.POSTFIELDS, bod))
+                options.append((pycurl.POSTFIELDSIZE, len(bod)))
 
-        # Template headers as needed and convert headers dictionary to list of header entries
-        head = self.get_headers(context=context)
-        head = copy.copy(head)  # We're going to mutate it, need to copy
-
-        # Set charset if doing unicode conversion and not set explicitly
-        # TESTME
-        if is_unicoded and u'content-type' in head.keys():
-            content = head[u'content-type']
-            if u'charset' not in content:
-                head[u'content-type'] = content + u' ; charset=UTF-8'
-
-        if head:
-            headers = [str(headername) + ':' + str(headervalue)
-                       for headername, headervalue in head.items()]
+        if curl_share is None:
+            options.append((pycurl.HTTPHEADER, prepared.closing_headers))
+            # Don't keep the connection either, or a multi handle may later try to reuse it after the server closes it
+            options.append((pycurl.FORBID_REUSE, 1))
         else:
-            headers = list()
-        # Fix for expecting 100-continue from server, which not all servers
-        # will send!
-        headers.append("Expect:")
-        headers.append("Connection: close")
-        curl.setopt(curl.HTTPHEADER, headers)
+            options.append((pycurl.HTTPHEADER, prepared.headers))
+            options.append((pycurl.SHARE, curl_share))
 
-        # Set custom curl options, which are KEY:VALUE pairs matching the pycurl option names
-        # And the key/value pairs are set
-        if self.curl_options:
-            filterfunc = lambda x: x[0] is not None and x[1] is not None  # Must have key and value
-            for (key, value) in ifilter(filterfunc, self.curl_options.items()):
-                # getattr to look up constant for variable name
-                curl.setopt(getattr(curl, key), value)
+        # Always set, so a reused handle doesn't keep them from an earlier request
+        options.append((pycurl.VERBOSE, 1 if verbose else 0))
+        options.append((pycurl.SSL_VERIFYPEER, 0 if ssl_insecure else 1))
+        options.append((pycurl.SSL_VERIFYHOST, 0 if ssl_insecure else 2))
+
+        # Set custom curl options
+        options.extend(prepared.curl_options)
+        apply_curl_options(curl, options, is_reused=curl is curl_handle)
         return curl
 
     @classmethod
@@ -0,0 +1,213 @@
+import sys
+import logging
+import pycurl
+
+from . import tests
+from .tests import DEFAULT_TIMEOUT
+from . import benchmarks
+from .benchmarks import METRICS
+
+try:
+    from cStringIO import StringIO as MyIO
+except:
+    try:
+        from StringIO import StringIO as MyIO
+    except ImportError:
+        from io import BytesIO as MyIO
+
+"""
+Transports perform the HTTP request/response step for tests and benchmarks, with many requests in flight
+- Transport: interface, start requests and wait for them to finish
+- PycurlTransport: libcurl via a CurlMulti, the default and supports every test option
+- AsyncioTransport (asynciotransport module): pure-python HTTP/1.1 on an asyncio event loop, Python 3.5+
+
+All return TransportResponse objects with the same response code, headers, body and timing metrics
+"""
+
+logger = logging.getLogger('pyresttest.transports')
+
+
+class TransportResponse(object):
+    """ Response from a request run by a transport """
+    response_code = None
+    headers = None  # Raw header block as bytes, including status line, as sent by the server
+    body = None  # Body as bytes, or None if not collected
+    metrics = None  # Maps benchmark metric name (see benchmarks.METRICS) to value
+    error = None  # Exception if the request failed without a response (network error, timeout)
+
+    def __init__(self):
+        self.metrics = dict()
+
+
+class Transport(object):
+    """ Runs requests for templated tests, several at once
+
+        Use: start() requests, then call wait() to get back completed ones, until in_flight() is 0
+        Transports are not thread-safe, use one per thread or process """
+
+    name = None
+    timeout = DEFAULT_TIMEOUT
+    ssl_insecure = False
+    verbose = False
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, ssl_insecure=False, verbose=False):
+        self.timeout = timeout
+        self.ssl_insecure = ssl_insecure
+        self.verbose = verbose
+
+    def start(self, templated_test, context=None, key=None, metrics=None, collect_body=True):
+        """ Start a request for a templated test, key is returned with its response by wait()
+            metrics is the names of metrics needed in the response (None for all), and
+            if collect_body is False, the headers and body are thrown away """
+        raise NotImplementedError("Transport must implement start")
+
+    def wait(self, max_wait=1.0):
+        """ Run requests for up to max_wait seconds, or until at least one finishes
+            Returns list of (key, TransportResponse) for finished requests """
+        raise NotImplementedError("Transport must implement wait")
+
+    def in_flight(self):
+        """ Number of requests started but not yet returned by wait() """
+        raise NotImplementedError("Transport must implement in_flight")
+
+    def close(self):
+        """ Free any connections and handles held """
+        pass
+
+    def perform(self, templated_test, context=None, metrics=None, collect_body=True):
+        """ Run a single request and return its TransportResponse, blocking until done """
+        self.start(templated_test, context=context, metrics=metrics, collect_body=collect_body)
+        while True:
+            for key, response in self.wait():
+                return response
+
+
+def wait_for_multi(multi, max_wait=1.0):
+    """ Wait for activity on a CurlMulti, for up to max_wait seconds
+        or less if curl needs to handle a timeout sooner (DNS resolution, etc) """
+    curl_timeout = multi.timeout()  # Milliseconds, or -1 if curl has no timeout set
+    if curl_timeout >= 0:
+        max_wait = min(max_wait, curl_timeout / 1000.0)
+    if max_wait > 0:
+        multi.select(max_wait)
+
+
+class PycurlTransport(Transport):
+    """ Runs requests through libcurl on a CurlMulti
+        Curl handles come from curl_pool if given (connection reuse), otherwise they are kept
+        and reused here, starting with any curl_handles given """
+
+    name = u'pycurl'
+    multi = None
+    curl_pool = None
+    idle = None  # Curl handles free for use, if not using a pool
+    running = None  # Maps curl handle to (key, url, metric names, header buffer, body buffer)
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, ssl_insecure=False, verbose=False,
+                 curl_pool=None, curl_handles=None):
+        super(PycurlTransport, self).__init__(timeout=timeout, ssl_insecure=ssl_insecure, verbose=verbose)
+        self.multi = pycurl.CurlMulti()
+        self.curl_pool = curl_pool
+        self.idle = list(curl_handles or [])
+        self.running = dict()
+
+    def start(self, templated_test, context=None, key=None, metrics=None, collect_body=True):
+        curl_share = None
+        if self.curl_pool is not None:
+            curl = self.curl_pool.acquire(templated_test.url)
+            curl_share = self.curl_pool.share
+        else:
+            curl = self.idle.pop() if self.idle else None
+        curl = templated_test.configure_curl(
+            timeout=self.timeout, context=context, curl_handle=curl, curl_share=curl_share,
+            verbose=self.verbose, ssl_insecure=self.ssl_insecure)
+
+        headers = None
+        body = None
+        if collect_body:
+            headers = MyIO()
+            body = MyIO()
+            curl.setopt(pycurl.WRITEFUNCTION, body.write)
+            curl.setopt(pycurl.HEADERFUNCTION, headers.write)
+        else:  # Do not store actual response body at all.
+            curl.setopt(pycurl.WRITEFUNCTION, lambda x: None)
+
+        if metrics is None:
+            metrics = METRICS.keys()
+        metrics = [(name, METRICS[name]) for name in metrics if name in METRICS]
+        self.running[curl] = (key, templated_test.url, metrics, headers, body)
+        self.multi.add_handle(curl)
+
+    def read_response(self, curl, metrics, headers, body):
+        """ Build a TransportResponse from a finished curl handle """
+        response = TransportResponse()
+        response.response_code = curl.getinfo(pycurl.RESPONSE_CODE)
+        if headers is not None:
+            response.headers = headers.getvalue()
+            response.body = body.getvalue()
+            headers.close()
+            body.close()
+        response_metrics = response.metrics
+        for name, info in metrics:
+            response_metrics[name] = curl.getinfo(info)
+        return response
+
+    def wait(self, max_wait=1.0):
+        if not self.running:
+            return list()
+        output = list()
+        waited = False
+
+        while True:
+            # Drive transfers, then collect any that completed
+            ret = pycurl.E_CALL_MULTI_PERFORM
+            while ret == pycurl.E_CALL_MULTI_PERFORM:
+                ret, num_handles = self.multi.perform()
+
+            while True:
+                num_queued, ok_list, err_list = self.multi.info_read()
+                for curl in ok_list:
+                    self.multi.remove_handle(curl)
+                    key, url, metrics, headers, body = self.running.pop(curl)
+                    output.append((key, self.read_response(curl, metrics, headers, body)))
+                    if self.curl_pool is not None:
+                        self.curl_pool.release(url, curl)
+                    else:
+                        self.idle.append(curl)
+                for curl, errno, errmsg in err_list:
+                    self.multi.remove_handle(curl)
+                    key = self.running.pop(curl)[0]
+                    curl.close()
+                    response = TransportResponse()
+                    response.error = pycurl.error(errno, errmsg)
+                    output.append((key, response))
+                if num_queued == 0:
+                    break
+
+            if output or waited:
+                return output
+            wait_for_multi(self.multi, max_wait)
+            waited = True
+
+    def in_flight(self):
+        return len(self.running)
+
+    def close(self):
+        for curl in list(self.running.keys()):
+            self.multi.remove_handle(curl)
+            curl.close()
+        self.running = dict()
+        for curl in self.idle:
+            curl.close()
+        self.idle = list()
+        self.multi.close()
+
+
+# Transports by name, for the transport config option
+TRANSPORTS = {u'pycurl': PycurlTransport}
+
+try:  # Needs asyncio and async/await syntax
+    from . import asynciotransport
+    TRANSPORTS[u'asyncio'] = asynciotransport.AsyncioTransport
+except (ImportError, SyntaxError):
+    logger.debug("asyncio transport not available, requires Python 3.5+")
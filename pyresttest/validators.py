@@ -187,7 +187,7 @@ class AbstractExtractor(object):
     def templated_query(self, context=None):
         query = self.query
         if context and self.is_templated:
-            query = string.Template(query).safe_substitute(
+            query = parsing.get_template(query).safe_substitute(
                 context.get_values())
         return query
 
@@ -212,6 +212,7 @@ class AbstractExtractor(object):
                 config = config['template']
                 extractor_base.is_templated = True
                 extractor_base.query = config
+                parsing.get_template(config)  # Compile once, up front
             except KeyError:
                 raise ValueError(
                     "Cannot define a dictionary config for abstract extractor without it having template key")
@@ -370,7 +371,7 @@ class ComparatorValidator(AbstractValidator):
                 trace = traceback.format_exc()
                 return Failure(message="Expected value extractor threw exception", details=trace, validator=self, failure_type=FAILURE_EXTRACTOR_EXCEPTION)
         elif self.isTemplateExpected and context:
-            expected_val = string.Template(
+            expected_val = parsing.get_template(
                 self.expected).safe_substitute(context.get_values())
         else:
             expected_val = self.expected
@@ -440,6 +441,7 @@ class ComparatorValidator(AbstractValidator):
                         "Can't template a comparator-validator unless template value is a string")
                 output.isTemplateExpected = True
                 output.expected = template
+                parsing.get_template(template)  # Compile once, up front
             else:  # Extractor to compare against
                 output.expected = _get_extractor(expected)
                 if not output.expected:
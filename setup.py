@@ -37,7 +37,10 @@ setup(name='pyresttest',
       ],
       py_modules=['pyresttest.resttest', 'pyresttest.generators', 'pyresttest.binding',
                   'pyresttest.parsing', 'pyresttest.validators', 'pyresttest.contenthandling',
-                  'pyresttest.benchmarks', 'pyresttest.tests', 
+                  'pyresttest.benchmarks', 'pyresttest.tests', 'pyresttest.scheduling',
+                  'pyresttest.connections', 'pyresttest.transports', 'pyresttest.asynciotransport',
+                  'pyresttest.distributed', 'pyresttest.histogram', 'pyresttest.baseline',
+                  'pyresttest.intervals', 'pyresttest.history',
                   'pyresttest.six',
                   'pyresttest.ext.validator_jsonschema',
                   'pyresttest.ext.extractor_jmespath'],
@@ -46,9 +49,10 @@ setup(name='pyresttest',
       tests_require=test_dependencies,
       extras_require= {
         'JSONSchema': ['jsonschema'],
-        'JMESPath': ['jmespath']
+        'JMESPath': ['jmespath'],
+        'NumPy': ['numpy']
       },
       # Make this executable from command line when installed
-      scripts=['util/pyresttest', 'util/resttest.py'],
+      scripts=['util/pyresttest', 'util/resttest.py', 'util/pyresttest-history'],
       provides=['pyresttest']
       )